@@ -2,11 +2,18 @@ import sys
 import os
 import datetime as dt
 import json
+import functools
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
+from multiprocessing.util import Finalize
 from skyrim.whiterun import CCalendar, CInstrumentInfoTable
 from skyrim.winterhold import check_and_mkdir
 from skyrim.falkreath import CManagerLibReader, CTable
-from xfuns import cal_features_and_return_one_day
+from dp_m01_cache import CM01Cache
+from xlibs import CManagerLibParquet, features_and_return_parquet_name
+from xfuns import cal_features_and_return_one_day_np
+from xfuns import cal_features_and_return_tensor, features_and_return_to_table, m01_tensor_fields
 
 
 def split_spot_daily_k(equity_index_by_instrument_dir: str, equity_indexes: list[str]):
@@ -21,35 +28,10 @@ def split_spot_daily_k(equity_index_by_instrument_dir: str, equity_indexes: list
     return 0
 
 
-def cal_features_and_return(bgn_date: str, stp_date: str,
-                            equity_indexes: list[str],
-                            calendar_path: str, futures_instru_info_path: str,
-                            equity_index_by_instrument_dir: str,
-                            md_by_instru_dir: str,
-                            futures_md_structure_path: str,
-                            futures_em01_db_name: str,
-                            futures_md_dir: str,
-                            major_minor_dir: str,
-                            research_features_and_return_dir: str,
-                            verbose: bool = False
-                            ):
-    im_bgn_date = "20220722"
-    id_cols = ["timestamp", "loc_id", "instrument", "exchange", "wind_code"]
-    val_cols = [
-        "open", "high", "low", "close",
-        "volume", "amount", "oi",
-        "daily_open", "daily_high", "daily_low",
-        "preclose", "preoi",
-    ]
-    m01_columns = id_cols + val_cols
-
-    # --- load calendar
-    calendar = CCalendar(calendar_path)
-
-    # --- load instru info table
-    instru_info_table = CInstrumentInfoTable(t_path=futures_instru_info_path, t_index_label="windCode", t_type="CSV")
-
-    # --- spot and futures manager
+def load_spot_and_futures_managers(equity_indexes: list[str],
+                                   equity_index_by_instrument_dir: str,
+                                   md_by_instru_dir: str,
+                                   major_minor_dir: str):
     spot_data_manager, futures_md_manager, major_minor_manager = {}, {}, {}
     for equity_index_code, equity_instru_id in equity_indexes:
         spot_data_file = "{}.csv".format(equity_index_code)
@@ -68,54 +50,386 @@ def cal_features_and_return(bgn_date: str, stp_date: str,
         major_minor_manager[equity_instru_id] = major_minor_df
 
         print("... {}:{} spot and futures data loaded @ {}".format(equity_index_code, equity_instru_id, dt.datetime.now()))
+    return spot_data_manager, futures_md_manager, major_minor_manager
+
+
+def load_features_and_return_env(equity_indexes: list[str],
+                                  calendar_path: str, futures_instru_info_path: str,
+                                  equity_index_by_instrument_dir: str,
+                                  md_by_instru_dir: str,
+                                  futures_md_structure_path: str,
+                                  futures_em01_db_name: str,
+                                  futures_md_dir: str,
+                                  major_minor_dir: str,
+                                  m01_cache_dir: str | None = None,
+                                  ) -> dict:
+    # --- load calendar
+    calendar = CCalendar(calendar_path)
+
+    # --- load instru info table
+    instru_info_table = CInstrumentInfoTable(t_path=futures_instru_info_path, t_index_label="windCode", t_type="CSV")
+
+    # --- spot and futures manager
+    spot_data_manager, futures_md_manager, major_minor_manager = load_spot_and_futures_managers(
+        equity_indexes=equity_indexes,
+        equity_index_by_instrument_dir=equity_index_by_instrument_dir,
+        md_by_instru_dir=md_by_instru_dir,
+        major_minor_dir=major_minor_dir,
+    )
 
-    # --- init lib writer
+    # --- init lib reader
     with open(futures_md_structure_path, "r") as j:
         m01_table_struct = json.load(j)[futures_em01_db_name]["CTable"]
     m01_table = CTable(t_table_struct=m01_table_struct)
     m01_db = CManagerLibReader(t_db_save_dir=futures_md_dir, t_db_name=futures_em01_db_name + ".db")
     m01_db.set_default(m01_table.m_table_name)
+    m01_cache = None if m01_cache_dir is None else CM01Cache(m01_cache_dir, major_minor_dir=major_minor_dir)
 
-    # --- main loop
-    for trade_date in calendar.get_iter_list(bgn_date, stp_date, True):
-        prev_date = calendar.get_next_date(trade_date, -1)
+    return {
+        "equity_indexes": equity_indexes,
+        "calendar": calendar,
+        "instru_info_table": instru_info_table,
+        "spot_data_manager": spot_data_manager,
+        "futures_md_manager": futures_md_manager,
+        "major_minor_manager": major_minor_manager,
+        "m01_db": m01_db,
+        "m01_cache": m01_cache,
+    }
+
+
+def cal_features_and_return_for_date(trade_date: str,
+                                     equity_indexes: list[str],
+                                     calendar: CCalendar,
+                                     instru_info_table: CInstrumentInfoTable,
+                                     spot_data_manager: dict[str, pd.DataFrame],
+                                     futures_md_manager: dict[str, pd.DataFrame],
+                                     major_minor_manager: dict[str, pd.DataFrame],
+                                     m01_db: CManagerLibReader,
+                                     m01_cache: CM01Cache | None = None,
+                                     sub_win_width: int = 30,
+                                     ) -> list[tuple[str, pd.DataFrame]]:
+    """
+
+    :param m01_cache: if provided, minute bars are sliced from this store instead of read from m01_db
+    :param sub_win_width: minutes between two checkpoints
+    :return: a list of (instrument, features and return), empty if there is no minute bar at this date
+    """
+    im_bgn_date = "20220722"
+    id_cols = ["timestamp", "loc_id", "instrument", "exchange", "wind_code"]
+    val_cols = [
+        "open", "high", "low", "close",
+        "volume", "amount", "oi",
+        "daily_open", "daily_high", "daily_low",
+        "preclose", "preoi",
+    ]
+    m01_columns = id_cols + val_cols
+
+    res = []
+    prev_date = calendar.get_next_date(trade_date, -1)
+    if m01_cache is None:
         m01_df = m01_db.read_by_date(t_trade_date=trade_date, t_value_columns=m01_columns)
         if len(m01_df) == 0:
+            return res
+    elif not m01_cache.has_data(trade_date):
+        return res
+
+    for equity_index_code, equity_instru_id in equity_indexes:
+        if (trade_date <= im_bgn_date) and (equity_instru_id == "IM.CFE"):
             continue
+        try:
+            major_contract = major_minor_manager[equity_instru_id].at[trade_date, "n_contract"]
+            pre_settle = futures_md_manager[equity_instru_id].at[prev_date, major_contract]
+            pre_spot_close = spot_data_manager[equity_instru_id].at[prev_date, "close"]
+        except KeyError:
+            print(equity_instru_id, "does not have major contract @ ", trade_date)
+            sys.exit()
+        if m01_cache is None:
+            major_contract_m01_df = m01_df.loc[m01_df.wind_code == major_contract].reset_index(drop=True)
+            num_of_bars = len(major_contract_m01_df)
+        else:
+            m01_tensor, cached_contracts, bar_num = m01_cache.get_bars([trade_date], equity_instru_id)
+            m01_cache.check_contracts([trade_date], equity_instru_id, [major_contract], cached_contracts)
+            num_of_bars = bar_num[0]
+        if num_of_bars != 240:
+            print("Error! Number of bars = {} @ {} for {} - {}".format(
+                num_of_bars, trade_date, equity_instru_id, major_contract))
+            sys.exit()
 
-        check_and_mkdir(save_year_dir := os.path.join(research_features_and_return_dir, trade_date[0:4]))
-        check_and_mkdir(save_date_dir := os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date))
+        contract_multiplier = instru_info_table.get_multiplier(equity_instru_id)
+        if m01_cache is None:
+            features_and_ret_df = cal_features_and_return_one_day_np(
+                m01=major_contract_m01_df,
+                instrument=equity_instru_id, contract=major_contract, contract_multiplier=contract_multiplier,
+                pre_settle=pre_settle, pre_spot_close=pre_spot_close,
+                sub_win_width=sub_win_width)
+        else:
+            # same as cal_features_and_return_one_day_np, bars of this date are a view of the store
+            ans = cal_features_and_return_tensor(
+                m01_tensor=m01_tensor, contract_multiplier=contract_multiplier,
+                pre_settle=pre_settle, pre_spot_close=pre_spot_close,
+                sub_win_width=sub_win_width)
+            features_and_ret_df = features_and_return_to_table(
+                t_ans=ans, trade_dates=None, instrument=equity_instru_id, contracts=[major_contract])
+            features_and_ret_df.index = range(1, len(features_and_ret_df) + 1)
+        res.append((equity_instru_id, features_and_ret_df))
+    return res
+
+
+def save_features_and_return_for_date(trade_date: str, features_and_return: list[tuple[str, pd.DataFrame]],
+                                      research_features_and_return_dir: str,
+                                      features_and_return_lib: CManagerLibParquet | None = None):
+    """
+
+    :param trade_date:
+    :param features_and_return: output of cal_features_and_return_for_date
+    :param research_features_and_return_dir:
+    :param features_and_return_lib: if provided, features are appended to this lib instead of saved as csv
+    :return:
+    """
+    if features_and_return_lib is not None:
+        features_and_return_df = pd.concat([df for _, df in features_and_return], axis=0, ignore_index=True)
+        features_and_return_df.insert(0, "trade_date", trade_date)
+        features_and_return_lib.append(features_and_return_df)
+        return 0
+
+    check_and_mkdir(os.path.join(research_features_and_return_dir, trade_date[0:4]))
+    check_and_mkdir(save_date_dir := os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date))
+    for equity_instru_id, features_and_ret_df in features_and_return:
+        features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
+        features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
+        features_and_ret_df.to_csv(features_and_return_path, index=False, float_format="%.6f")
+    return 0
+
+
+# --- lookup tables and em01 reader of a pool worker, loaded once by the initializer
+_worker_env = {}
+
+
+def _init_features_and_return_worker(env_kwargs: dict):
+    _worker_env.update(load_features_and_return_env(**env_kwargs))
+    Finalize(None, _worker_env["m01_db"].close, exitpriority=16)
+    return 0
+
+
+def _process_target_fun_for_features_and_return(trade_date: str, sub_win_width: int) -> list[tuple[str, pd.DataFrame]] | None:
+    # sys.exit in a pool worker would kill the worker and hang the pool, so None is returned instead
+    try:
+        return cal_features_and_return_for_date(trade_date, sub_win_width=sub_win_width, **_worker_env)
+    except SystemExit:
+        return None
+
+
+def cal_features_and_return(bgn_date: str, stp_date: str,
+                            equity_indexes: list[str],
+                            calendar_path: str, futures_instru_info_path: str,
+                            equity_index_by_instrument_dir: str,
+                            md_by_instru_dir: str,
+                            futures_md_structure_path: str,
+                            futures_em01_db_name: str,
+                            futures_md_dir: str,
+                            major_minor_dir: str,
+                            research_features_and_return_dir: str,
+                            sub_win_width: int = 30,
+                            proc_num: int = 1,
+                            m01_cache_dir: str | None = None,
+                            sink: str = "csv",
+                            verbose: bool = False
+                            ):
+    """
+
+    :param sub_win_width: minutes between two checkpoints, 5 at least
+    :param proc_num: number of worker processes, trade dates are sharded across them if > 1,
+                     each worker loads the lookup tables and opens em01 once,
+                     results come back and are saved in the order of trade dates
+    :param m01_cache_dir: if provided, minute bars are sliced from the store made by
+                          dp_m01_cache.export_m01_cache instead of read from em01 day by day,
+                          each worker opens the store once
+    :param sink: "csv" for one csv.gz file for each date and instrument,
+                 "parquet" for features_and_return.parquet partitioned by month, no dp_01 is needed then
+    """
+    env_kwargs = {
+        "equity_indexes": equity_indexes,
+        "calendar_path": calendar_path,
+        "futures_instru_info_path": futures_instru_info_path,
+        "equity_index_by_instrument_dir": equity_index_by_instrument_dir,
+        "md_by_instru_dir": md_by_instru_dir,
+        "futures_md_structure_path": futures_md_structure_path,
+        "futures_em01_db_name": futures_em01_db_name,
+        "futures_md_dir": futures_md_dir,
+        "major_minor_dir": major_minor_dir,
+        "m01_cache_dir": m01_cache_dir,
+    }
+
+    features_and_return_lib = CManagerLibParquet(
+        t_lib_dir=os.path.join(research_features_and_return_dir, features_and_return_parquet_name)
+    ) if sink == "parquet" else None
+
+    # --- main loop
+    if proc_num <= 1:
+        env = load_features_and_return_env(**env_kwargs)
+        for trade_date in env["calendar"].get_iter_list(bgn_date, stp_date, True):
+            if res := cal_features_and_return_for_date(trade_date, sub_win_width=sub_win_width, **env):
+                save_features_and_return_for_date(trade_date, res, research_features_and_return_dir, features_and_return_lib)
+            if verbose:
+                print("... features and return are calculated for {}".format(trade_date))
+
+        # --- close lib
+        env["m01_db"].close()
+    else:
+        iter_dates = CCalendar(calendar_path).get_iter_list(bgn_date, stp_date, True)
+        target_fun = functools.partial(_process_target_fun_for_features_and_return, sub_win_width=sub_win_width)
+        with mp.Pool(processes=proc_num, initializer=_init_features_and_return_worker, initargs=(env_kwargs,)) as pool:
+            for trade_date, res in zip(iter_dates, pool.imap(target_fun, iter_dates)):
+                if res is None:
+                    print("... this program will terminate at once, please check again")
+                    pool.terminate()
+                    sys.exit()
+                if res:
+                    save_features_and_return_for_date(trade_date, res, research_features_and_return_dir, features_and_return_lib)
+                if verbose:
+                    print("... features and return are calculated for {}".format(trade_date))
+            pool.close()
+            pool.join()
+
+    if features_and_return_lib is not None:
+        features_and_return_lib.close()
+    return 0
+
+
+def cal_features_and_return_batch(bgn_date: str, stp_date: str,
+                                  equity_indexes: list[str],
+                                  calendar_path: str, futures_instru_info_path: str,
+                                  equity_index_by_instrument_dir: str,
+                                  md_by_instru_dir: str,
+                                  futures_md_structure_path: str,
+                                  futures_em01_db_name: str,
+                                  futures_md_dir: str,
+                                  major_minor_dir: str,
+                                  research_features_and_return_dir: str,
+                                  sub_win_width: int = 30,
+                                  days_per_chunk: int = 60,
+                                  m01_cache_dir: str | None = None,
+                                  sink: str = "csv",
+                                  verbose: bool = False
+                                  ) -> pd.DataFrame:
+    """
+    batch version of cal_features_and_return, minute bars of major contracts are loaded
+    into a (days x 240 x fields) array per instrument, one chunk of days at a time,
+    and features of all days and tids are calculated by cal_features_and_return_tensor at once.
+    Output files are the same as cal_features_and_return.
+
+    :param sub_win_width: minutes between two checkpoints, 5 at least
+    :param days_per_chunk: number of trade dates loaded from em01 by one query
+    :param m01_cache_dir: if provided, minute bars are sliced from the store made by
+                          dp_m01_cache.export_m01_cache instead of loaded from em01
+    :param sink: "csv" or "parquet", same as cal_features_and_return
+    :return: a single feature table of all dates and instruments, with column "trade_date"
+    """
+    im_bgn_date = "20220722"
+    tot_bar_num = 240
+    id_cols = ["trade_date", "timestamp", "wind_code"]
+
+    env = load_features_and_return_env(
+        equity_indexes=equity_indexes,
+        calendar_path=calendar_path, futures_instru_info_path=futures_instru_info_path,
+        equity_index_by_instrument_dir=equity_index_by_instrument_dir,
+        md_by_instru_dir=md_by_instru_dir,
+        futures_md_structure_path=futures_md_structure_path,
+        futures_em01_db_name=futures_em01_db_name,
+        futures_md_dir=futures_md_dir,
+        major_minor_dir=major_minor_dir,
+        m01_cache_dir=m01_cache_dir,
+    )
+    calendar, instru_info_table, m01_db, m01_cache = env["calendar"], env["instru_info_table"], env["m01_db"], env["m01_cache"]
+    spot_data_manager, futures_md_manager, major_minor_manager = \
+        env["spot_data_manager"], env["futures_md_manager"], env["major_minor_manager"]
+
+    # --- main loop
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    res_dfs = []
+    for chunk_bgn in range(0, len(iter_dates), days_per_chunk):
+        chunk_dates = iter_dates[chunk_bgn:chunk_bgn + days_per_chunk]
+        if m01_cache is None:
+            m01_df = m01_db.read_by_conditions(
+                t_conditions=[
+                    ("trade_date", ">=", chunk_dates[0]),
+                    ("trade_date", "<=", chunk_dates[-1]),
+                ],
+                t_value_columns=id_cols + [_ for _ in m01_tensor_fields if _ != "timestamp"]
+            )
+            data_dates = list(filter(set(m01_df["trade_date"]).__contains__, chunk_dates))
+        else:
+            data_dates = list(filter(m01_cache.has_data, chunk_dates))
+        if len(data_dates) == 0:
+            continue
 
         for equity_index_code, equity_instru_id in equity_indexes:
-            if (trade_date <= im_bgn_date) and (equity_instru_id == "IM.CFE"):
+            trade_dates = [_ for _ in data_dates if not ((_ <= im_bgn_date) and (equity_instru_id == "IM.CFE"))]
+            if len(trade_dates) == 0:
                 continue
-            try:
-                major_contract = major_minor_manager[equity_instru_id].at[trade_date, "n_contract"]
-                pre_settle = futures_md_manager[equity_instru_id].at[prev_date, major_contract]
-                pre_spot_close = spot_data_manager[equity_instru_id].at[prev_date, "close"]
-            except KeyError:
-                print(equity_instru_id, "does not have major contract @ ", trade_date)
-                sys.exit()
-            major_contract_m01_df = m01_df.loc[m01_df.wind_code == major_contract].reset_index(drop=True)
-            if (num_of_bars := len(major_contract_m01_df)) != 240:
+            major_contracts, pre_settle, pre_spot_close = [], [], []
+            for trade_date in trade_dates:
+                prev_date = calendar.get_next_date(trade_date, -1)
+                try:
+                    major_contract = major_minor_manager[equity_instru_id].at[trade_date, "n_contract"]
+                    pre_settle.append(futures_md_manager[equity_instru_id].at[prev_date, major_contract])
+                    pre_spot_close.append(spot_data_manager[equity_instru_id].at[prev_date, "close"])
+                except KeyError:
+                    print(equity_instru_id, "does not have major contract @ ", trade_date)
+                    sys.exit()
+                major_contracts.append(major_contract)
+
+            if m01_cache is None:
+                major_df = pd.DataFrame({"trade_date": trade_dates, "wind_code": major_contracts})
+                major_m01_df = pd.merge(left=major_df, right=m01_df, on=["trade_date", "wind_code"], how="inner")
+                num_of_bars = major_m01_df.groupby("trade_date").size().reindex(trade_dates, fill_value=0).values
+            else:
+                m01_tensor, cached_contracts, num_of_bars = m01_cache.get_bars(trade_dates, equity_instru_id)
+                m01_cache.check_contracts(trade_dates, equity_instru_id, major_contracts, cached_contracts)
+            if (num_of_bars != tot_bar_num).any():
+                bad_loc = np.flatnonzero(num_of_bars != tot_bar_num)[0]
                 print("Error! Number of bars = {} @ {} for {} - {}".format(
-                    num_of_bars, trade_date, equity_instru_id, major_contract))
+                    num_of_bars[bad_loc], trade_dates[bad_loc], equity_instru_id, major_contracts[bad_loc]))
                 sys.exit()
+            if m01_cache is None:
+                major_m01_df = major_m01_df.sort_values(by=["trade_date", "timestamp"])
+                m01_tensor = major_m01_df[list(m01_tensor_fields)].to_numpy(dtype=np.float64).reshape(
+                    len(trade_dates), tot_bar_num, len(m01_tensor_fields))
 
-            contract_multiplier = instru_info_table.get_multiplier(equity_instru_id)
-            features_and_ret_df = cal_features_and_return_one_day(
-                m01=major_contract_m01_df,
-                instrument=equity_instru_id, contract=major_contract, contract_multiplier=contract_multiplier,
-                pre_settle=pre_settle, pre_spot_close=pre_spot_close)
-
-            features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
-            features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
-            features_and_ret_df.to_csv(features_and_return_path, index=False, float_format="%.6f")
+            ans = cal_features_and_return_tensor(
+                m01_tensor=m01_tensor,
+                contract_multiplier=instru_info_table.get_multiplier(equity_instru_id),
+                pre_settle=np.array(pre_settle, dtype=np.float64),
+                pre_spot_close=np.array(pre_spot_close, dtype=np.float64),
+                sub_win_width=sub_win_width, tot_bar_num=tot_bar_num)
+            res_dfs.append(features_and_return_to_table(
+                t_ans=ans, trade_dates=trade_dates, instrument=equity_instru_id, contracts=major_contracts))
 
         if verbose:
-            print("... features and return are calculated for {}".format(trade_date))
+            print("... features and return are calculated from {} to {}".format(chunk_dates[0], chunk_dates[-1]))
 
     # --- close lib
     m01_db.close()
 
-    return 0
+    if len(res_dfs) == 0:
+        return pd.DataFrame()
+    features_and_return_df = pd.concat(res_dfs, axis=0, ignore_index=True).sort_values(
+        by=["trade_date", "instrument", "tid"], ignore_index=True)
+
+    # --- save
+    if sink == "parquet":
+        features_and_return_lib = CManagerLibParquet(
+            t_lib_dir=os.path.join(research_features_and_return_dir, features_and_return_parquet_name))
+        features_and_return_lib.append(features_and_return_df)
+        features_and_return_lib.close()
+    else:
+        # one file for each date and instrument, same as cal_features_and_return
+        for (trade_date, equity_instru_id), features_and_ret_df in features_and_return_df.groupby(["trade_date", "instrument"]):
+            check_and_mkdir(os.path.join(research_features_and_return_dir, trade_date[0:4]))
+            check_and_mkdir(save_date_dir := os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date))
+            features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
+            features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
+            features_and_ret_df.drop(labels="trade_date", axis=1).to_csv(features_and_return_path, index=False, float_format="%.6f")
+
+    print("... @ {}, features and return are calculated from {} to {}".format(dt.datetime.now(), bgn_date, stp_date))
+    return features_and_return_df
@@ -1,5 +1,8 @@
 import os
 import datetime as dt
+import multiprocessing as mp
+import functools
+import sqlite3
 import pandas as pd
 from skyrim.falkreath import CManagerLibWriterByDate, CTable
 from skyrim.whiterun import CCalendar
@@ -60,4 +63,150 @@ def convert_csv_to_sqlite3(run_mode: str, bgn_date: str, stp_date: str,
         print("... @ {0}, features and return of {1} converted to sqlite3".format(dt.datetime.now(), trade_date))
 
     features_and_return_lib.close()
+    build_features_and_return_indexes(research_features_and_return_dir, sqlite3_tables)
+    return 0
+
+
+def build_features_and_return_indexes(research_features_and_return_dir: str, sqlite3_tables):
+    """
+    indexes in sqlite3_tables["features_and_return"]["indexes"] serve
+    the conditions of instrument, tid and a range of trade_date used by ml_*
+
+    """
+    features_and_return_struct = sqlite3_tables["features_and_return"]
+    connection = sqlite3.connect(os.path.join(research_features_and_return_dir, "features_and_return.db"))
+    cursor = connection.cursor()
+    for index_name, index_columns in features_and_return_struct.get("indexes", {}).items():
+        cursor.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+            index_name, features_and_return_struct["table_name"], ", ".join(index_columns)))
+        print("... @ {0}, index {1} is built".format(dt.datetime.now(), index_name))
+    cursor.execute("ANALYZE")
+    connection.commit()
+    connection.close()
+    return 0
+
+
+# --- bulk load
+bulk_load_pragmas = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -524288",  # 512MB
+)
+
+
+def _read_features_and_return_rows(trade_date: str, research_features_and_return_dir: str,
+                                   equity_indexes, columns: list[str]) -> list[tuple]:
+    save_date_dir = os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date)
+    rows = []
+    for equity_index_code, equity_instru_id in equity_indexes:
+        if trade_date <= "20220722" and equity_instru_id == "IM.CFE":
+            continue
+
+        features_and_return_file = "{}-{}-features_and_return.csv.gz".format(trade_date, equity_instru_id)
+        features_and_return_path = os.path.join(save_date_dir, features_and_return_file)
+        features_and_ret_df = pd.read_csv(features_and_return_path, dtype={"trade_date": str, "timestamp": int})
+        features_and_ret_df.insert(0, "trade_date", trade_date)
+        rows += features_and_ret_df[columns].astype(object).itertuples(index=False, name=None)
+    return rows
+
+
+def init_features_and_return_table(run_mode: str, research_features_and_return_dir: str, sqlite3_tables) -> tuple[list[str], str]:
+    """
+    initialize table by skyrim, to keep the same schema as convert_csv_to_sqlite3
+
+    :return: columns of rows from _read_features_and_return_rows, and the sql to insert them
+    """
+    features_and_return_struct = sqlite3_tables["features_and_return"]
+    features_and_return_lib = CManagerLibWriterByDate(
+        t_db_save_dir=research_features_and_return_dir,
+        t_db_name="features_and_return.db"
+    )
+    features_and_return_tab = CTable(t_table_struct=features_and_return_struct)
+    features_and_return_lib.initialize_table(
+        t_table=features_and_return_tab,
+        t_remove_existence=run_mode.upper() in ["O", "OVERWRITE"]
+    )
+    features_and_return_lib.close()
+
+    columns = list(features_and_return_struct["primary_keys"]) + list(features_and_return_struct["value_columns"])
+    insert_sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+        features_and_return_struct["table_name"], ", ".join(columns), ", ".join(["?"] * len(columns)))
+    return columns, insert_sql
+
+
+def convert_csv_to_sqlite3_bulk(run_mode: str, bgn_date: str, stp_date: str,
+                                calendar_path: str,
+                                research_features_and_return_dir: str,
+                                equity_indexes,
+                                sqlite3_tables,
+                                days_per_commit: int = 250,
+                                proc_num: int = 5,
+                                ):
+    """
+    same result as convert_csv_to_sqlite3, but for a long history:
+    csv files are read by a pool of proc_num processes, while the main process is the only writer,
+    which inserts rows with executemany and commits once every days_per_commit days.
+    Pragmas in bulk_load_pragmas are used for this connection only, and indexes
+    in sqlite3_tables[...]["indexes"] are dropped before loading and built after loading.
+
+    :param run_mode: must be one of ['o', 'overwrite', 'a', 'append']
+    :param bgn_date: begin date, format = [YYYYMMDD]
+    :param stp_date: stop date, format = [YYYYMMDD]
+    :param calendar_path:
+    :param research_features_and_return_dir:
+    :param equity_indexes:
+    :param sqlite3_tables:
+    :param days_per_commit:
+    :param proc_num:
+    :return:
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendar(calendar_path)
+    trade_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    if len(trade_dates) == 0:
+        print("... @ {0}, there is no trade date in [{1}, {2}), nothing is converted".format(dt.datetime.now(), bgn_date, stp_date))
+        return 0
+
+    # --- single writer
+    columns, insert_sql = init_features_and_return_table(run_mode, research_features_and_return_dir, sqlite3_tables)
+    features_and_return_struct = sqlite3_tables["features_and_return"]
+    table_name = features_and_return_struct["table_name"]
+    indexes = features_and_return_struct.get("indexes", {})
+
+    connection = sqlite3.connect(os.path.join(research_features_and_return_dir, "features_and_return.db"))
+    cursor = connection.cursor()
+    for pragma in bulk_load_pragmas:
+        cursor.execute(pragma)
+    for index_name in indexes:
+        cursor.execute("DROP INDEX IF EXISTS {}".format(index_name))
+    if run_mode.upper() in ["A", "APPEND"]:
+        cursor.execute("DELETE FROM {} WHERE trade_date >= ? AND trade_date <= ?".format(table_name),
+                       (trade_dates[0], trade_dates[-1]))
+    connection.commit()
+
+    # --- parallel readers, results come back in the order of trade dates
+    read_rows = functools.partial(
+        _read_features_and_return_rows,
+        research_features_and_return_dir=research_features_and_return_dir,
+        equity_indexes=equity_indexes,
+        columns=columns,
+    )
+    with mp.Pool(processes=proc_num) as pool:
+        for i, rows in enumerate(pool.imap(read_rows, trade_dates, chunksize=5)):
+            cursor.executemany(insert_sql, rows)
+            if (i + 1) % days_per_commit == 0 or (i + 1) == len(trade_dates):
+                connection.commit()
+                print("... @ {0}, features and return to {1} converted to sqlite3".format(dt.datetime.now(), trade_dates[i]))
+
+    # with locking_mode = EXCLUSIVE, the lock is kept until the cursor is closed too
+    cursor.close()
+    connection.close()
+
+    # --- build indexes after loading
+    build_features_and_return_indexes(research_features_and_return_dir, sqlite3_tables)
     return 0
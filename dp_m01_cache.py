@@ -0,0 +1,195 @@
+"""
+minute bars of major contracts are exported from em01 once and saved as
+
+    m01.bars.npy:  float64, shape = (dates, instruments, 240, len(m01_tensor_fields)), NaN if no data
+    m01.index.csv: trade_date, instrument, contract, bar_num, one row for each (date, instrument)
+    m01.meta.json: bgn_date, stp_date and mtime of the major_minor file of each instrument when exported,
+                   so a store made before a roll update of major_minor could be refused
+
+so feature jobs could read zero-copy slices by np.load(mmap_mode="r") instead of sqlite queries.
+"""
+
+import os
+import sys
+import json
+import datetime as dt
+import numpy as np
+import pandas as pd
+from skyrim.whiterun import CCalendar
+from skyrim.falkreath import CManagerLibReader, CTable
+from xfuns import m01_tensor_fields
+
+
+def export_m01_cache(bgn_date: str, stp_date: str,
+                     equity_indexes: list[str],
+                     calendar_path: str,
+                     futures_md_structure_path: str,
+                     futures_em01_db_name: str,
+                     futures_md_dir: str,
+                     major_minor_dir: str,
+                     m01_cache_dir: str,
+                     days_per_chunk: int = 60,
+                     tot_bar_num: int = 240,
+                     ):
+    """
+
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD]
+    :param equity_indexes:
+    :param calendar_path:
+    :param futures_md_structure_path:
+    :param futures_em01_db_name:
+    :param futures_md_dir:
+    :param major_minor_dir:
+    :param m01_cache_dir:
+    :param days_per_chunk: number of trade dates loaded from em01 by one query
+    :param tot_bar_num:
+    :return:
+    """
+    calendar = CCalendar(calendar_path)
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    instruments = [equity_instru_id for _, equity_instru_id in equity_indexes]
+
+    # --- major contracts
+    major_contracts = pd.DataFrame(index=iter_dates, columns=instruments, dtype=object)
+    for equity_instru_id in instruments:
+        major_minor_file = "major_minor.{}.csv.gz".format(equity_instru_id)
+        major_minor_path = os.path.join(major_minor_dir, major_minor_file)
+        major_minor_df = pd.read_csv(major_minor_path, dtype=str).set_index("trade_date")
+        major_contracts[equity_instru_id] = major_minor_df["n_contract"].reindex(iter_dates)
+
+    # --- init lib reader
+    with open(futures_md_structure_path, "r") as j:
+        m01_table_struct = json.load(j)[futures_em01_db_name]["CTable"]
+    m01_table = CTable(t_table_struct=m01_table_struct)
+    m01_db = CManagerLibReader(t_db_save_dir=futures_md_dir, t_db_name=futures_em01_db_name + ".db")
+    m01_db.set_default(m01_table.m_table_name)
+
+    # --- init store
+    bars_path = os.path.join(m01_cache_dir, "m01.bars.npy")
+    bars = np.lib.format.open_memmap(
+        bars_path, mode="w+", dtype=np.float64,
+        shape=(len(iter_dates), len(instruments), tot_bar_num, len(m01_tensor_fields)))
+    bars[...] = np.nan
+    bar_num = np.zeros(shape=(len(iter_dates), len(instruments)), dtype=int)
+
+    for chunk_bgn in range(0, len(iter_dates), days_per_chunk):
+        chunk_dates = iter_dates[chunk_bgn:chunk_bgn + days_per_chunk]
+        m01_df = m01_db.read_by_conditions(
+            t_conditions=[
+                ("trade_date", ">=", chunk_dates[0]),
+                ("trade_date", "<=", chunk_dates[-1]),
+            ],
+            t_value_columns=["trade_date", "wind_code"] + list(m01_tensor_fields)
+        )
+        major_df = pd.DataFrame({
+            "trade_date": np.repeat(chunk_dates, len(instruments)),
+            "instrument": np.tile(instruments, len(chunk_dates)),
+            "wind_code": major_contracts.loc[chunk_dates].to_numpy().flatten(),
+        }).dropna(axis=0, subset=["wind_code"])
+        major_m01_df = pd.merge(left=major_df, right=m01_df, on=["trade_date", "wind_code"], how="inner")
+        for (trade_date, equity_instru_id), bars_df in major_m01_df.groupby(["trade_date", "instrument"]):
+            d, i = chunk_bgn + chunk_dates.index(trade_date), instruments.index(equity_instru_id)
+            bar_num[d, i] = len(bars_df)
+            if bar_num[d, i] == tot_bar_num:
+                bars[d, i] = bars_df.sort_values(by="timestamp")[list(m01_tensor_fields)].to_numpy(dtype=np.float64)
+        print("... @ {}, minute bars from {} to {} are exported".format(dt.datetime.now(), chunk_dates[0], chunk_dates[-1]))
+    bars.flush()
+    m01_db.close()
+
+    # --- index
+    index_df = pd.DataFrame({
+        "trade_date": np.repeat(iter_dates, len(instruments)),
+        "instrument": np.tile(instruments, len(iter_dates)),
+        "contract": major_contracts.to_numpy().flatten(),
+        "bar_num": bar_num.flatten(),
+    })
+    index_path = os.path.join(m01_cache_dir, "m01.index.csv")
+    index_df.to_csv(index_path, index=False)
+
+    # --- staleness marker
+    meta = {
+        "bgn_date": bgn_date, "stp_date": stp_date,
+        "major_minor_mtime": {
+            equity_instru_id: os.path.getmtime(os.path.join(major_minor_dir, "major_minor.{}.csv.gz".format(equity_instru_id)))
+            for equity_instru_id in instruments},
+    }
+    with open(os.path.join(m01_cache_dir, "m01.meta.json"), "w") as j:
+        json.dump(meta, j, indent=1)
+    return 0
+
+
+class CM01Cache(object):
+    def __init__(self, m01_cache_dir: str, major_minor_dir: str | None = None):
+        """
+
+        :param m01_cache_dir:
+        :param major_minor_dir: if provided, the store is refused if a major_minor file is updated after export
+        """
+        if major_minor_dir is not None:
+            self.check_major_minor(m01_cache_dir, major_minor_dir)
+        index_df = pd.read_csv(os.path.join(m01_cache_dir, "m01.index.csv"), dtype={"trade_date": str, "contract": str})
+        self.m_bars = np.load(os.path.join(m01_cache_dir, "m01.bars.npy"), mmap_mode="r")
+        self.m_dates = index_df["trade_date"].drop_duplicates().tolist()
+        self.m_instruments = index_df["instrument"].drop_duplicates().tolist()
+        self.m_date_loc = {d: k for k, d in enumerate(self.m_dates)}
+        self.m_contract = index_df["contract"].to_numpy().reshape(len(self.m_dates), len(self.m_instruments))
+        self.m_bar_num = index_df["bar_num"].to_numpy().reshape(len(self.m_dates), len(self.m_instruments))
+
+    def get_bars(self, trade_dates: list[str], instrument: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+
+        :param trade_dates: a zero-copy view is returned if they are consecutive in the store
+        :param instrument: like "IC.CFE"
+        :return: bars of shape (len(trade_dates), 240, len(m01_tensor_fields)), fields are in the order
+                 of m01_tensor_fields, contract and number of bars of each date
+        """
+        try:
+            d = np.array([self.m_date_loc[_] for _ in trade_dates], dtype=int)
+            i = self.m_instruments.index(instrument)
+        except (KeyError, ValueError):
+            print("... {} @ {} is not in m01 cache, please export again".format(instrument, trade_dates))
+            sys.exit()
+        if len(d) > 0 and np.all(np.diff(d) == 1):
+            bars = self.m_bars[d[0]:d[-1] + 1, i]
+        else:
+            bars = self.m_bars[d, i]
+        return bars, self.m_contract[d, i], self.m_bar_num[d, i]
+
+    @staticmethod
+    def check_major_minor(m01_cache_dir: str, major_minor_dir: str):
+        meta_path = os.path.join(m01_cache_dir, "m01.meta.json")
+        if not os.path.exists(meta_path):
+            print("... {} is not found, the m01 cache is exported by an old version".format(meta_path))
+            print("... this program will terminate at once, please re-export m01 cache")
+            sys.exit()
+        with open(meta_path, "r") as j:
+            meta = json.load(j)
+        for equity_instru_id, mtime in meta["major_minor_mtime"].items():
+            major_minor_path = os.path.join(major_minor_dir, "major_minor.{}.csv.gz".format(equity_instru_id))
+            if os.path.getmtime(major_minor_path) > mtime:
+                print("... {} is updated after the m01 cache is exported @ {}".format(major_minor_path, m01_cache_dir))
+                print("... this program will terminate at once, please re-export m01 cache")
+                sys.exit()
+        return 0
+
+    def check_contracts(self, trade_dates: list[str], instrument: str, contracts: list[str], cached_contracts: np.ndarray):
+        """
+
+        :param trade_dates:
+        :param instrument:
+        :param contracts: major contracts of trade_dates from major_minor now
+        :param cached_contracts: contracts returned by get_bars
+        :return:
+        """
+        for trade_date, contract, cached_contract in zip(trade_dates, contracts, cached_contracts):
+            # dates without bars are left to the check of number of bars
+            if isinstance(cached_contract, str) and contract != cached_contract:
+                print("... major contract of {} @ {} is {}, but bars of {} are in m01 cache".format(
+                    instrument, trade_date, contract, cached_contract))
+                print("... this program will terminate at once, please re-export m01 cache")
+                sys.exit()
+        return 0
+
+    def has_data(self, trade_date: str) -> bool:
+        return trade_date in self.m_date_loc and bool(np.any(self.m_bar_num[self.m_date_loc[trade_date]] > 0))
@@ -1,3 +1,5 @@
+import sys
+import datetime as dt
 import subprocess as sp
 import itertools as ittl
 from project_setup import calendar_path
@@ -6,24 +8,32 @@ from project_setup import equity_index_by_instrument_dir, md_by_instru_dir
 from project_setup import futures_md_structure_path, futures_em01_db_name, futures_md_dir
 from project_setup import major_minor_dir
 from project_setup import research_features_and_return_dir
+from project_setup import research_m01_cache_dir
 from project_setup import research_models_dir
 from project_setup import research_navs_dir
 from project_setup import research_predictions_dir
 from project_setup import research_summary_dir
+from project_setup import research_manifest_path
 from project_config import sqlite3_tables
 from project_config import equity_indexes
-from project_config import instruments_universe, tids
+from project_config import instruments_universe, tids, sub_win_width
 from project_config import train_windows
 from project_config import x_lbls, y_lbls
 from project_config import cost_rate
-from dp_00_features_and_return import split_spot_daily_k, cal_features_and_return
-from dp_01_convert_csv_to_sqlite3 import convert_csv_to_sqlite3
-from ml_normalize import ml_normalize
-from ml_train_lm import ml_lm
+from dp_00_features_and_return import split_spot_daily_k, cal_features_and_return, cal_features_and_return_batch
+from dp_m01_cache import export_m01_cache
+from dp_01_convert_csv_to_sqlite3 import convert_csv_to_sqlite3, convert_csv_to_sqlite3_bulk
+from ml_normalize import ml_normalize_rolling
+from ml_train_lm import ml_lm, ml_lm_gram
 from ml_train_mlpr import multi_process_fun_for_ml_mlpr
 from ml_train_mlpc import multi_process_fun_for_ml_mlpc
-from ml_test import multi_process_fun_for_ml_test
-from ml_summary import ml_summary
+from ml_test import multi_process_fun_for_ml_test, ml_model_test_stacked
+from ml_pack import ml_pack_models, ml_stack_models
+from ml_pipeline import multi_process_fun_for_ml_pipeline
+from ml_scheduler import multi_process_fun_for_ml_tasks
+from ml_summary import ml_summary_all, ml_summary_incremental
+from ml_serve import ml_serve, ml_serve_replay
+from xdag import run_research_dag
 
 if __name__ == "__main__":
 
@@ -31,15 +41,53 @@ if __name__ == "__main__":
     trn_bgn_date, trn_stp_date = "20180101", "20230522"
 
     switch = {
+        "m01_cache": False,
         "features_and_return": False,
+        "features_and_return_batch": False,
         "toSql": False,
+        "toSqlBulk": False,
         "normalize": False,
         "lm": False,
         "mlpr": False,
         "mlpc": False,
+        "pack": False,  # scalers and models of a month in one file, read by "test"
+        "stack": False,  # scalers and models of all groups of a month as stacked arrays, read by "test" if test_stacked and "serve"
         "test": False,
+        "pipeline": False,  # normalize, lm, mlpr, mlpc and test in one pass, instead of their switches above
         "summary": False,
+        "dag": False,  # stages in dag_stages as one graph of tasks, instead of the switches above
+        "update": False,  # "dag" up to today, only missing or stale artifacts in the manifest are made, or run "python main.py update"
+        "serve": False,  # local inference service of serve_month for the session, or run "python main.py serve"
+        "replay": False,  # drive a running service with minute bars of serve_month, or run "python main.py replay"
     }
+    if sys.argv[1:] in (["update"], ["serve"], ["replay"]):
+        switch = {k: k == sys.argv[1] for k in switch}
+    use_m01_cache = False  # read minute bars from the store exported by switch "m01_cache"
+    features_sink = "csv"  # "parquet": features are saved to a columnar lib directly, and "toSql" is not needed
+    features_lib_type = "parquet" if features_sink == "parquet" else "sqlite"
+    lm_from_grams = True  # lm of all groups are solved from per-month Gram sums in one pass, instead of one fit for each group
+    use_features_panel = True  # mlpr, mlpc and test read features from one copy in shared memory
+    mlp_warm_start = False  # mlpr and mlpc start from the weights of last month, and stop early
+    dag_stages = ("features", "ingest", "normalize", "train", "test", "summary")
+    use_task_scheduler = False  # mlpr, mlpc and test run as (model, group, window, month) tasks, largest first, instead of one task for each group
+    test_batch_months = True  # test of a group reads all months in one query and writes in one update, not used if use_task_scheduler
+    test_stacked = False  # "test" scores all groups of a month by one batched forward pass in one process, instead of the two ways above
+    summary_incremental = False  # "summary" reads only predictions after the saved state, trades are summarized without CNAV
+    predictions_lib_type = "sqlite"  # "parquet": predictions of all models in one lib partitioned by model and month, instead of a db per pred_id
+    serve_month = dt.datetime.now().strftime("%Y%m")  # models trained at the month before it are loaded
+    serve_address = ("127.0.0.1", 6180)  # or path of a unix socket on linux, like "/tmp/ml_serve.sock"
+    serve_latency_budget_ms = 50.0
+
+    if switch["m01_cache"]:
+        export_m01_cache(
+            bgn_date=md_bgn_date, stp_date=md_stp_date, equity_indexes=equity_indexes,
+            calendar_path=calendar_path,
+            futures_md_structure_path=futures_md_structure_path,
+            futures_em01_db_name=futures_em01_db_name,
+            futures_md_dir=futures_md_dir,
+            major_minor_dir=major_minor_dir,
+            m01_cache_dir=research_m01_cache_dir
+        )
 
     if switch["features_and_return"]:
         split_spot_daily_k(equity_index_by_instrument_dir, equity_indexes)
@@ -52,10 +100,31 @@ if __name__ == "__main__":
             futures_em01_db_name=futures_em01_db_name,
             futures_md_dir=futures_md_dir,
             major_minor_dir=major_minor_dir,
-            research_features_and_return_dir=research_features_and_return_dir
+            research_features_and_return_dir=research_features_and_return_dir,
+            sub_win_width=sub_win_width,
+            proc_num=5,
+            m01_cache_dir=research_m01_cache_dir if use_m01_cache else None,
+            sink=features_sink,
         )
         sp.run(["python", "dp_00_features_and_return.py", md_bgn_date, md_stp_date])
 
+    if switch["features_and_return_batch"]:
+        split_spot_daily_k(equity_index_by_instrument_dir, equity_indexes)
+        cal_features_and_return_batch(
+            bgn_date=md_bgn_date, stp_date=md_stp_date, equity_indexes=equity_indexes,
+            calendar_path=calendar_path, futures_instru_info_path=futures_instru_info_path,
+            equity_index_by_instrument_dir=equity_index_by_instrument_dir,
+            md_by_instru_dir=md_by_instru_dir,
+            futures_md_structure_path=futures_md_structure_path,
+            futures_em01_db_name=futures_em01_db_name,
+            futures_md_dir=futures_md_dir,
+            major_minor_dir=major_minor_dir,
+            research_features_and_return_dir=research_features_and_return_dir,
+            sub_win_width=sub_win_width,
+            m01_cache_dir=research_m01_cache_dir if use_m01_cache else None,
+            sink=features_sink,
+        )
+
     if switch["toSql"]:
         convert_csv_to_sqlite3(
             run_mode="o", bgn_date=md_bgn_date, stp_date=md_stp_date,
@@ -65,19 +134,41 @@ if __name__ == "__main__":
             sqlite3_tables=sqlite3_tables
         )
 
+    if switch["toSqlBulk"]:
+        convert_csv_to_sqlite3_bulk(
+            run_mode="o", bgn_date=md_bgn_date, stp_date=md_stp_date,
+            calendar_path=calendar_path,
+            research_features_and_return_dir=research_features_and_return_dir,
+            equity_indexes=equity_indexes,
+            sqlite3_tables=sqlite3_tables,
+            proc_num=5,
+        )
+
     if switch["normalize"]:
-        for instrument, tid, trn_win in ittl.product(instruments_universe + [None], tids + [None], train_windows):
-            ml_normalize(
-                instrument=instrument, tid=tid, trn_win=trn_win,
-                bgn_date=trn_bgn_date, stp_date=trn_stp_date,
-                calendar_path=calendar_path,
-                features_and_return_dir=research_features_and_return_dir,
-                models_dir=research_models_dir,
-                sqlite3_tables=sqlite3_tables,
-                x_lbls=x_lbls, y_lbls=y_lbls
-            )
+        ml_normalize_rolling(
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            sqlite3_tables=sqlite3_tables,
+            x_lbls=x_lbls,
+            features_lib_type=features_lib_type
+        )
 
-    if switch["lm"]:
+    if switch["lm"] and lm_from_grams:
+        ml_lm_gram(
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            sqlite3_tables=sqlite3_tables,
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type
+        )
+
+    if switch["lm"] and not lm_from_grams:
         for instrument, tid, trn_win in ittl.product(instruments_universe + [None], tids + [None], train_windows):
             ml_lm(
                 instrument=instrument, tid=tid, trn_win=trn_win,
@@ -86,10 +177,28 @@ if __name__ == "__main__":
                 features_and_return_dir=research_features_and_return_dir,
                 models_dir=research_models_dir,
                 sqlite3_tables=sqlite3_tables,
-                x_lbls=x_lbls, y_lbls=y_lbls
+                x_lbls=x_lbls, y_lbls=y_lbls,
+                features_lib_type=features_lib_type
             )
 
-    if switch["mlpr"]:
+    if use_task_scheduler and (switch["mlpr"] or switch["mlpc"]):
+        multi_process_fun_for_ml_tasks(
+            proc_num=5, stage="train",
+            model_lbls=[_ for _ in ["mlpr", "mlpc"] if switch[_]],
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            predictions_dir=None,
+            sqlite3_tables=sqlite3_tables,
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            use_features_panel=use_features_panel,
+            warm_start=mlp_warm_start,
+        )
+
+    if switch["mlpr"] and not use_task_scheduler:
         multi_process_fun_for_ml_mlpr(
             group_n=5,
             instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
@@ -98,10 +207,13 @@ if __name__ == "__main__":
             features_and_return_dir=research_features_and_return_dir,
             models_dir=research_models_dir,
             sqlite3_tables=sqlite3_tables,
-            x_lbls=x_lbls, y_lbls=y_lbls
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            use_features_panel=use_features_panel,
+            warm_start=mlp_warm_start,
         )
 
-    if switch["mlpc"]:
+    if switch["mlpc"] and not use_task_scheduler:
         multi_process_fun_for_ml_mlpc(
             group_n=5,
             instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
@@ -110,10 +222,62 @@ if __name__ == "__main__":
             features_and_return_dir=research_features_and_return_dir,
             models_dir=research_models_dir,
             sqlite3_tables=sqlite3_tables,
-            x_lbls=x_lbls, y_lbls=y_lbls
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            use_features_panel=use_features_panel,
+            warm_start=mlp_warm_start,
+        )
+
+    if switch["pack"]:
+        ml_pack_models(
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            models_dir=research_models_dir,
+            remove_files=False,
         )
 
-    if switch["test"]:
+    if switch["stack"]:
+        ml_stack_models(
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            models_dir=research_models_dir,
+            model_lbls=["lm", "mlpr", "mlpc"],
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+        )
+
+    if switch["test"] and test_stacked:
+        ml_model_test_stacked(
+            model_lbls=["lm", "mlpr", "mlpc"],
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            predictions_dir=research_predictions_dir,
+            sqlite3_tables=sqlite3_tables,
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            predictions_lib_type=predictions_lib_type,
+        )
+
+    if switch["test"] and use_task_scheduler and not test_stacked:
+        multi_process_fun_for_ml_tasks(
+            proc_num=5, stage="test",
+            model_lbls=["lm", "mlpr", "mlpc"],
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            predictions_dir=research_predictions_dir,
+            sqlite3_tables=sqlite3_tables,
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            use_features_panel=use_features_panel,
+            predictions_lib_type=predictions_lib_type,
+        )
+
+    if switch["test"] and not use_task_scheduler and not test_stacked:
         multi_process_fun_for_ml_test(
             group_n=5,
             model_lbls=["lm", "mlpr", "mlpc"],
@@ -124,16 +288,115 @@ if __name__ == "__main__":
             models_dir=research_models_dir,
             predictions_dir=research_predictions_dir,
             sqlite3_tables=sqlite3_tables,
-            x_lbls=x_lbls, y_lbls=y_lbls
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            use_features_panel=use_features_panel,
+            predictions_lib_type=predictions_lib_type,
+            batch_months=test_batch_months,
         )
 
-    if switch["summary"]:
-        for model_lbl in ["lm", "mlpr", "mlpc"]:
-            ml_summary(
-                model_lbl=model_lbl,
-                instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
-                sqlite3_tables=sqlite3_tables,
-                predictions_dir=research_predictions_dir, navs_dir=research_navs_dir,
-                research_summary_dir=research_summary_dir,
-                cost_rate=cost_rate
-            )
+    if switch["pipeline"]:
+        multi_process_fun_for_ml_pipeline(
+            group_n=5,
+            model_lbls=["lm", "mlpr", "mlpc"],
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            bgn_date=trn_bgn_date, stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            predictions_dir=research_predictions_dir,
+            sqlite3_tables=sqlite3_tables,
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            features_lib_type=features_lib_type,
+            use_features_panel=use_features_panel,
+            predictions_lib_type=predictions_lib_type,
+        )
+
+    if switch["summary"] and summary_incremental:
+        ml_summary_incremental(
+            model_lbls=["lm", "mlpr", "mlpc"],
+            instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
+            sqlite3_tables=sqlite3_tables,
+            predictions_dir=research_predictions_dir, navs_dir=research_navs_dir,
+            research_summary_dir=research_summary_dir,
+            cost_rate=cost_rate,
+            predictions_lib_type=predictions_lib_type,
+        )
+
+    if switch["summary"] and not summary_incremental:
+        ml_summary_all(
+            model_lbls=["lm", "mlpr", "mlpc"],
+            instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
+            sqlite3_tables=sqlite3_tables,
+            predictions_dir=research_predictions_dir, navs_dir=research_navs_dir,
+            research_summary_dir=research_summary_dir,
+            cost_rate=cost_rate,
+            predictions_lib_type=predictions_lib_type,
+        )
+
+    if switch["dag"] or switch["update"]:
+        if switch["update"]:
+            md_stp_date = trn_stp_date = (dt.datetime.now() + dt.timedelta(days=1)).strftime("%Y%m%d")
+        run_research_dag(
+            stages=dag_stages,
+            md_bgn_date=md_bgn_date, md_stp_date=md_stp_date,
+            trn_bgn_date=trn_bgn_date, trn_stp_date=trn_stp_date,
+            calendar_path=calendar_path,
+            features_env_kwargs={
+                "futures_instru_info_path": futures_instru_info_path,
+                "md_by_instru_dir": md_by_instru_dir,
+                "futures_md_structure_path": futures_md_structure_path,
+                "futures_em01_db_name": futures_em01_db_name,
+                "futures_md_dir": futures_md_dir,
+                "major_minor_dir": major_minor_dir,
+                "m01_cache_dir": research_m01_cache_dir if use_m01_cache else None,
+            },
+            equity_index_by_instrument_dir=equity_index_by_instrument_dir,
+            research_features_and_return_dir=research_features_and_return_dir,
+            models_dir=research_models_dir,
+            predictions_dir=research_predictions_dir,
+            navs_dir=research_navs_dir,
+            summary_dir=research_summary_dir,
+            sqlite3_tables=sqlite3_tables,
+            equity_indexes=equity_indexes,
+            instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
+            x_lbls=x_lbls, y_lbls=y_lbls,
+            cost_rate=cost_rate,
+            sub_win_width=sub_win_width,
+            features_sink=features_sink,
+            warm_start=mlp_warm_start,
+            proc_num=5,
+            manifest_path=research_manifest_path,
+            predictions_lib_type=predictions_lib_type,
+        )
+
+    if switch["serve"]:
+        ml_serve(
+            serve_month=serve_month,
+            calendar_path=calendar_path,
+            models_dir=research_models_dir,
+            instruments=instruments_universe + [None], tids=tids + [None], train_windows=train_windows,
+            model_lbls=["lm", "mlpr", "mlpc"],
+            x_lbls=x_lbls,
+            serve_address=serve_address,
+            sub_win_width=sub_win_width,
+            latency_budget_ms=serve_latency_budget_ms,
+        )
+
+    if switch["replay"]:
+        ml_serve_replay(
+            bgn_date=serve_month + "01", stp_date=min(trn_stp_date, dt.datetime.now().strftime("%Y%m%d")),
+            serve_address=serve_address,
+            equity_indexes=equity_indexes,
+            calendar_path=calendar_path,
+            features_env_kwargs={
+                "futures_instru_info_path": futures_instru_info_path,
+                "md_by_instru_dir": md_by_instru_dir,
+                "futures_md_structure_path": futures_md_structure_path,
+                "futures_em01_db_name": futures_em01_db_name,
+                "futures_md_dir": futures_md_dir,
+                "major_minor_dir": major_minor_dir,
+            },
+            equity_index_by_instrument_dir=equity_index_by_instrument_dir,
+            m01_cache_dir=research_m01_cache_dir if use_m01_cache else None,
+        )
@@ -1,10 +1,67 @@
 import os
 import datetime as dt
+import itertools as ittl
+import numpy as np
+import pandas as pd
 from sklearn.preprocessing import StandardScaler
-from skyrim.falkreath import CManagerLibReader, CTable
 from skyrim.whiterun import CCalendarMonthly
 from skyrim.winterhold import check_and_mkdir
 from xfuns import save_to_sio_obj
+from xlibs import get_features_and_return_lib
+
+
+def ml_normalize_one_month(instrument: str | None, tid: str | None, trn_win: int,
+                           train_end_month: str,
+                           calendar: CCalendarMonthly, features_and_return_lib,
+                           models_dir: str,
+                           x_lbls: list, y_lbls: list,
+                           minimum_data_size: int = 100,
+                           ) -> StandardScaler | None:
+    """
+    fit and save the scaler of one month
+
+    :param instrument: like IC.CFE
+    :param tid: ['T01',...,'T07']
+    :param trn_win: [6,12,24]
+    :param train_end_month: format = [YYYYMM]
+    :param calendar:
+    :param features_and_return_lib: a reader with read_by_conditions
+    :param models_dir:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :param minimum_data_size:
+    :return: the scaler, None if there are less than minimum_data_size rows
+    """
+    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    check_and_mkdir(os.path.join(models_dir, train_end_month[0:4]))
+    check_and_mkdir(model_month_dir := os.path.join(models_dir, train_end_month[0:4], train_end_month))
+
+    train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+    conds = init_conds + [
+        ("trade_date", ">=", train_bgn_date),
+        ("trade_date", "<=", train_end_date),
+    ]
+    src_df = features_and_return_lib.read_by_conditions(
+        t_conditions=conds,
+        t_value_columns=x_lbls + y_lbls
+    )
+    if len(src_df) < minimum_data_size:
+        return None
+    x_df, y_df = src_df[x_lbls], src_df[y_lbls]
+
+    # --- normalize
+    scaler_path = os.path.join(
+        model_month_dir,
+        "{}-{}.scl".format(model_grp_id, train_end_month)
+    )
+    scaler = StandardScaler()
+    scaler.fit(x_df)
+    save_to_sio_obj(scaler, scaler_path)
+
+    print("... {0} | NORM | {1:>24s} | {2} | Normalized |".format(
+        dt.datetime.now(), model_grp_id, train_end_month))
+    return scaler
 
 
 def ml_normalize(instrument: str | None, tid: str | None, trn_win: int,
@@ -13,7 +70,8 @@ def ml_normalize(instrument: str | None, tid: str | None, trn_win: int,
                  features_and_return_dir: str, models_dir: str,
                  sqlite3_tables: dict,
                  x_lbls: list, y_lbls: list,
-                 minimum_data_size: int = 100
+                 minimum_data_size: int = 100,
+                 features_lib_type: str = "sqlite",
                  ):
     """
 
@@ -29,12 +87,10 @@ def ml_normalize(instrument: str | None, tid: str | None, trn_win: int,
     :param x_lbls:
     :param y_lbls: "rtm" must be in it
     :param minimum_data_size:
+    :param features_lib_type: "sqlite" or "parquet"
     :return:
     """
 
-    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
-    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
-
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
@@ -42,46 +98,166 @@ def ml_normalize(instrument: str | None, tid: str | None, trn_win: int,
     calendar = CCalendarMonthly(calendar_path)
 
     # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
 
     # --- dates
     iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
 
     # --- main core
-    scaler = StandardScaler()
     for train_end_month in iter_months:
-        check_and_mkdir(os.path.join(models_dir, train_end_month[0:4]))
-        check_and_mkdir(model_month_dir := os.path.join(models_dir, train_end_month[0:4], train_end_month))
-
-        train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
-        conds = init_conds + [
-            ("trade_date", ">=", train_bgn_date),
-            ("trade_date", "<=", train_end_date),
-        ]
-        src_df = features_and_return_lib.read_by_conditions(
-            t_conditions=conds,
-            t_value_columns=x_lbls + y_lbls
+        ml_normalize_one_month(
+            instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=train_end_month,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls,
+            minimum_data_size=minimum_data_size,
         )
-        if len(src_df) < minimum_data_size:
-            continue
-        x_df, y_df = src_df[x_lbls], src_df[y_lbls]
 
-        # --- normalize
-        scaler_path = os.path.join(
-            model_month_dir,
-            "{}-{}.scl".format(model_grp_id, train_end_month)
-        )
-        scaler.fit(x_df)
-        save_to_sio_obj(scaler, scaler_path)
+    features_and_return_lib.close()
+    return 0
+
 
-        print("... {0} | NORM | {1:>24s} | {2} | Normalized |".format(
-            dt.datetime.now(), model_grp_id, train_end_month))
+# --- rolling normalize, scalers of all groups are derived from moments of each (instrument, tid, month)
+def _combine_moments(rows: np.ndarray, n: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+    """
+    combine blocks along axis 0, by the pairwise formula of Chan, Golub and LeVeque,
+    m2 is the sum of squared deviations from the mean of each block
+
+    """
+    tot_n = n.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tot_mean = (n * mean).sum(axis=0) / tot_n
+    tot_m2 = m2.sum(axis=0) + (n * (mean - tot_mean) ** 2).sum(axis=0)
+    return rows.sum(axis=0), tot_n, tot_mean, tot_m2
+
+
+def _make_scaler(n: np.ndarray, mean: np.ndarray, m2: np.ndarray, x_lbls: list) -> StandardScaler:
+    """
+    set the attributes of a fitted StandardScaler, same as StandardScaler.partial_fit
+
+    """
+    scaler = StandardScaler()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = m2 / n
+    n_samples_seen = n.astype(np.int64)
+    if np.ptp(n_samples_seen) == 0:
+        n_samples_seen = n_samples_seen[0]
 
+    # near constant features, see sklearn.preprocessing._data._is_constant_feature
+    eps = np.finfo(np.float64).eps
+    constant_mask = var <= n_samples_seen * eps * var + (n_samples_seen * mean * eps) ** 2
+    scale = np.sqrt(var)
+    scale[constant_mask] = 1.0
+
+    scaler.feature_names_in_ = np.asarray(x_lbls, dtype=object)
+    scaler.n_features_in_ = len(x_lbls)
+    scaler.n_samples_seen_ = n_samples_seen
+    scaler.mean_, scaler.var_, scaler.scale_ = mean, var, scale
+    return scaler
+
+
+def cal_month_moments(src_df: pd.DataFrame, x_lbls: list) -> pd.DataFrame:
+    """
+
+    :param src_df: with columns trade_date, instrument, tid and x_lbls
+    :param x_lbls:
+    :return: index = (instrument, tid, month), columns = rows + (n, mean, m2) x x_lbls,
+             n counts values which are not nan
+    """
+    grouped = src_df.groupby(by=[src_df["instrument"], src_df["tid"], src_df["trade_date"].str.slice(0, 6).rename("month")])
+    n = grouped[x_lbls].count()
+    mean = grouped[x_lbls].mean()
+    m2 = grouped[x_lbls].var(ddof=0) * n
+    month_moments_df = pd.concat([n, mean.fillna(0), m2.fillna(0)], axis=1, keys=["n", "mean", "m2"])
+    month_moments_df["rows"] = grouped.size()
+    return month_moments_df
+
+
+def ml_normalize_rolling(instruments: list[str | None], tids: list[str | None], train_windows: list[int],
+                         bgn_date: str, stp_date: str,
+                         calendar_path: str,
+                         features_and_return_dir: str, models_dir: str,
+                         sqlite3_tables: dict,
+                         x_lbls: list,
+                         minimum_data_size: int = 100,
+                         features_lib_type: str = "sqlite",
+                         ):
+    """
+    same scalers as ml_normalize for every group in product(instruments, tids, train_windows),
+    but the features table is read once. Counts, means and sums of squared deviations are
+    calculated once for each (instrument, tid, month), scalers of pooled groups
+    (instrument or tid is None) and of trailing windows are combined from these month blocks,
+    so windows must start and end at boundaries of months, which is true for
+    calendar.get_bgn_and_end_dates_for_trailing_window
+
+    :param instruments: like ["IC.CFE", None], None for all instruments
+    :param tids: like ["T01", None], None for all tids
+    :param train_windows: [6,12,24]
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param features_and_return_dir:
+    :param models_dir:
+    :param sqlite3_tables:
+    :param x_lbls:
+    :param minimum_data_size:
+    :param features_lib_type: "sqlite" or "parquet"
+    :return:
+    """
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendarMonthly(calendar_path)
+
+    # --- load month moments
+    features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+    src_df = features_and_return_lib.read(t_value_columns=["trade_date", "instrument", "tid"] + x_lbls)
     features_and_return_lib.close()
+    month_moments_df = cal_month_moments(src_df, x_lbls)
+
+    # --- dates
+    iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
+
+    # --- main core
+    for instrument, tid in ittl.product(instruments, tids):
+        # month blocks of this group, subgroups are combined for pooled groups
+        grp_filter = np.ones(len(month_moments_df), dtype=bool)
+        if instrument is not None:
+            grp_filter &= month_moments_df.index.get_level_values("instrument") == instrument
+        if tid is not None:
+            grp_filter &= month_moments_df.index.get_level_values("tid") == tid
+        grp_df = month_moments_df.loc[grp_filter]
+        grp_months, grp_blocks = [], []
+        for month, month_df in grp_df.groupby(level="month"):
+            grp_months.append(month)
+            grp_blocks.append(_combine_moments(
+                month_df["rows"].values, month_df["n"].values, month_df["mean"].values, month_df["m2"].values))
+        if not grp_blocks:
+            continue
+        grp_months = np.array(grp_months)
+        grp_rows, grp_n, grp_mean, grp_m2 = [np.array(_) for _ in zip(*grp_blocks)]
+
+        for trn_win in train_windows:
+            model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+            for train_end_month in iter_months:
+                check_and_mkdir(os.path.join(models_dir, train_end_month[0:4]))
+                check_and_mkdir(model_month_dir := os.path.join(models_dir, train_end_month[0:4], train_end_month))
+
+                train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+                win_filter = (grp_months >= train_bgn_date[0:6]) & (grp_months <= train_end_date[0:6])
+                rows, n, mean, m2 = _combine_moments(
+                    grp_rows[win_filter], grp_n[win_filter], grp_mean[win_filter], grp_m2[win_filter])
+                if rows < minimum_data_size:
+                    continue
+
+                # --- normalize
+                scaler_path = os.path.join(
+                    model_month_dir,
+                    "{}-{}.scl".format(model_grp_id, train_end_month)
+                )
+                save_to_sio_obj(_make_scaler(n, mean, m2, x_lbls), scaler_path)
+
+                print("... {0} | NORM | {1:>24s} | {2} | Normalized |".format(
+                    dt.datetime.now(), model_grp_id, train_end_month))
     return 0
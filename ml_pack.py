@@ -0,0 +1,75 @@
+import datetime as dt
+import itertools as ittl
+from skyrim.whiterun import CCalendarMonthly
+from xlibs import CModelStore, CStackedModels
+
+
+def ml_pack_models(bgn_date: str, stp_date: str,
+                   calendar_path: str,
+                   models_dir: str,
+                   remove_files: bool = False,
+                   ):
+    """
+    pack scalers and models of each month into one file of CModelStore, run it after training,
+    then ml_model_test reads them from the store.
+
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param models_dir:
+    :param remove_files: remove skops files after packing, keep them if warm start or the manifest of the dag is used
+    :return:
+    """
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendarMonthly(calendar_path)
+
+    # --- main core
+    model_store = CModelStore(models_dir)
+    for train_end_month in calendar.map_iter_dates_to_iter_months(bgn_date, stp_date):
+        artifacts_num = model_store.pack_month(train_end_month, t_remove_files=remove_files)
+        print("... {} | {} | {:>4d} artifacts packed |".format(dt.datetime.now(), train_end_month, artifacts_num))
+    return 0
+
+
+def ml_stack_models(bgn_date: str, stp_date: str,
+                    calendar_path: str,
+                    models_dir: str,
+                    model_lbls: list[str], instruments: list[str], tids: list[str], train_windows: list[int],
+                    ):
+    """
+    stack scalers, lm coefficients and mlp weights of all groups of each month into arrays of CStackedModels,
+    saved as models_dir/YYYY/YYYYMM/YYYYMM.stacked.npz, run it after training or "pack",
+    then the stacked test and the inference service score all groups by one batched forward pass.
+
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param models_dir:
+    :param model_lbls: ["lm", "mlpr", "mlpc"]
+    :param instruments: like ["IC.CFE", ..., None], None for the group of all instruments
+    :param tids: like ["T01", ..., None], None for the group of all tids
+    :param train_windows:
+    :return:
+    """
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendarMonthly(calendar_path)
+
+    # --- main core
+    model_store = CModelStore(models_dir)
+    grp_ids = ["-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+               for instrument, tid, trn_win in ittl.product(instruments, tids, train_windows)]
+    for train_end_month in calendar.map_iter_dates_to_iter_months(bgn_date, stp_date):
+        stacked = CStackedModels.from_store(model_store, train_end_month, grp_ids, model_lbls)
+        if len(stacked.m_grp_ids) == 0:
+            continue
+        stacked.save(CStackedModels.get_path(models_dir, train_end_month))
+        print("... {} | {} | {:>4d} groups stacked |".format(dt.datetime.now(), train_end_month, len(stacked.m_grp_ids)))
+    return 0
@@ -0,0 +1,213 @@
+import os
+import datetime as dt
+import numpy as np
+import pandas as pd
+import itertools as ittl
+import multiprocessing as mp
+from sklearn.preprocessing import StandardScaler
+from skyrim.falkreath import CManagerLibWriter, CTable
+from skyrim.whiterun import CCalendarMonthly
+from skyrim.winterhold import check_and_mkdir
+from xfuns import save_to_sio_obj, get_train_model
+from xlibs import get_features_and_return_lib, get_predictions_store, CFeaturesPanel, CPredictionsStore
+
+
+def ml_pipeline(model_lbls: list[str], instrument: str | None, tid: str | None, trn_win: int,
+                bgn_date: str, stp_date: str,
+                calendar_path: str,
+                features_and_return_dir: str, models_dir: str, predictions_dir: str,
+                sqlite3_tables: dict,
+                x_lbls: list, y_lbls: list,
+                minimum_data_size: int = 100,
+                features_lib_type: str = "sqlite",
+                features_panel: CFeaturesPanel | None = None,
+                predictions_store: CPredictionsStore | None = None,
+                ):
+    """
+    normalize, train and test in one pass, for each month, the train window and the test month
+    are read once, the scaler and all models in model_lbls are fitted and saved, then the
+    test month is predicted. Artifacts are the same as ml_normalize, ml_lm, ml_mlpr, ml_mlpc and ml_test.
+
+    :param model_lbls: ["lm", "mlpr", "mlpc"]
+    :param instrument: like IC.CFE
+    :param tid: ['T01',...,'T07']
+    :param trn_win: [6,12,24]
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param features_and_return_dir:
+    :param models_dir:
+    :param predictions_dir:
+    :param sqlite3_tables:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :param minimum_data_size:
+    :param features_lib_type: "sqlite" or "parquet"
+    :param features_panel: if provided, features are read from it instead of the lib of features_lib_type
+    :param predictions_store: if provided, predictions are appended to it instead of the dbs of pred_id
+    :return:
+    """
+
+    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    pred_header_cols = ["trade_date", "instrument", "contract", "tid", "timestamp"]
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendarMonthly(calendar_path)
+
+    # --- load lib reader
+    if features_panel is None:
+        features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+    else:
+        features_and_return_lib = features_panel
+
+    # --- load lib writer
+    predictions_libs = {}
+    for model_lbl in (model_lbls if predictions_store is None else []):
+        pred_id = model_grp_id + "-pred-{}".format(model_lbl)
+        predictions_libs[model_lbl] = CManagerLibWriter(
+            t_db_save_dir=predictions_dir,
+            t_db_name=pred_id + ".db",
+        )
+        predictions_libs[model_lbl].initialize_table(CTable(t_table_struct=sqlite3_tables[pred_id]))
+
+    # --- dates
+    iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
+
+    # --- main core
+    for train_end_month in iter_months:
+        check_and_mkdir(os.path.join(models_dir, train_end_month[0:4]))
+        check_and_mkdir(model_month_dir := os.path.join(models_dir, train_end_month[0:4], train_end_month))
+
+        # --- load train and test data
+        train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+        train_data = features_and_return_lib.read_array_by_conditions(
+            t_conditions=init_conds + [("trade_date", ">=", train_bgn_date), ("trade_date", "<=", train_end_date)],
+            t_value_columns=x_lbls + y_lbls
+        )
+        if len(train_data) < minimum_data_size:
+            continue
+        test_month = calendar.get_next_month(train_end_month, 1)
+        test_bgn_date, test_end_date = calendar.get_first_date_of_month(test_month), calendar.get_last_date_of_month(test_month)
+        test_df = features_and_return_lib.read_by_conditions(
+            t_conditions=init_conds + [("trade_date", ">=", test_bgn_date), ("trade_date", "<=", test_end_date)],
+            t_value_columns=pred_header_cols + x_lbls + y_lbls
+        )
+
+        # --- normalize
+        scaler = StandardScaler()
+        scaler.fit(pd.DataFrame(train_data[:, :len(x_lbls)], columns=x_lbls))
+        save_to_sio_obj(scaler, os.path.join(model_month_dir, "{}-{}.scl".format(model_grp_id, train_end_month)))
+        x_train = np.nan_to_num((train_data[:, :len(x_lbls)] - scaler.mean_) / scaler.scale_, nan=0)
+        y_train = train_data[:, len(x_lbls)]
+        x_test = np.nan_to_num(scaler.transform(test_df[x_lbls]), nan=0) if len(test_df) > 0 else None
+
+        for model_lbl in model_lbls:
+            # --- fit model
+            train_model = get_train_model(model_lbl)
+            train_model.fit(X=x_train, y=(y_train >= 0).astype(int) if model_lbl == "mlpc" else y_train)
+            train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
+            save_to_sio_obj(train_model, os.path.join(model_month_dir, train_model_file))
+
+            # --- prediction
+            if x_test is not None:
+                pred_df = test_df[pred_header_cols + ["rtm"]].assign(pred=train_model.predict(X=x_test))
+                if predictions_store is None:
+                    predictions_libs[model_lbl].update(t_update_df=pred_df, t_using_index=False)
+                else:
+                    predictions_store.append(model_lbl, instrument, tid, trn_win, pred_df)
+
+            print("... {0} | {3} | {1:>24s} | {2} | fitted and tested |".format(
+                dt.datetime.now(), model_grp_id, train_end_month, model_lbl))
+
+    for predictions_lib in predictions_libs.values():
+        predictions_lib.close()
+    features_and_return_lib.close()
+    return 0
+
+
+def process_target_fun_for_ml_pipeline(group_id: int, group_n: int,
+                                       model_lbls: list[str], instruments: list[str], tids: list[str], train_windows: list[int],
+                                       bgn_date: str, stp_date: str,
+                                       calendar_path: str,
+                                       features_and_return_dir: str, models_dir: str, predictions_dir: str,
+                                       sqlite3_tables: dict,
+                                       x_lbls: list, y_lbls: list,
+                                       features_lib_type: str = "sqlite",
+                                       features_panel: CFeaturesPanel | None = None,
+                                       predictions_lib_type: str = "sqlite",
+                                       ):
+    predictions_store = get_predictions_store(predictions_dir) if predictions_lib_type == "parquet" else None
+    for i, (instrument, tid, trn_win) in enumerate(ittl.product(instruments, tids, train_windows)):
+        if i % group_n == group_id:
+            ml_pipeline(
+                model_lbls=model_lbls, instrument=instrument, tid=tid, trn_win=trn_win,
+                bgn_date=bgn_date, stp_date=stp_date,
+                calendar_path=calendar_path,
+                features_and_return_dir=features_and_return_dir,
+                models_dir=models_dir,
+                predictions_dir=predictions_dir,
+                sqlite3_tables=sqlite3_tables,
+                x_lbls=x_lbls, y_lbls=y_lbls,
+                features_lib_type=features_lib_type,
+                features_panel=features_panel,
+                predictions_store=predictions_store,
+            )
+    if predictions_store is not None:
+        predictions_store.close()
+    return 0
+
+
+def multi_process_fun_for_ml_pipeline(group_n: int,
+                                      model_lbls: list[str], instruments: list[str], tids: list[str], train_windows: list[int],
+                                      bgn_date: str, stp_date: str,
+                                      calendar_path: str,
+                                      features_and_return_dir: str, models_dir: str, predictions_dir: str,
+                                      sqlite3_tables: dict,
+                                      x_lbls: list, y_lbls: list,
+                                      features_lib_type: str = "sqlite",
+                                      use_features_panel: bool = False,
+                                      predictions_lib_type: str = "sqlite",
+                                      ):
+    """
+    groups are shared by group_n processes.
+    If use_features_panel, features are loaded once into a CFeaturesPanel in shared memory,
+    and all processes read from it.
+    If predictions_lib_type is "parquet", processes append to one CPredictionsStore,
+    which is compacted after all of them are done.
+
+    """
+    features_panel = None
+    if use_features_panel:
+        features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+        features_panel = CFeaturesPanel.from_lib(features_and_return_lib, x_lbls + y_lbls)
+        features_and_return_lib.close()
+
+    to_join_list = []
+    for group_id in range(group_n):
+        t = mp.Process(target=process_target_fun_for_ml_pipeline, args=(
+            group_id, group_n,
+            model_lbls, instruments, tids, train_windows,
+            bgn_date, stp_date,
+            calendar_path,
+            features_and_return_dir, models_dir, predictions_dir,
+            sqlite3_tables,
+            x_lbls, y_lbls,
+            features_lib_type,
+            features_panel,
+            predictions_lib_type,
+        ))
+        t.start()
+        to_join_list.append(t)
+    for t in to_join_list:
+        t.join()
+
+    if predictions_lib_type == "parquet":
+        get_predictions_store(predictions_dir).compact()
+
+    if features_panel is not None:
+        features_panel.unlink()
+    return 0
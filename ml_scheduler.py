@@ -0,0 +1,326 @@
+import os
+import sys
+import time
+import datetime as dt
+import numpy as np
+import pandas as pd
+import itertools as ittl
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+from skyrim.falkreath import CManagerLibWriter, CTable
+from skyrim.whiterun import CCalendarMonthly
+from skyrim.winterhold import check_and_mkdir
+from xfuns import get_train_model
+from xlibs import get_features_and_return_lib, get_predictions_store, CFeaturesPanel, CModelStore, CPredictionsStore
+from ml_train_lm import ml_lm_one_month
+from ml_train_mlpr import ml_mlpr_one_month
+from ml_train_mlpc import ml_mlpc_one_month
+from ml_test import ml_model_test_one_month
+
+train_one_month_funs = {
+    "lm": ml_lm_one_month,
+    "mlpr": ml_mlpr_one_month,
+    "mlpc": ml_mlpc_one_month,
+}
+task_timings_file = "task_timings.csv"
+
+
+def get_ml_tasks(stage: str, model_lbls: list[str], instruments: list[str], tids: list[str], train_windows: list[int],
+                 iter_months: list[str], warm_start: bool = False) -> list[tuple]:
+    """
+
+    :param stage: "train" or "test"
+    :param model_lbls: ["lm", "mlpr", "mlpc"]
+    :param instruments:
+    :param tids:
+    :param train_windows:
+    :param iter_months: train end months
+    :param warm_start: for "train", a warm started model depends on the model of last month,
+                       so all months of a group are in one task, else one month for each task
+    :return: a list of tasks like (stage, model_lbl, instrument, tid, trn_win, train_end_months)
+    """
+    tasks = []
+    for model_lbl, instrument, tid, trn_win in ittl.product(model_lbls, instruments, tids, train_windows):
+        if stage == "train" and warm_start:
+            tasks.append((stage, model_lbl, instrument, tid, trn_win, tuple(iter_months)))
+        else:
+            tasks += [(stage, model_lbl, instrument, tid, trn_win, (m,)) for m in iter_months]
+    return tasks
+
+
+def cal_ml_task_costs(tasks: list[tuple], calendar: CCalendarMonthly, features_and_return_lib,
+                      past_timings: dict[tuple, float] | None = None) -> list[float]:
+    """
+    cost of a task is the number of rows it reads: rows of train windows for "train",
+    and rows of test months for "test". If a task was timed in a past run, its seconds are used
+    instead, and the rows of other tasks are converted to seconds by the median seconds per row.
+
+    :param tasks: from get_ml_tasks
+    :param calendar:
+    :param features_and_return_lib: any reader with read
+    :param past_timings: {task: seconds}
+    :return: costs, in the same order as tasks
+    """
+    # --- cumulative rows by trade date of each (instrument, tid) pair
+    src_df = features_and_return_lib.read(t_value_columns=["trade_date", "instrument", "tid"])
+    src_df["trade_date"] = src_df["trade_date"].astype(str)
+    pair_counts = src_df.groupby(by=["instrument", "tid", "trade_date"]).size()
+
+    cum_rows = {}
+
+    def _rows(instrument: str | None, tid: str | None, bgn: str, end: str) -> int:
+        if (instrument, tid) not in cum_rows:
+            counts = pair_counts
+            if instrument is not None:
+                counts = counts[counts.index.get_level_values("instrument") == instrument]
+            if tid is not None:
+                counts = counts[counts.index.get_level_values("tid") == tid]
+            by_date = counts.groupby(level="trade_date").sum().sort_index()
+            cum_rows[(instrument, tid)] = (by_date.index.to_numpy(dtype=str), np.append(0, by_date.cumsum().to_numpy()))
+        dates, cum = cum_rows[(instrument, tid)]
+        return int(cum[np.searchsorted(dates, end, side="right")] - cum[np.searchsorted(dates, bgn, side="left")])
+
+    rows = []
+    for stage, model_lbl, instrument, tid, trn_win, train_end_months in tasks:
+        task_rows = 0
+        for train_end_month in train_end_months:
+            if stage == "train":
+                bgn, end = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+            else:
+                test_month = calendar.get_next_month(train_end_month, 1)
+                bgn, end = calendar.get_first_date_of_month(test_month), calendar.get_last_date_of_month(test_month)
+            task_rows += _rows(instrument, tid, bgn, end)
+        rows.append(task_rows)
+
+    if not past_timings:
+        return [float(_) for _ in rows]
+    secs_per_row = [past_timings[t] / r for t, r in zip(tasks, rows) if t in past_timings and r > 0]
+    secs_per_row = float(np.median(secs_per_row)) if secs_per_row else 1.0
+    return [past_timings.get(t, r * secs_per_row) for t, r in zip(tasks, rows)]
+
+
+def load_task_timings(models_dir: str, stage: str) -> dict[tuple, float]:
+    task_timings_path = os.path.join(models_dir, "fit_logs", task_timings_file)
+    if not os.path.exists(task_timings_path):
+        return {}
+    timings_df = pd.read_csv(task_timings_path, dtype={"instrument": str, "tid": str, "train_end_months": str})
+    timings_df = timings_df.loc[timings_df["stage"] == stage].replace({np.nan: None})
+    return {
+        (r["stage"], r["model_lbl"], r["instrument"], r["tid"], int(r["trn_win"]), tuple(r["train_end_months"].split("|"))): r["seconds"]
+        for r in timings_df.to_dict(orient="records")
+    }
+
+
+def save_task_timings(models_dir: str, stage: str, timings: dict[tuple, float]):
+    check_and_mkdir(fit_logs_dir := os.path.join(models_dir, "fit_logs"))
+    task_timings_path = os.path.join(fit_logs_dir, task_timings_file)
+    timings_df = pd.DataFrame(
+        [(s, m, i, t, w, "|".join(months), seconds) for (s, m, i, t, w, months), seconds in timings.items()],
+        columns=["stage", "model_lbl", "instrument", "tid", "trn_win", "train_end_months", "seconds"]
+    )
+    if os.path.exists(task_timings_path):
+        old_df = pd.read_csv(task_timings_path, dtype={"instrument": str, "tid": str, "train_end_months": str})
+        timings_df = pd.concat([old_df.loc[old_df["stage"] != stage], timings_df], axis=0, ignore_index=True)
+    timings_df.to_csv(task_timings_path, index=False, float_format="%.6f")
+    return 0
+
+
+# --- calendar and features reader of a pool worker, loaded once by the initializer
+_worker_env = {}
+
+
+def _init_ml_worker(env_kwargs: dict, features_panel: CFeaturesPanel | None):
+    if features_panel is None:
+        features_and_return_lib = get_features_and_return_lib(
+            env_kwargs["features_and_return_dir"], env_kwargs["sqlite3_tables"], env_kwargs["features_lib_type"])
+    else:
+        features_and_return_lib = features_panel
+    _worker_env.update({
+        "calendar": CCalendarMonthly(env_kwargs["calendar_path"]),
+        "features_and_return_lib": features_and_return_lib,
+        "models_dir": env_kwargs["models_dir"],
+        "x_lbls": env_kwargs["x_lbls"],
+        "y_lbls": env_kwargs["y_lbls"],
+        "warm_start": env_kwargs["warm_start"],
+        "model_store": CModelStore(env_kwargs["models_dir"]),
+    })
+    Finalize(None, features_and_return_lib.close, exitpriority=16)
+    return 0
+
+
+def _process_target_fun_for_ml_task(task: tuple) -> tuple[tuple, float, list | None]:
+    stage, model_lbl, instrument, tid, trn_win, train_end_months = task
+    kwargs = dict(
+        instrument=instrument, tid=tid, trn_win=trn_win,
+        calendar=_worker_env["calendar"], features_and_return_lib=_worker_env["features_and_return_lib"],
+        models_dir=_worker_env["models_dir"], x_lbls=_worker_env["x_lbls"], y_lbls=_worker_env["y_lbls"],
+    )
+    t0 = time.time()
+    # sys.exit in a pool worker would kill the worker and hang the pool, so None is returned instead
+    try:
+        if stage == "train":
+            train_model = get_train_model(model_lbl, warm_start=_worker_env["warm_start"])
+            res = [train_one_month_funs[model_lbl](train_model=train_model, train_end_month=m, **kwargs)
+                   for m in train_end_months]
+        else:
+            res = [ml_model_test_one_month(model_lbl=model_lbl, train_end_month=m, model_store=_worker_env["model_store"], **kwargs)
+                   for m in train_end_months]
+    except SystemExit:
+        res = None
+    return task, time.time() - t0, res
+
+
+def save_ml_group_results(stage: str, grp_key: tuple, results: dict[str, dict | pd.DataFrame | None],
+                          models_dir: str, predictions_dir: str | None, sqlite3_tables: dict,
+                          warm_start: bool = False, merge: bool = False,
+                          predictions_store: CPredictionsStore | None = None):
+    """
+
+    :param stage: "train" or "test"
+    :param grp_key: (model_lbl, instrument, tid, trn_win)
+    :param results: {train_end_month: fit log or predictions}, None for months not fitted
+    :param models_dir:
+    :param predictions_dir:
+    :param sqlite3_tables:
+    :param warm_start:
+    :param merge: fit logs of other months in the existing file are kept, predictions are always merged by primary keys
+    :param predictions_store: if provided, predictions are appended to it instead of the db of pred_id
+    :return:
+    """
+    model_lbl, instrument, tid, trn_win = grp_key
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    ordered_results = [results[m] for m in sorted(results) if results[m] is not None]
+    if stage == "train":
+        check_and_mkdir(fit_logs_dir := os.path.join(models_dir, "fit_logs"))
+        fit_log_file = "{}-{}-{}-fit_log.csv".format(model_grp_id, model_lbl, "warm" if warm_start else "cold")
+        fit_log_df = pd.DataFrame(ordered_results)
+        if merge and os.path.exists(fit_log_path := os.path.join(fit_logs_dir, fit_log_file)):
+            exist_df = pd.read_csv(fit_log_path, dtype={"train_end_month": str})
+            if len(fit_log_df) > 0:
+                exist_df = exist_df.loc[~exist_df["train_end_month"].isin(fit_log_df["train_end_month"])]
+            fit_log_df = pd.concat([exist_df, fit_log_df], axis=0, ignore_index=True).sort_values(by="train_end_month", ignore_index=True)
+        fit_log_df.to_csv(os.path.join(fit_logs_dir, fit_log_file), index=False, float_format="%.6f")
+    elif predictions_store is not None:
+        for pred_df in ordered_results:
+            predictions_store.append(model_lbl, instrument, tid, trn_win, pred_df)
+    else:
+        pred_id = model_grp_id + "-pred-{}".format(model_lbl)
+        predictions_lib = CManagerLibWriter(
+            t_db_save_dir=predictions_dir,
+            t_db_name=pred_id + ".db",
+        )
+        predictions_lib.initialize_table(CTable(t_table_struct=sqlite3_tables[pred_id]))
+        for pred_df in ordered_results:
+            predictions_lib.update(t_update_df=pred_df, t_using_index=False)
+        predictions_lib.close()
+    return 0
+
+
+def multi_process_fun_for_ml_tasks(proc_num: int, stage: str,
+                                   model_lbls: list[str], instruments: list[str], tids: list[str], train_windows: list[int],
+                                   bgn_date: str, stp_date: str,
+                                   calendar_path: str,
+                                   features_and_return_dir: str, models_dir: str, predictions_dir: str | None,
+                                   sqlite3_tables: dict,
+                                   x_lbls: list, y_lbls: list,
+                                   features_lib_type: str = "sqlite",
+                                   use_features_panel: bool = False,
+                                   warm_start: bool = False,
+                                   predictions_lib_type: str = "sqlite",
+                                   ):
+    """
+    all (model, group, window, month) tasks of a stage are put in one queue, largest first,
+    and proc_num persistent workers take the next task once they are free, so a slow group
+    does not keep the other workers idle. Each worker loads the calendar and opens the features
+    reader once. The parent is the only writer of prediction dbs and fit logs, the outputs are
+    the same as multi_process_fun_for_ml_mlpr, multi_process_fun_for_ml_mlpc and multi_process_fun_for_ml_test.
+
+    :param proc_num: number of worker processes
+    :param stage: "train", with scalers from ml_normalize, or "test"
+    :param model_lbls:
+    :param instruments:
+    :param tids:
+    :param train_windows:
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param features_and_return_dir:
+    :param models_dir:
+    :param predictions_dir: necessary for "test"
+    :param sqlite3_tables:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :param features_lib_type: "sqlite" or "parquet"
+    :param use_features_panel: features are loaded once into a CFeaturesPanel in shared memory, and all workers read from it
+    :param warm_start: for "train", see ml_mlpr
+    :param predictions_lib_type: for "test", "sqlite" for a db per pred_id, "parquet" for one CPredictionsStore
+    :return:
+    """
+    if stage not in ("train", "test"):
+        print("... stage = {} is not supported".format(stage))
+        sys.exit()
+    if stage == "train" and (unsupported := [_ for _ in model_lbls if _ not in train_one_month_funs]):
+        print("... models {} are not supported".format(unsupported))
+        sys.exit()
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    calendar = CCalendarMonthly(calendar_path)
+    iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
+
+    # --- tasks, largest first
+    features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+    tasks = get_ml_tasks(stage, model_lbls, instruments, tids, train_windows, iter_months, warm_start)
+    costs = cal_ml_task_costs(tasks, calendar, features_and_return_lib, load_task_timings(models_dir, stage))
+    tasks = [task for _, task in sorted(zip(costs, tasks), key=lambda z: -z[0])]
+    features_panel = CFeaturesPanel.from_lib(features_and_return_lib, x_lbls + y_lbls) if use_features_panel else None
+    features_and_return_lib.close()
+
+    # --- results of a group are kept until all its months are done, then saved in the order of months
+    grp_months_left = {}
+    for _, model_lbl, instrument, tid, trn_win, train_end_months in tasks:
+        grp_key = (model_lbl, instrument, tid, trn_win)
+        grp_months_left[grp_key] = grp_months_left.get(grp_key, 0) + len(train_end_months)
+    grp_results = {grp_key: {} for grp_key in grp_months_left}
+    predictions_store = get_predictions_store(predictions_dir) if stage == "test" and predictions_lib_type == "parquet" else None
+
+    env_kwargs = {
+        "calendar_path": calendar_path,
+        "features_and_return_dir": features_and_return_dir,
+        "sqlite3_tables": sqlite3_tables,
+        "features_lib_type": features_lib_type,
+        "models_dir": models_dir,
+        "x_lbls": x_lbls,
+        "y_lbls": y_lbls,
+        "warm_start": warm_start,
+    }
+    timings, t0 = {}, time.time()
+    with mp.Pool(processes=proc_num, initializer=_init_ml_worker, initargs=(env_kwargs, features_panel)) as pool:
+        for task, seconds, res in pool.imap_unordered(_process_target_fun_for_ml_task, tasks, chunksize=1):
+            if res is None:
+                print("... this program will terminate at once, please check again")
+                pool.terminate()
+                if features_panel is not None:
+                    features_panel.unlink()
+                sys.exit()
+            timings[task] = seconds
+            _, model_lbl, instrument, tid, trn_win, train_end_months = task
+            grp_key = (model_lbl, instrument, tid, trn_win)
+            grp_results[grp_key].update(zip(train_end_months, res))
+            grp_months_left[grp_key] -= len(train_end_months)
+            if grp_months_left[grp_key] == 0:
+                save_ml_group_results(stage, grp_key, grp_results.pop(grp_key), models_dir, predictions_dir, sqlite3_tables, warm_start,
+                                      predictions_store=predictions_store)
+        pool.close()
+        pool.join()
+
+    if predictions_store is not None:
+        predictions_store.close()
+        predictions_store.compact()
+
+    if features_panel is not None:
+        features_panel.unlink()
+    save_task_timings(models_dir, stage, timings)
+    print("... {} | {} tasks of {} | wall time = {:.2f}s, task time = {:.2f}s, {} workers".format(
+        dt.datetime.now(), len(tasks), stage, time.time() - t0, sum(timings.values()), proc_num))
+    return 0
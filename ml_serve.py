@@ -0,0 +1,397 @@
+"""
+a local inference service for the trading session, scalers and models of the month are preloaded
+as stacked arrays, minute bars of an instrument are fed as they come, and at each checkpoint the alphas are calculated
+by CIntradayFeatures and every applicable model is predicted.
+
+protocol: one json object per line, over a unix socket if the address is a path, or over localhost tcp
+if it is (host, port), like ("127.0.0.1", 6180), which also works on windows.
+
+    {"cmd": "bars", "trade_date": "20230522", "instrument": "IC.CFE", "contract": "IC2306.CFE",
+     "contract_multiplier": 200, "pre_settle": 6000.0, "pre_spot_close": 6010.0,
+     "bar_num": 0, "bars": [{"timestamp": ..., "high": ..., ...}, ...]}
+        bars are minute bars with keys in m01_tensor_fields, bar_num is the index of the first one in the day,
+        so the client could send all bars so far (bar_num = 0) or only the new ones, bars already fed are skipped.
+        -> {"signals": [{"tid", "timestamp", "alphas", "predictions": {pred_id: pred}}], "latency_ms", "late"}
+           timestamp is the one of the last bar before the checkpoint
+    {"cmd": "metrics"}
+        -> {"requests", "signals", "late", "p50_ms", "p99_ms", "signal_p50_ms", "signal_p99_ms"}
+    {"cmd": "shutdown"}
+
+a bad request is answered with {"error": message}, and the service keeps running. If a "bars" request fails
+while the bars are fed, the bars of its instrument are reset and should be resent from bar_num = 0.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import socketserver
+import threading
+import datetime as dt
+import numpy as np
+import pandas as pd
+import itertools as ittl
+from collections import deque
+from skyrim.whiterun import CCalendarMonthly
+from xfuns import CIntradayFeatures, m01_tensor_fields
+from xlibs import get_stacked_models, CStackedModels
+from dp_m01_cache import CM01Cache
+from dp_00_features_and_return import load_features_and_return_env
+
+
+class CInferenceModels(object):
+    def __init__(self, t_models_dir: str, t_train_end_month: str,
+                 t_instruments: list[str], t_tids: list[str], t_train_windows: list[int],
+                 t_model_lbls: list[str], t_x_lbls: list[str]):
+        """
+        scalers and models of t_train_end_month, which are used to predict the month after it,
+        loaded as CStackedModels from the file of ml_pack.ml_stack_models, or stacked from CModelStore.
+        Groups without a scaler, like the ones without enough data to be trained, are skipped.
+
+        :param t_instruments: like ["IC.CFE", ..., None], None for the group of all instruments
+        :param t_tids: like ["T01", ..., None], None for the group of all tids
+        """
+        self.m_train_end_month = t_train_end_month
+        self.m_train_windows = t_train_windows
+        self.m_model_lbls = t_model_lbls
+        self.m_x_lbls = t_x_lbls
+        self.m_groups = {"-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)])): (instrument, tid, trn_win)
+                         for instrument, tid, trn_win in ittl.product(t_instruments, t_tids, t_train_windows)}
+        self.m_stacked = get_stacked_models(t_models_dir, t_train_end_month, list(self.m_groups), t_model_lbls)
+
+        # --- (instrument, tid) -> stacked models of applicable groups, made at the first request
+        self.m_applicable: dict[tuple[str, str], CStackedModels] = {}
+
+    def get_model_num(self) -> int:
+        return int(sum(self.m_stacked.m_arrays[_ + "/has"].sum() for _ in self.m_model_lbls))
+
+    def get_group_num(self) -> int:
+        return len(self.m_stacked.m_grp_ids)
+
+    def _get_applicable(self, t_instrument: str, t_tid: str) -> CStackedModels:
+        if (stacked := self.m_applicable.get((t_instrument, t_tid))) is None:
+            grp_loc = [k for k, model_grp_id in enumerate(self.m_stacked.m_grp_ids)
+                       if self.m_groups[model_grp_id][0] in (t_instrument, None) and self.m_groups[model_grp_id][1] in (t_tid, None)]
+            self.m_applicable[(t_instrument, t_tid)] = stacked = self.m_stacked.take(grp_loc)
+        return stacked
+
+    def predict(self, t_instrument: str, t_tid: str, t_alphas: dict) -> dict[str, float]:
+        """
+
+        :param t_instrument: like "IC.CFE"
+        :param t_tid: like "T02"
+        :param t_alphas: output of CIntradayFeatures.update
+        :return: {pred_id: pred} of every applicable model, that is groups of (instrument, tid),
+                 (instrument, all tids), (all instruments, tid) and (all instruments, all tids) of each window,
+                 scored by one batched forward pass
+        """
+        stacked = self._get_applicable(t_instrument, t_tid)
+        x = np.array([[t_alphas[_] for _ in self.m_x_lbls]], dtype=np.float64)
+        preds = stacked.forward(x)
+        res = {}
+        for model_lbl in self.m_model_lbls:
+            for model_grp_id, has, pred in zip(stacked.m_grp_ids, stacked.m_arrays[model_lbl + "/has"], preds[model_lbl][:, 0]):
+                if has:
+                    res[model_grp_id + "-pred-{}".format(model_lbl)] = float(pred)
+        return res
+
+
+class CInferenceService(object):
+    def __init__(self, t_models: CInferenceModels,
+                 t_sub_win_width: int = 30, t_tot_bar_num: int = 240,
+                 t_latency_budget_ms: float = 50.0, t_metrics_size: int = 100000):
+        """
+        one CIntradayFeatures for each instrument of the trade date, requests are handled one at a time.
+
+        :param t_latency_budget_ms: requests slower than it are counted as late, and flagged in the response
+        :param t_metrics_size: latencies of the last t_metrics_size requests are kept for p50 and p99
+        """
+        self.m_models = t_models
+        self.m_sub_win_width, self.m_tot_bar_num = t_sub_win_width, t_tot_bar_num
+        self.m_latency_budget_ms = t_latency_budget_ms
+        self.m_engines: dict[str, tuple[str, CIntradayFeatures]] = {}  # instrument -> (trade date, engine)
+        self.m_lock = threading.Lock()
+
+        # --- metrics
+        self.m_request_num, self.m_signal_num, self.m_late_num = 0, 0, 0
+        self.m_latency = deque(maxlen=t_metrics_size)
+        self.m_signal_latency = deque(maxlen=t_metrics_size)
+
+    def _get_engine(self, t_request: dict) -> CIntradayFeatures:
+        instrument, trade_date = t_request["instrument"], t_request["trade_date"]
+        if (item := self.m_engines.get(instrument)) is None or item[0] != trade_date:
+            engine = CIntradayFeatures(
+                instrument=instrument, contract=t_request["contract"],
+                contract_multiplier=t_request["contract_multiplier"],
+                pre_settle=t_request["pre_settle"], pre_spot_close=t_request["pre_spot_close"],
+                sub_win_width=self.m_sub_win_width, tot_bar_num=self.m_tot_bar_num)
+            self.m_engines[instrument] = item = (trade_date, engine)
+        return item[1]
+
+    def on_bars(self, t_request: dict) -> dict:
+        t0 = time.perf_counter()
+        engine = self._get_engine(t_request)
+        bar_num, bars = t_request.get("bar_num", 0), t_request["bars"]
+        if bar_num > engine.m_bar_num:
+            return {"error": "{} bars of {} are fed, bars from {} are missing".format(
+                engine.m_bar_num, t_request["instrument"], engine.m_bar_num)}
+        if bar_num + len(bars) > self.m_tot_bar_num:
+            return {"error": "too many bars for {}, {} at most".format(t_request["instrument"], self.m_tot_bar_num)}
+
+        signals = []
+        for bar in bars[engine.m_bar_num - bar_num:]:
+            if (alphas := engine.update(bar)) is None:
+                continue
+            signals.append({
+                "tid": alphas["tid"],
+                "timestamp": bar["timestamp"],
+                "alphas": alphas,
+                "predictions": self.m_models.predict(t_request["instrument"], alphas["tid"], alphas),
+            })
+
+        latency_ms = (time.perf_counter() - t0) * 1000
+        late = latency_ms > self.m_latency_budget_ms
+        self.m_request_num += 1
+        self.m_late_num += int(late)
+        self.m_latency.append(latency_ms)
+        if signals:
+            self.m_signal_num += len(signals)
+            self.m_signal_latency.append(latency_ms)
+        return {"signals": signals, "latency_ms": latency_ms, "late": late}
+
+    def get_metrics(self) -> dict:
+        res = {"requests": self.m_request_num, "signals": self.m_signal_num, "late": self.m_late_num}
+        for prefix, latency in (("", self.m_latency), ("signal_", self.m_signal_latency)):
+            p50, p99 = np.percentile(latency, [50, 99]) if latency else (np.nan, np.nan)
+            res[prefix + "p50_ms"], res[prefix + "p99_ms"] = float(p50), float(p99)
+        return res
+
+    def handle(self, t_request: dict) -> dict:
+        with self.m_lock:
+            cmd = t_request.get("cmd")
+            try:
+                if cmd == "bars":
+                    return self.on_bars(t_request)
+                elif cmd == "metrics":
+                    return self.get_metrics()
+                else:
+                    return {"error": "unknown cmd {}".format(cmd)}
+            except Exception as e:
+                error = "bad request, {}: {}".format(type(e).__name__, e)
+                # bars before the failed one may be fed already, so the engine is dropped
+                # and the client should resend bars from bar_num = 0
+                if cmd == "bars" and isinstance(instrument := t_request.get("instrument"), str):
+                    if self.m_engines.pop(instrument, None) is not None:
+                        error += ", bars of {} are reset, please resend from bar_num = 0".format(instrument)
+                return {"error": error}
+
+
+def _make_server(serve_address: str | tuple[str, int], service: CInferenceService) -> socketserver.BaseServer:
+    class CHandler(socketserver.StreamRequestHandler):
+        def setup(self):
+            super().setup()
+            if isinstance(serve_address, tuple):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    request = {"cmd": None, "error": "bad json, {}".format(e)}
+                if not isinstance(request, dict):
+                    request = {"cmd": None, "error": "bad request, a json object is expected"}
+                if request.get("cmd") == "shutdown":
+                    self.wfile.write(b'{"shutdown": true}\n')
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                response = {"error": request["error"]} if "error" in request else service.handle(request)
+                self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+    if isinstance(serve_address, tuple):
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        return socketserver.ThreadingTCPServer(serve_address, CHandler)
+    if os.path.exists(serve_address):
+        os.remove(serve_address)
+    return socketserver.ThreadingUnixStreamServer(serve_address, CHandler)
+
+
+def ml_serve(serve_month: str,
+             calendar_path: str,
+             models_dir: str,
+             instruments: list[str], tids: list[str], train_windows: list[int],
+             model_lbls: list[str],
+             x_lbls: list,
+             serve_address: str | tuple[str, int],
+             sub_win_width: int = 30,
+             tot_bar_num: int = 240,
+             latency_budget_ms: float = 50.0,
+             ):
+    """
+    preload scalers and models trained at the month before serve_month, and serve until a "shutdown" request.
+
+    :param serve_month: format = [YYYYMM], the month of the trade date
+    :param calendar_path:
+    :param models_dir:
+    :param instruments: like ["IC.CFE", ..., None], None for the group of all instruments
+    :param tids: like ["T01", ..., None], None for the group of all tids
+    :param train_windows:
+    :param model_lbls: ["lm", "mlpr", "mlpc"]
+    :param x_lbls:
+    :param serve_address: path of a unix socket, or (host, port) of localhost tcp
+    :param sub_win_width: minutes between two checkpoints, same as the one of features of the models
+    :param tot_bar_num:
+    :param latency_budget_ms:
+    :return:
+    """
+    calendar = CCalendarMonthly(calendar_path)
+    train_end_month = calendar.get_next_month(serve_month, -1)
+
+    t0 = time.perf_counter()
+    models = CInferenceModels(
+        t_models_dir=models_dir, t_train_end_month=train_end_month,
+        t_instruments=instruments, t_tids=tids, t_train_windows=train_windows,
+        t_model_lbls=model_lbls, t_x_lbls=x_lbls)
+    if models.get_model_num() == 0:
+        print("... no model is trained @ {}, please check again".format(train_end_month))
+        print("... this program will terminate at once")
+        sys.exit()
+    print("... {} | {} models of {} groups @ {} are loaded in {:.2f} seconds |".format(
+        dt.datetime.now(), models.get_model_num(), models.get_group_num(), train_end_month, time.perf_counter() - t0))
+
+    service = CInferenceService(
+        t_models=models,
+        t_sub_win_width=sub_win_width, t_tot_bar_num=tot_bar_num,
+        t_latency_budget_ms=latency_budget_ms)
+    with _make_server(serve_address, service) as server:
+        print("... {} | serving @ {} |".format(dt.datetime.now(), serve_address))
+        server.serve_forever()
+    if isinstance(serve_address, str) and os.path.exists(serve_address):
+        os.remove(serve_address)
+    print("... {} | service stopped | {} |".format(dt.datetime.now(), service.get_metrics()))
+    return 0
+
+
+# --- replay client
+class CInferenceClient(object):
+    def __init__(self, t_serve_address: str | tuple[str, int]):
+        if isinstance(t_serve_address, tuple):
+            self.m_sock = socket.create_connection(t_serve_address)
+            self.m_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.m_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.m_sock.connect(t_serve_address)
+        self.m_rfile = self.m_sock.makefile("rb")
+
+    def request(self, t_request: dict) -> dict:
+        self.m_sock.sendall((json.dumps(t_request) + "\n").encode("utf-8"))
+        return json.loads(self.m_rfile.readline())
+
+    def close(self):
+        self.m_rfile.close()
+        self.m_sock.close()
+        return 0
+
+
+def _load_replay_bars(trade_date: str, env: dict, m01_cache: CM01Cache | None,
+                      tot_bar_num: int = 240) -> list[tuple[str, str, int, float, float, np.ndarray]]:
+    """
+
+    :return: a list of (instrument, contract, contract_multiplier, pre_settle, pre_spot_close, bars),
+             bars are of shape (tot_bar_num, len(m01_tensor_fields)), instruments without all bars are skipped
+    """
+    calendar, instru_info_table = env["calendar"], env["instru_info_table"]
+    spot_data_manager, futures_md_manager, major_minor_manager = \
+        env["spot_data_manager"], env["futures_md_manager"], env["major_minor_manager"]
+    prev_date = calendar.get_next_date(trade_date, -1)
+    m01_df = None if m01_cache is not None else env["m01_db"].read_by_date(
+        t_trade_date=trade_date, t_value_columns=["wind_code"] + list(m01_tensor_fields))
+
+    res = []
+    for _, equity_instru_id in env["equity_indexes"]:
+        try:
+            major_contract = major_minor_manager[equity_instru_id].at[trade_date, "n_contract"]
+            pre_settle = futures_md_manager[equity_instru_id].at[prev_date, major_contract]
+            pre_spot_close = spot_data_manager[equity_instru_id].at[prev_date, "close"]
+        except KeyError:
+            continue
+        if m01_cache is None:
+            bars_df = m01_df.loc[m01_df["wind_code"] == major_contract].sort_values(by="timestamp")
+            bars = bars_df[list(m01_tensor_fields)].to_numpy(dtype=np.float64)
+        else:
+            bars, cached_contracts, bar_num = m01_cache.get_bars([trade_date], equity_instru_id)
+            m01_cache.check_contracts([trade_date], equity_instru_id, [major_contract], cached_contracts)
+            bars = bars[0] if bar_num[0] == tot_bar_num else bars[0:0]
+        if len(bars) != tot_bar_num:
+            continue
+        res.append((equity_instru_id, major_contract, instru_info_table.get_multiplier(equity_instru_id),
+                    float(pre_settle), float(pre_spot_close), bars))
+    return res
+
+
+def ml_serve_replay(bgn_date: str, stp_date: str,
+                    serve_address: str | tuple[str, int],
+                    equity_indexes: list[str],
+                    calendar_path: str,
+                    features_env_kwargs: dict,
+                    equity_index_by_instrument_dir: str,
+                    m01_cache_dir: str | None = None,
+                    tot_bar_num: int = 240,
+                    shutdown: bool = False,
+                    ) -> pd.DataFrame:
+    """
+    drive a running service with historical minute bars, all instruments are sent one bar at a time,
+    minute by minute, like the session. Round trip latencies are measured by the client.
+
+    :param bgn_date: format = [YYYYMMDD], dates should be in the serve_month of the service
+    :param stp_date: format = [YYYYMMDD]
+    :param serve_address: path of a unix socket, or (host, port) of localhost tcp
+    :param equity_indexes:
+    :param calendar_path:
+    :param features_env_kwargs: arguments of load_features_and_return_env other than
+                                equity_indexes, calendar_path and equity_index_by_instrument_dir
+    :param equity_index_by_instrument_dir:
+    :param m01_cache_dir: if provided, minute bars are sliced from the store of dp_m01_cache instead of em01
+    :param tot_bar_num:
+    :param shutdown: stop the service after replay
+    :return: trade_date, instrument, contract, tid, timestamp, pred_id, pred of all signals
+    """
+    env = load_features_and_return_env(
+        equity_indexes=equity_indexes, calendar_path=calendar_path,
+        equity_index_by_instrument_dir=equity_index_by_instrument_dir, **features_env_kwargs)
+    m01_cache = None if m01_cache_dir is None else CM01Cache(m01_cache_dir, major_minor_dir=features_env_kwargs["major_minor_dir"])
+    client = CInferenceClient(serve_address)
+
+    res, round_trip_ms = [], []
+    for trade_date in env["calendar"].get_iter_list(bgn_date, stp_date, True):
+        day_bars = _load_replay_bars(trade_date, env, m01_cache, tot_bar_num)
+        day_records = [pd.DataFrame(bars, columns=list(m01_tensor_fields)).astype(
+            {"timestamp": np.int64}).to_dict(orient="records") for *_, bars in day_bars]
+        for k in range(tot_bar_num):
+            for (instrument, contract, contract_multiplier, pre_settle, pre_spot_close, _), records in zip(day_bars, day_records):
+                t0 = time.perf_counter()
+                response = client.request({
+                    "cmd": "bars", "trade_date": trade_date, "instrument": instrument, "contract": contract,
+                    "contract_multiplier": contract_multiplier, "pre_settle": pre_settle, "pre_spot_close": pre_spot_close,
+                    "bar_num": k, "bars": [records[k]],
+                })
+                round_trip_ms.append((time.perf_counter() - t0) * 1000)
+                if "error" in response:
+                    print("... {} | {} | {} |".format(trade_date, instrument, response["error"]))
+                    continue
+                for signal in response["signals"]:
+                    for pred_id, pred in signal["predictions"].items():
+                        res.append((trade_date, instrument, contract, signal["tid"], signal["timestamp"], pred_id, pred))
+        print("... {} | {} | {} instruments replayed |".format(dt.datetime.now(), trade_date, len(day_bars)))
+
+    metrics = client.request({"cmd": "metrics"})
+    if shutdown:
+        client.request({"cmd": "shutdown"})
+    client.close()
+
+    p50, p99 = np.percentile(round_trip_ms, [50, 99]) if round_trip_ms else (np.nan, np.nan)
+    print("... round trip of {} requests | p50 = {:.3f} ms | p99 = {:.3f} ms |".format(len(round_trip_ms), p50, p99))
+    print("... service | {} |".format(metrics))
+    return pd.DataFrame(res, columns=["trade_date", "instrument", "contract", "tid", "timestamp", "pred_id", "pred"])
+
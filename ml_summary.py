@@ -4,6 +4,9 @@ import numpy as np
 import pandas as pd
 from skyrim.falkreath import CManagerLibReader, CTable
 from skyrim.riften import CNAV
+from xlibs import get_predictions_store
+
+summary_state_file = "summary.state.csv.gz"
 
 
 def cal_precision_and_recall(t_value: int, t_y_actu: np.ndarray, t_y_pred: np.ndarray):
@@ -108,6 +111,243 @@ def ml_summary(model_lbl: str,
             instrument if instrument else "",
             tid if tid else "",
             train_window))
+    save_summary(model_lbl, res_models, res_trades, research_summary_dir)
+    return 0
+
+
+def cal_precision_and_recall_grouped(t_grp: np.ndarray, t_grp_num: int, t_y_actu: np.ndarray, t_y_pred: np.ndarray) -> pd.DataFrame:
+    """
+    the same metrics as cal_precision_and_recall with t_value = 1, for all groups at once
+
+    :param t_grp: group code of each row, in [0, t_grp_num)
+    :param t_grp_num:
+    :param t_y_actu: 0 or 1
+    :param t_y_pred: 0 or 1
+    :return: a row for each group, metrics of groups without rows are nan
+    """
+    cell = t_grp * 4 + t_y_actu * 2 + t_y_pred
+    return cal_precision_and_recall_from_counts(np.bincount(cell, minlength=t_grp_num * 4).reshape(t_grp_num, 4))
+
+
+def cal_precision_and_recall_from_counts(t_counts: np.ndarray) -> pd.DataFrame:
+    """
+
+    :param t_counts: shape = (groups, 4), columns are counts of tn, fp, fn, tp with t_value = 1
+    :return:
+    """
+    counts = t_counts.astype(np.float64)
+    _tn, _fp, _fn, _tp = counts[:, 0], counts[:, 1], counts[:, 2], counts[:, 3]
+    _obs = counts.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame({
+            "obs": _obs.astype(int), "win_rate": (_tp + _tn) / _obs,
+            "p": (_tp + _fn) / _obs, "pos_precision": _tp / (_tp + _fp), "pos_recall": _tp / (_tp + _fn),
+            "q": (_tn + _fp) / _obs, "neg_precision": _tn / (_tn + _fn), "neg_recall": _tn / (_tn + _fp),
+        })
+
+
+def load_predictions_for_summary(grp_keys: list[tuple],
+                                 predictions_dir: str,
+                                 sqlite3_tables: dict,
+                                 predictions_lib_type: str = "sqlite",
+                                 after_dates: list[str] | None = None,
+                                 ) -> pd.DataFrame:
+    """
+
+    :param grp_keys: [(model_lbl, instrument, tid, trn_win)], None for pooled groups
+    :param predictions_dir:
+    :param sqlite3_tables:
+    :param predictions_lib_type: "parquet" to read all models from the CPredictionsStore in one scan, else a db per pred_id
+    :param after_dates: if provided, only rows of a group with trade_date > its date are read, "" for all rows
+    :return: a long frame with columns grp (index of grp_keys), trade_date, rtm and pred, rows of a group are in the order of the lib
+    """
+    value_columns = ["trade_date", "rtm", "pred"]
+    if predictions_lib_type == "parquet":
+        src_df = get_predictions_store(predictions_dir).read(
+            t_value_columns=["model_lbl", "instrument_grp", "tid_grp", "tmw"] + value_columns,
+            t_model_lbls=sorted(set(_[0] for _ in grp_keys)),
+            t_bgn_date=min(after_dates) if after_dates and min(after_dates) else None,
+        )
+        keys_idx = pd.MultiIndex.from_tuples([(m, i if i else "", t if t else "", w) for m, i, t, w in grp_keys])
+        src_df["grp"] = keys_idx.get_indexer(pd.MultiIndex.from_frame(src_df[["model_lbl", "instrument_grp", "tid_grp", "tmw"]]))
+        is_kept = src_df["grp"].to_numpy() >= 0
+        if after_dates is not None:
+            is_kept &= src_df["trade_date"].to_numpy(dtype=object) > np.array(after_dates, dtype=object)[np.maximum(src_df["grp"].to_numpy(), 0)]
+        return src_df.loc[is_kept, ["grp"] + value_columns].reset_index(drop=True)
+
+    dfs = []
+    for grp, (model_lbl, instrument, tid, trn_win) in enumerate(grp_keys):
+        model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+        pred_id = model_grp_id + "-pred-{}".format(model_lbl)
+        predictions_lib = CManagerLibReader(
+            t_db_save_dir=predictions_dir,
+            t_db_name=pred_id + ".db",
+        )
+        predictions_lib.set_default(CTable(t_table_struct=sqlite3_tables[pred_id]).m_table_name)
+        if after_dates is not None and after_dates[grp]:
+            grp_df = predictions_lib.read_by_conditions(t_conditions=[("trade_date", ">", after_dates[grp])], t_value_columns=value_columns)
+        else:
+            grp_df = predictions_lib.read(t_value_columns=value_columns)
+        dfs.append(grp_df.assign(grp=grp))
+        predictions_lib.close()
+    return pd.concat(dfs, axis=0, ignore_index=True)[["grp"] + value_columns]
+
+
+def ml_summary_all(model_lbls: list[str],
+                   instruments_universe: list[str], tids: list[str], train_windows: list[int],
+                   sqlite3_tables: dict,
+                   predictions_dir: str, navs_dir: str,
+                   research_summary_dir: str,
+                   cost_rate: float, ret_scale: int = 100,
+                   predictions_lib_type: str = "sqlite",
+                   ):
+    """
+    the same outputs as ml_summary of each model in model_lbls. Predictions of all groups of all models
+    are loaded into one long frame, classification metrics come from one bincount, and daily returns
+    from one grouped mean, only indicators of navs are calculated group by group with CNAV.
+
+    :param predictions_lib_type: "sqlite" or "parquet", see load_predictions_for_summary
+    """
+    grp_keys = [(m, i, t, w) for m in model_lbls for i, t, w in ittl.product(instruments_universe + [None], tids + [None], train_windows)]
+    src_df = load_predictions_for_summary(grp_keys, predictions_dir, sqlite3_tables, predictions_lib_type)
+    grp = src_df["grp"].to_numpy()
+    pred = src_df["pred"].to_numpy(dtype=np.float64)
+    is_mlpc = np.array([m == "mlpc" for m, _, _, _ in grp_keys])[grp]
+    pred = np.where(is_mlpc, pred * 2 - 1, pred)
+    rtm = src_df["rtm"].to_numpy(dtype=np.float64)
+
+    # classify models
+    cls_df = cal_precision_and_recall_grouped(grp, len(grp_keys), (rtm >= 0).astype(int), (pred >= 0).astype(int))
+
+    # simu trades
+    raw_ret_df = pd.DataFrame({"grp": grp, "trade_date": src_df["trade_date"], "raw_ret": np.sign(pred) * rtm / ret_scale})
+    ret_df = raw_ret_df.groupby(["grp", "trade_date"])[["raw_ret"]].mean()
+    ret_df["net_ret"] = ret_df["raw_ret"] - cost_rate
+    ret_df["nav"] = (ret_df["net_ret"] + 1).groupby(level="grp").cumprod()
+
+    res = {m: ([], []) for m in model_lbls}
+    for g, grp_ret_df in ret_df.groupby(level="grp"):
+        model_lbl, instrument, tid, trn_win = grp_keys[g]
+        summary_header = {"model": model_lbl, "instrument": instrument, "tid": tid, "tmw": trn_win}
+        grp_ret_df = grp_ret_df.droplevel("grp")
+        nav = CNAV(t_raw_nav_srs=grp_ret_df["net_ret"], t_annual_rf_rate=0, t_type="RET", t_freq="D")
+        nav.cal_all_indicators()
+        res[model_lbl][0].append(dict(summary_header, **cls_df.iloc[g].to_dict()) | {"obs": int(cls_df.at[g, "obs"])})
+        res[model_lbl][1].append(dict(summary_header, **nav.to_dict(t_type="eng")))
+
+        model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+        nav_file = "{}-pred-{}-nav.csv.gz".format(model_grp_id, model_lbl)
+        grp_ret_df[["net_ret", "nav"]].to_csv(os.path.join(navs_dir, nav_file), float_format="%.8f")
+
+    for model_lbl, (res_models, res_trades) in res.items():
+        save_summary(model_lbl, res_models, res_trades, research_summary_dir)
+        print("... | {:>8s} | {:>4d} groups summarized |".format(model_lbl, len(res_models)))
+    return 0
+
+
+def ml_summary_incremental(model_lbls: list[str],
+                           instruments_universe: list[str], tids: list[str], train_windows: list[int],
+                           sqlite3_tables: dict,
+                           predictions_dir: str, navs_dir: str,
+                           research_summary_dir: str,
+                           cost_rate: float, ret_scale: int = 100,
+                           predictions_lib_type: str = "sqlite",
+                           ):
+    """
+    summaries are updated from a state of each group saved in summary_state_file, only predictions
+    after the last trade_date of the state are read, and only their rows are appended to nav files,
+    so the cost grows with new data. The state keeps confusion counts, days, sum and sum of squares of
+    net returns, the last nav, the peak of nav, which starts from 1, and the max drawdown. Predictions of dates already in the state
+    are taken as final, remove summary_state_file to rebuild it from all predictions, like after a retrain.
+
+    outputs:
+        summary.{model}.models.csv.gz, the same as ml_summary
+        summary.{model}.trades.incremental.csv.gz, indicators from the state instead of CNAV,
+        navs are the same as ml_summary
+
+    :param predictions_lib_type: "sqlite" or "parquet", see load_predictions_for_summary
+    """
+    grp_keys = [(m, i, t, w) for m in model_lbls for i, t, w in ittl.product(instruments_universe + [None], tids + [None], train_windows)]
+
+    # --- load state, groups not in it start from empty
+    state_df = pd.DataFrame({
+        "model": [_[0] for _ in grp_keys], "instrument": [_[1] for _ in grp_keys], "tid": [_[2] for _ in grp_keys], "tmw": [_[3] for _ in grp_keys],
+        "last_trade_date": "", "tn": 0, "fp": 0, "fn": 0, "tp": 0,
+        "days": 0, "ret_sum": 0.0, "ret_sq_sum": 0.0, "nav": 1.0, "nav_peak": 1.0, "max_drawdown": 0.0,
+    })
+    state_keys = ["model", "instrument", "tid", "tmw"]
+    if os.path.exists(state_path := os.path.join(research_summary_dir, summary_state_file)):
+        saved_df = pd.read_csv(state_path, dtype={"last_trade_date": str, "instrument": str, "tid": str}, keep_default_na=False)
+        saved_df[["instrument", "tid"]] = saved_df[["instrument", "tid"]].replace("", None)
+        state_df = state_df[state_keys].merge(saved_df, on=state_keys, how="left").fillna(state_df).astype(state_df.dtypes)
+    src_df = load_predictions_for_summary(grp_keys, predictions_dir, sqlite3_tables, predictions_lib_type,
+                                          after_dates=state_df["last_trade_date"].tolist())
+    grp = src_df["grp"].to_numpy()
+    pred = src_df["pred"].to_numpy(dtype=np.float64)
+    is_mlpc = np.array([m == "mlpc" for m, _, _, _ in grp_keys])[grp]
+    pred = np.where(is_mlpc, pred * 2 - 1, pred)
+    rtm = src_df["rtm"].to_numpy(dtype=np.float64)
+
+    # --- update confusion counts
+    cell = grp * 4 + (rtm >= 0).astype(int) * 2 + (pred >= 0).astype(int)
+    state_df[["tn", "fp", "fn", "tp"]] += np.bincount(cell, minlength=len(grp_keys) * 4).reshape(len(grp_keys), 4)
+
+    # --- update navs, the last nav of the state is the seed of cumprod, so navs are the same as a full run
+    raw_ret_df = pd.DataFrame({"grp": grp, "trade_date": src_df["trade_date"], "raw_ret": np.sign(pred) * rtm / ret_scale})
+    ret_df = raw_ret_df.groupby(["grp", "trade_date"])[["raw_ret"]].mean().reset_index()
+    ret_df["net_ret"] = ret_df["raw_ret"] - cost_rate
+    updated = ret_df["grp"].unique()
+    seed_df = pd.DataFrame({"grp": updated, "trade_date": "", "net_ret": np.nan, "growth": state_df["nav"].to_numpy()[updated]})
+    ret_df["growth"] = ret_df["net_ret"] + 1
+    nav_df = pd.concat([seed_df, ret_df[["grp", "trade_date", "net_ret", "growth"]]], axis=0).sort_values(by=["grp", "trade_date"], kind="stable")
+    nav_df["nav"] = nav_df.groupby("grp")["growth"].cumprod()
+    nav_df = nav_df.loc[nav_df["trade_date"] != ""]
+    nav_df["nav_peak"] = np.maximum(nav_df.groupby("grp")["nav"].cummax(), state_df["nav_peak"].to_numpy()[nav_df["grp"]])
+    nav_df["drawdown"] = 1 - nav_df["nav"] / nav_df["nav_peak"]
+    nav_df["ret_sq"] = nav_df["net_ret"] ** 2
+    agg_df = nav_df.groupby("grp").agg(
+        last_trade_date=("trade_date", "last"), days=("net_ret", "size"), ret_sum=("net_ret", "sum"), ret_sq_sum=("ret_sq", "sum"),
+        nav=("nav", "last"), nav_peak=("nav_peak", "last"), max_drawdown=("drawdown", "max"),
+    )
+    state_df.loc[agg_df.index, "last_trade_date"] = agg_df["last_trade_date"]
+    state_df.loc[agg_df.index, ["days", "ret_sum", "ret_sq_sum"]] += agg_df[["days", "ret_sum", "ret_sq_sum"]].to_numpy()
+    state_df.loc[agg_df.index, ["nav", "nav_peak"]] = agg_df[["nav", "nav_peak"]].to_numpy()
+    state_df.loc[agg_df.index, "max_drawdown"] = np.maximum(state_df.loc[agg_df.index, "max_drawdown"], agg_df["max_drawdown"])
+
+    # --- append navs
+    for g, grp_nav_df in nav_df.groupby("grp"):
+        model_lbl, instrument, tid, trn_win = grp_keys[g]
+        model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+        nav_path = os.path.join(navs_dir, "{}-pred-{}-nav.csv.gz".format(model_grp_id, model_lbl))
+        is_new = state_df.at[g, "days"] == len(grp_nav_df)
+        grp_nav_df.set_index("trade_date")[["net_ret", "nav"]].to_csv(
+            nav_path, float_format="%.8f", mode="w" if is_new else "a", header=is_new)
+    state_df.to_csv(state_path, index=False)
+
+    # --- summaries
+    cls_df = cal_precision_and_recall_from_counts(state_df[["tn", "fp", "fn", "tp"]].to_numpy())
+    days = state_df["days"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret_mean = state_df["ret_sum"].to_numpy() / days
+        ret_std = np.sqrt(np.maximum(state_df["ret_sq_sum"].to_numpy() - days * ret_mean ** 2, 0) / (days - 1))
+        trades_df = pd.DataFrame({
+            "days": state_df["days"], "hold_period_return": state_df["nav"] - 1,
+            "annual_return": ret_mean * 250, "annual_volatility": ret_std * np.sqrt(250),
+            "sharpe_ratio": ret_mean / ret_std * np.sqrt(250), "max_drawdown": state_df["max_drawdown"],
+        })
+    header_df = state_df[state_keys]
+    for model_lbl in model_lbls:
+        is_model = (header_df["model"] == model_lbl).to_numpy()
+        res_models_df = pd.concat([header_df.loc[is_model], cls_df.loc[is_model]], axis=1)
+        res_trades_df = pd.concat([header_df.loc[is_model], trades_df.loc[is_model]], axis=1)
+        res_models_df.to_csv(os.path.join(research_summary_dir, "summary.{}.models.csv.gz".format(model_lbl)), index=False, float_format="%.6f")
+        res_trades_df.to_csv(os.path.join(research_summary_dir, "summary.{}.trades.incremental.csv.gz".format(model_lbl)), index=False, float_format="%.6f")
+        print("... | {:>8s} | {:>4d} groups summarized, {} new days |".format(
+            model_lbl, is_model.sum(), agg_df["days"].loc[agg_df.index.isin(np.flatnonzero(is_model))].sum()))
+    return 0
+
+
+def save_summary(model_lbl: str, res_models: list[dict], res_trades: list[dict], research_summary_dir: str):
     res_models_df, res_trades_df = pd.DataFrame(res_models), pd.DataFrame(res_trades)
 
     res_models_file = "summary.{}.models.csv.gz".format(model_lbl)
@@ -1,11 +1,221 @@
 import os
 import datetime as dt
 import numpy as np
+import pandas as pd
 import itertools as ittl
 import multiprocessing as mp
-from skyrim.falkreath import CManagerLibReader, CManagerLibWriter, CTable
+from skyrim.falkreath import CManagerLibWriter, CTable
 from skyrim.whiterun import CCalendarMonthly
 from xfuns import read_from_sio_obj
+from xlibs import get_features_and_return_lib, get_predictions_store, get_stacked_models, CFeaturesPanel, CModelStore, CLruCache, CPredictionsStore
+
+
+# --- process level caches, ml_model_test of "lm", "mlpr" and "mlpc" on a group in one process share
+# the scaler and the normalized test rows of each month, keys are (models_dir, file, mtime) and
+# (models_dir, model_grp_id, month, mtime of scaler), or (models_dir, model_grp_id, months, mtimes of scalers)
+# for the test rows of ml_model_test_months, so artifacts retrained in a long-lived worker are read again
+ml_test_caches = {
+    "artifacts": CLruCache(t_max_size=512),
+    "test_data": CLruCache(t_max_size=128),
+}
+
+
+def _read_artifact(models_dir: str, train_end_month: str, artifact_file: str, model_store: CModelStore | None = None):
+    if model_store is None:
+        return read_from_sio_obj(os.path.join(models_dir, train_end_month[0:4], train_end_month, artifact_file))
+    return model_store.read(train_end_month, artifact_file)
+
+
+def _get_artifact_mtime(models_dir: str, train_end_month: str, artifact_file: str,
+                        model_store: CModelStore | None = None) -> float | None:
+    """
+
+    :return: mtime of the skops file, or of the model store if the file is removed after packing, None if neither exists
+    """
+    artifact_path = os.path.join(models_dir, train_end_month[0:4], train_end_month, artifact_file)
+    if os.path.exists(artifact_path):
+        return os.path.getmtime(artifact_path)
+    if model_store is not None and os.path.exists(store_path := model_store.get_store_path(train_end_month)):
+        return os.path.getmtime(store_path)
+    return None
+
+
+def _get_cached_artifact(models_dir: str, train_end_month: str, artifact_file: str, model_store: CModelStore | None = None):
+    return ml_test_caches["artifacts"].get(
+        (models_dir, artifact_file, _get_artifact_mtime(models_dir, train_end_month, artifact_file, model_store)),
+        lambda: _read_artifact(models_dir, train_end_month, artifact_file, model_store))
+
+
+def _load_test_data(instrument: str | None, tid: str | None, trn_win: int,
+                    train_end_month: str,
+                    calendar: CCalendarMonthly, features_and_return_lib,
+                    models_dir: str,
+                    x_lbls: list, y_lbls: list,
+                    model_store: CModelStore | None = None,
+                    ) -> tuple[pd.DataFrame, np.ndarray] | None:
+    """
+
+    :return: (header of test rows with "rtm", normalized x of test rows), None if the test month is empty or the scaler is not found
+    """
+    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    pred_header_cols = ["trade_date", "instrument", "contract", "tid", "timestamp"]
+    test_month = calendar.get_next_month(train_end_month, 1)
+
+    test_bgn_date, test_end_date = calendar.get_first_date_of_month(test_month), calendar.get_last_date_of_month(test_month)
+    conds = init_conds + [
+        ("trade_date", ">=", test_bgn_date),
+        ("trade_date", "<=", test_end_date),
+    ]
+    src_df = features_and_return_lib.read_by_conditions(
+        t_conditions=conds,
+        t_value_columns=pred_header_cols + x_lbls + y_lbls
+    )
+    if len(src_df) == 0:
+        return None
+
+    # --- normalize
+    scaler_file = "{}-{}.scl".format(model_grp_id, train_end_month)
+    try:
+        scaler = _get_cached_artifact(models_dir, train_end_month, scaler_file, model_store)
+    except FileNotFoundError:
+        return None
+    x_test = np.nan_to_num(scaler.transform(src_df[x_lbls]), nan=0)
+    return src_df[pred_header_cols + ["rtm"]], x_test
+
+
+def ml_model_test_one_month(model_lbl: str, instrument: str | None, tid: str | None, trn_win: int,
+                            train_end_month: str,
+                            calendar: CCalendarMonthly, features_and_return_lib,
+                            models_dir: str,
+                            x_lbls: list, y_lbls: list,
+                            model_store: CModelStore | None = None,
+                            ) -> pd.DataFrame | None:
+    """
+    predict the month after train_end_month, with the scaler and model of train_end_month.
+    The scaler, the model and the normalized test rows are cached in ml_test_caches.
+
+    :param model_lbl: ["lm", "mlpc", "mlpr"]
+    :param instrument: like IC.CFE
+    :param tid: ['T01',...,'T07']
+    :param trn_win: [6,12,24]
+    :param train_end_month: format = [YYYYMM]
+    :param calendar:
+    :param features_and_return_lib: a reader with read_by_conditions
+    :param models_dir:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :param model_store: if provided, the scaler and the model are read from it, else from skops files
+    :return: predictions with columns pred_header_cols + ["rtm", "pred"], None if the test month is empty or the scaler is not found
+    """
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+
+    # --- load test rows and normalize
+    scaler_file = "{}-{}.scl".format(model_grp_id, train_end_month)
+    test_data = ml_test_caches["test_data"].get(
+        (models_dir, model_grp_id, train_end_month, _get_artifact_mtime(models_dir, train_end_month, scaler_file, model_store)),
+        lambda: _load_test_data(
+            instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=train_end_month,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls, model_store=model_store,
+        ))
+    if test_data is None:
+        return None
+    header_df, x_test = test_data
+
+    # --- load model
+    train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
+    train_model = _get_cached_artifact(models_dir, train_end_month, train_model_file, model_store)
+
+    # --- prediction
+    return header_df.assign(pred=train_model.predict(X=x_test))
+
+
+def _load_test_data_months(instrument: str | None, tid: str | None, trn_win: int,
+                           train_end_months: list[str],
+                           calendar: CCalendarMonthly, features_and_return_lib,
+                           models_dir: str,
+                           x_lbls: list, y_lbls: list,
+                           model_store: CModelStore | None = None,
+                           ) -> tuple[pd.DataFrame, np.ndarray, dict[str, np.ndarray]] | None:
+    """
+    test rows of all months after train_end_months are read in one query, and split by
+    an index of month to rows, each slice is normalized by the scaler of its train_end_month
+
+    :return: (header of test rows with "rtm", normalized x of test rows, {train_end_month: rows of its test month}),
+             None if there are no test rows. Months without test rows or scalers are not in the dict.
+    """
+    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    pred_header_cols = ["trade_date", "instrument", "contract", "tid", "timestamp"]
+    test_months = [calendar.get_next_month(m, 1) for m in train_end_months]
+
+    conds = init_conds + [
+        ("trade_date", ">=", calendar.get_first_date_of_month(min(test_months))),
+        ("trade_date", "<=", calendar.get_last_date_of_month(max(test_months))),
+    ]
+    src_df = features_and_return_lib.read_by_conditions(
+        t_conditions=conds,
+        t_value_columns=pred_header_cols + x_lbls + y_lbls
+    )
+    if len(src_df) == 0:
+        return None
+
+    # --- normalize each month by its scaler
+    month_rows = src_df.groupby(src_df["trade_date"].str.slice(0, 6)).indices
+    x_src = src_df[x_lbls].to_numpy(dtype=np.float64)
+    x_test = np.zeros_like(x_src)
+    rows_by_month = {}
+    for train_end_month, test_month in zip(train_end_months, test_months):
+        if (rows := month_rows.get(test_month)) is None:
+            continue
+        scaler_file = "{}-{}.scl".format(model_grp_id, train_end_month)
+        try:
+            scaler = _get_cached_artifact(models_dir, train_end_month, scaler_file, model_store)
+        except FileNotFoundError:
+            continue
+        x_test[rows] = np.nan_to_num((x_src[rows] - scaler.mean_) / scaler.scale_, nan=0)
+        rows_by_month[train_end_month] = rows
+    return src_df[pred_header_cols + ["rtm"]], x_test, rows_by_month
+
+
+def ml_model_test_months(model_lbl: str, instrument: str | None, tid: str | None, trn_win: int,
+                         train_end_months: list[str],
+                         calendar: CCalendarMonthly, features_and_return_lib,
+                         models_dir: str,
+                         x_lbls: list, y_lbls: list,
+                         model_store: CModelStore | None = None,
+                         ) -> pd.DataFrame | None:
+    """
+    the same predictions as ml_model_test_one_month of each month in train_end_months, in the order of months,
+    but test rows of all months are read and normalized once, and cached in ml_test_caches for other models
+
+    :param train_end_months: format = [YYYYMM], in ascending order
+    :return: predictions with columns pred_header_cols + ["rtm", "pred"], None if no month is predicted
+    """
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+
+    # --- load test rows and normalize
+    scaler_mtimes = tuple(_get_artifact_mtime(models_dir, m, "{}-{}.scl".format(model_grp_id, m), model_store) for m in train_end_months)
+    test_data = ml_test_caches["test_data"].get(
+        (models_dir, model_grp_id, tuple(train_end_months), scaler_mtimes),
+        lambda: _load_test_data_months(
+            instrument=instrument, tid=tid, trn_win=trn_win, train_end_months=train_end_months,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls, model_store=model_store,
+        ))
+    if test_data is None or len(test_data[2]) == 0:
+        return None
+    header_df, x_test, rows_by_month = test_data
+
+    # --- prediction, month by month on slices
+    preds = []
+    for train_end_month, rows in rows_by_month.items():
+        train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
+        train_model = _get_cached_artifact(models_dir, train_end_month, train_model_file, model_store)
+        preds.append(train_model.predict(X=x_test[rows]))
+    all_rows = np.concatenate(list(rows_by_month.values()))
+    return header_df.iloc[all_rows].assign(pred=np.concatenate(preds))
 
 
 def ml_model_test(model_lbl: str, instrument: str | None, tid: str | None, trn_win: int,
@@ -14,6 +224,10 @@ def ml_model_test(model_lbl: str, instrument: str | None, tid: str | None, trn_w
                   features_and_return_dir: str, models_dir: str, predictions_dir: str,
                   sqlite3_tables: dict,
                   x_lbls: list, y_lbls: list,
+                  features_lib_type: str = "sqlite",
+                  features_panel: CFeaturesPanel | None = None,
+                  predictions_store: CPredictionsStore | None = None,
+                  batch_months: bool = False,
                   ):
     """
 
@@ -30,13 +244,16 @@ def ml_model_test(model_lbl: str, instrument: str | None, tid: str | None, trn_w
     :param sqlite3_tables:
     :param x_lbls:
     :param y_lbls: "rtm" must be in it
+    :param features_lib_type: "sqlite" or "parquet"
+    :param features_panel: if provided, features are read from it instead of the lib of features_lib_type
+    :param predictions_store: if provided, predictions are appended to it instead of the db of pred_id
+    :param batch_months: test rows of all months are read in one query, and predictions are written in one update,
+                         see ml_model_test_months
     :return:
     """
 
-    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
     model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
     pred_id = model_grp_id + "-pred-{}".format(model_lbl)
-    pred_header_cols = ["trade_date", "instrument", "contract", "tid", "timestamp"]
 
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
@@ -45,69 +262,53 @@ def ml_model_test(model_lbl: str, instrument: str | None, tid: str | None, trn_w
     calendar = CCalendarMonthly(calendar_path)
 
     # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    if features_panel is None:
+        features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+    else:
+        features_and_return_lib = features_panel
 
     # --- load lib writer
-    predictions_lib = CManagerLibWriter(
-        t_db_save_dir=predictions_dir,
-        t_db_name=pred_id + ".db",
-    )
-    predictions_lib_stru = sqlite3_tables[pred_id]
-    predictions_lib_tab = CTable(t_table_struct=predictions_lib_stru)
-    predictions_lib.initialize_table(predictions_lib_tab)
+    predictions_lib = None
+    if predictions_store is None:
+        predictions_lib = CManagerLibWriter(
+            t_db_save_dir=predictions_dir,
+            t_db_name=pred_id + ".db",
+        )
+        predictions_lib_stru = sqlite3_tables[pred_id]
+        predictions_lib_tab = CTable(t_table_struct=predictions_lib_stru)
+        predictions_lib.initialize_table(predictions_lib_tab)
+
+    # --- load model store, months not packed are read from skops files
+    model_store = CModelStore(models_dir)
 
     # --- dates
     iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
 
     # --- main core
-    for train_end_month in iter_months:
-        model_month_dir = os.path.join(models_dir, train_end_month[0:4], train_end_month)
-        test_month = calendar.get_next_month(train_end_month, 1)
-
-        test_bgn_date, test_end_date = calendar.get_first_date_of_month(test_month), calendar.get_last_date_of_month(test_month)
-        conds = init_conds + [
-            ("trade_date", ">=", test_bgn_date),
-            ("trade_date", "<=", test_end_date),
-        ]
-        src_df = features_and_return_lib.read_by_conditions(
-            t_conditions=conds,
-            t_value_columns=pred_header_cols + x_lbls + y_lbls
-        )
-        x_df, y_df = src_df[x_lbls], src_df[y_lbls]
-
-        # --- normalize
-        scaler_path = os.path.join(
-            model_month_dir,
-            "{}-{}.scl".format(model_grp_id, train_end_month)
-        )
-        try:
-            scaler = read_from_sio_obj(scaler_path)
-        except FileNotFoundError:
+    if batch_months:
+        pred_dfs = [ml_model_test_months(
+            model_lbl=model_lbl, instrument=instrument, tid=tid, trn_win=trn_win, train_end_months=iter_months,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls,
+            model_store=model_store,
+        )]
+    else:
+        pred_dfs = (ml_model_test_one_month(
+            model_lbl=model_lbl, instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=train_end_month,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls,
+            model_store=model_store,
+        ) for train_end_month in iter_months)
+    for pred_df in pred_dfs:
+        if pred_df is None:
             continue
+        if predictions_store is None:
+            predictions_lib.update(t_update_df=pred_df, t_using_index=False)
+        else:
+            predictions_store.append(model_lbl, instrument, tid, trn_win, pred_df)
 
-        # --- fit model
-        x_test = np.nan_to_num(scaler.transform(x_df), nan=0)
-
-        train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
-        train_model_path = os.path.join(model_month_dir, train_model_file)
-
-        # --- load model
-        train_model = read_from_sio_obj(train_model_path)
-
-        # --- prediction
-        src_df["pred"] = train_model.predict(X=x_test)
-        predictions_lib.update(
-            t_update_df=src_df[pred_header_cols + ["rtm", "pred"]],
-            t_using_index=False
-        )
-
-    predictions_lib.close()
+    if predictions_lib is not None:
+        predictions_lib.close()
     features_and_return_lib.close()
     return 0
 
@@ -119,19 +320,34 @@ def process_target_fun_for_ml_test(group_id: int, group_n: int,
                                    features_and_return_dir: str, models_dir: str, predictions_dir: str,
                                    sqlite3_tables: dict,
                                    x_lbls: list, y_lbls: list,
+                                   features_lib_type: str = "sqlite",
+                                   features_panel: CFeaturesPanel | None = None,
+                                   predictions_lib_type: str = "sqlite",
+                                   batch_months: bool = False,
                                    ):
-    for i, (model_lbl, instrument, tid, trn_win) in enumerate(ittl.product(model_lbls, instruments, tids, train_windows)):
+    predictions_store = get_predictions_store(predictions_dir) if predictions_lib_type == "parquet" else None
+    # all models of a group are tested in the same process, to share ml_test_caches
+    for i, (instrument, tid, trn_win) in enumerate(ittl.product(instruments, tids, train_windows)):
         if i % group_n == group_id:
-            ml_model_test(
-                model_lbl=model_lbl, instrument=instrument, tid=tid, trn_win=trn_win,
-                bgn_date=bgn_date, stp_date=stp_date,
-                calendar_path=calendar_path,
-                features_and_return_dir=features_and_return_dir,
-                models_dir=models_dir,
-                predictions_dir=predictions_dir,
-                sqlite3_tables=sqlite3_tables,
-                x_lbls=x_lbls, y_lbls=y_lbls
-            )
+            for model_lbl in model_lbls:
+                ml_model_test(
+                    model_lbl=model_lbl, instrument=instrument, tid=tid, trn_win=trn_win,
+                    bgn_date=bgn_date, stp_date=stp_date,
+                    calendar_path=calendar_path,
+                    features_and_return_dir=features_and_return_dir,
+                    models_dir=models_dir,
+                    predictions_dir=predictions_dir,
+                    sqlite3_tables=sqlite3_tables,
+                    x_lbls=x_lbls, y_lbls=y_lbls,
+                    features_lib_type=features_lib_type,
+                    features_panel=features_panel,
+                    predictions_store=predictions_store,
+                    batch_months=batch_months,
+                )
+    if predictions_store is not None:
+        predictions_store.close()
+    for cache_name, cache in ml_test_caches.items():
+        print("... {} | process {} | cache of {:<9s} | {} |".format(dt.datetime.now(), group_id, cache_name, cache.info()))
     return 0
 
 
@@ -142,7 +358,26 @@ def multi_process_fun_for_ml_test(group_n: int,
                                   features_and_return_dir: str, models_dir: str, predictions_dir: str,
                                   sqlite3_tables: dict,
                                   x_lbls: list, y_lbls: list,
+                                  features_lib_type: str = "sqlite",
+                                  use_features_panel: bool = False,
+                                  predictions_lib_type: str = "sqlite",
+                                  batch_months: bool = False,
                                   ):
+    """
+    groups are shared by group_n processes.
+    If use_features_panel, features are loaded once into a CFeaturesPanel in shared memory,
+    and all processes read from it.
+    If predictions_lib_type is "parquet", processes append to one CPredictionsStore,
+    which is compacted after all of them are done.
+    If batch_months, each group is tested with one query and one update, see ml_model_test_months.
+
+    """
+    features_panel = None
+    if use_features_panel:
+        features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+        features_panel = CFeaturesPanel.from_lib(features_and_return_lib, x_lbls + y_lbls)
+        features_and_return_lib.close()
+
     to_join_list = []
     for group_id in range(group_n):
         t = mp.Process(target=process_target_fun_for_ml_test, args=(
@@ -153,9 +388,119 @@ def multi_process_fun_for_ml_test(group_n: int,
             features_and_return_dir, models_dir, predictions_dir,
             sqlite3_tables,
             x_lbls, y_lbls,
+            features_lib_type,
+            features_panel,
+            predictions_lib_type,
+            batch_months,
         ))
         t.start()
         to_join_list.append(t)
     for t in to_join_list:
         t.join()
+
+    if predictions_lib_type == "parquet":
+        get_predictions_store(predictions_dir).compact()
+
+    if features_panel is not None:
+        features_panel.unlink()
+    return 0
+
+
+def ml_model_test_stacked(model_lbls: list[str], instruments: list[str], tids: list[str], train_windows: list[int],
+                          bgn_date: str, stp_date: str,
+                          calendar_path: str,
+                          features_and_return_dir: str, models_dir: str, predictions_dir: str,
+                          sqlite3_tables: dict,
+                          x_lbls: list, y_lbls: list,
+                          features_lib_type: str = "sqlite",
+                          predictions_lib_type: str = "sqlite",
+                          ):
+    """
+    test all groups in one process, for each month, all test rows are read in one query, and scored by
+    every model of every group in one batched forward pass of CStackedModels, then rows of each group
+    are picked by its instrument and tid. Predictions are the same as ml_model_test, and written in one update for each pred_id.
+
+    :param model_lbls: ["lm", "mlpr", "mlpc"]
+    :param instruments: like ["IC.CFE", ..., None], None for the group of all instruments
+    :param tids: like ["T01", ..., None], None for the group of all tids
+    :param train_windows: [6,12,24]
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param features_and_return_dir:
+    :param models_dir: stacked models are loaded from the files made by ml_pack.ml_stack_models, or stacked from the model store
+    :param predictions_dir:
+    :param sqlite3_tables:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :param features_lib_type: "sqlite" or "parquet"
+    :param predictions_lib_type: "sqlite" or "parquet"
+    :return:
+    """
+    pred_header_cols = ["trade_date", "instrument", "contract", "tid", "timestamp"]
+    groups = {"-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)])): (instrument, tid, trn_win)
+              for instrument, tid, trn_win in ittl.product(instruments, tids, train_windows)}
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendarMonthly(calendar_path)
+
+    # --- load lib reader
+    features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+
+    # --- load model store, months not packed are read from skops files
+    model_store = CModelStore(models_dir)
+
+    # --- main core
+    pred_dfs: dict[tuple[str, str], list[pd.DataFrame]] = {}
+    for train_end_month in calendar.map_iter_dates_to_iter_months(bgn_date, stp_date):
+        test_month = calendar.get_next_month(train_end_month, 1)
+        src_df = features_and_return_lib.read_by_conditions(
+            t_conditions=[
+                ("trade_date", ">=", calendar.get_first_date_of_month(test_month)),
+                ("trade_date", "<=", calendar.get_last_date_of_month(test_month)),
+            ],
+            t_value_columns=pred_header_cols + x_lbls + y_lbls
+        )
+        if len(src_df) == 0:
+            continue
+        stacked = get_stacked_models(models_dir, train_end_month, list(groups), model_lbls, model_store)
+        if len(stacked.m_grp_ids) == 0:
+            continue
+
+        # --- prediction, shape = (groups, rows) for each model
+        preds = stacked.forward(src_df[x_lbls].to_numpy(dtype=np.float64))
+        instrument_rows = {k: src_df["instrument"].to_numpy() == k for k in instruments if k is not None}
+        tid_rows = {k: src_df["tid"].to_numpy() == k for k in tids if k is not None}
+        all_rows = np.ones(len(src_df), dtype=bool)
+        for g, model_grp_id in enumerate(stacked.m_grp_ids):
+            instrument, tid, trn_win = groups[model_grp_id]
+            rows = instrument_rows.get(instrument, all_rows) & tid_rows.get(tid, all_rows)
+            if not rows.any():
+                continue
+            header_df = src_df.loc[rows, pred_header_cols + ["rtm"]]
+            for model_lbl in model_lbls:
+                if stacked.m_arrays[model_lbl + "/has"][g]:
+                    pred_dfs.setdefault((model_grp_id, model_lbl), []).append(header_df.assign(pred=preds[model_lbl][g, rows]))
+        print("... {} | {} | {:>4d} groups tested |".format(dt.datetime.now(), train_end_month, len(stacked.m_grp_ids)))
+    features_and_return_lib.close()
+
+    # --- save
+    predictions_store = get_predictions_store(predictions_dir) if predictions_lib_type == "parquet" else None
+    for (model_grp_id, model_lbl), grp_pred_dfs in pred_dfs.items():
+        pred_df = pd.concat(grp_pred_dfs, axis=0, ignore_index=True)
+        if predictions_store is not None:
+            instrument, tid, trn_win = groups[model_grp_id]
+            predictions_store.append(model_lbl, instrument, tid, trn_win, pred_df)
+            continue
+        pred_id = model_grp_id + "-pred-{}".format(model_lbl)
+        predictions_lib = CManagerLibWriter(t_db_save_dir=predictions_dir, t_db_name=pred_id + ".db")
+        predictions_lib.initialize_table(CTable(t_table_struct=sqlite3_tables[pred_id]))
+        predictions_lib.update(t_update_df=pred_df, t_using_index=False)
+        predictions_lib.close()
+    if predictions_store is not None:
+        predictions_store.close()
+        predictions_store.compact()
     return 0
@@ -1,11 +1,83 @@
 import os
+import sys
+import time
 import datetime as dt
+import itertools as ittl
 import numpy as np
+import pandas as pd
 from sklearn.linear_model import LinearRegression
-from skyrim.falkreath import CManagerLibReader, CTable
 from skyrim.whiterun import CCalendarMonthly
 from xfuns import save_to_sio_obj
 from xfuns import read_from_sio_obj
+from xlibs import get_features_and_return_lib
+
+
+def ml_lm_one_month(train_model: LinearRegression, instrument: str | None, tid: str | None, trn_win: int,
+                    train_end_month: str,
+                    calendar: CCalendarMonthly, features_and_return_lib,
+                    models_dir: str,
+                    x_lbls: list, y_lbls: list,
+                    ) -> dict | None:
+    """
+    fit and save the model of one month, with the scaler saved by ml_normalize
+
+    :param train_model: from xfuns.get_train_model
+    :param instrument: like IC.CFE
+    :param tid: ['T01',...,'T07']
+    :param trn_win: [6,12,24]
+    :param train_end_month: format = [YYYYMM]
+    :param calendar:
+    :param features_and_return_lib: a reader with read_array_by_conditions
+    :param models_dir:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :return: fit log of this month, None if the scaler is not found
+    """
+    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    model_lbl = "lm"
+    model_month_dir = os.path.join(models_dir, train_end_month[0:4], train_end_month)
+
+    train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+    conds = init_conds + [
+        ("trade_date", ">=", train_bgn_date),
+        ("trade_date", "<=", train_end_date),
+    ]
+    src_data = features_and_return_lib.read_array_by_conditions(
+        t_conditions=conds,
+        t_value_columns=x_lbls + y_lbls
+    )
+    x_data, y_data = src_data[:, :len(x_lbls)], src_data[:, len(x_lbls)]
+
+    # --- normalize
+    scaler_path = os.path.join(
+        model_month_dir,
+        "{}-{}.scl".format(model_grp_id, train_end_month)
+    )
+    try:
+        scaler = read_from_sio_obj(scaler_path)
+    except FileNotFoundError:
+        return None
+
+    # --- fit model, same as scaler.transform, which expects a DataFrame with feature names
+    x_train = np.nan_to_num((x_data - scaler.mean_) / scaler.scale_, nan=0)
+    t0 = time.time()
+    train_model.fit(X=x_train, y=y_data)
+    month_fit_log = {
+        "train_end_month": train_end_month,
+        "train_size": len(x_train),
+        "fit_time": time.time() - t0,
+    }
+
+    train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
+    train_model_path = os.path.join(model_month_dir, train_model_file)
+
+    # --- save model
+    save_to_sio_obj(train_model, train_model_path)
+
+    print("... {0} | {3} | {1:>24s} | {2} | fitted |".format(
+        dt.datetime.now(), model_grp_id, train_end_month, model_lbl))
+    return month_fit_log
 
 
 def ml_lm(instrument: str | None, tid: str | None, trn_win: int,
@@ -14,6 +86,7 @@ def ml_lm(instrument: str | None, tid: str | None, trn_win: int,
           features_and_return_dir: str, models_dir: str,
           sqlite3_tables: dict,
           x_lbls: list, y_lbls: list,
+          features_lib_type: str = "sqlite",
           ):
     """
 
@@ -28,12 +101,10 @@ def ml_lm(instrument: str | None, tid: str | None, trn_win: int,
     :param sqlite3_tables:
     :param x_lbls:
     :param y_lbls: "rtm" must be in it
+    :param features_lib_type: "sqlite" or "parquet"
     :return:
     """
 
-    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
-    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
-
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
@@ -41,55 +112,20 @@ def ml_lm(instrument: str | None, tid: str | None, trn_win: int,
     calendar = CCalendarMonthly(calendar_path)
 
     # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
 
     # --- dates
     iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
 
     # --- main core
-    train_model, model_lbl = LinearRegression(), "lm"
+    train_model = LinearRegression()
     for train_end_month in iter_months:
-        model_month_dir = os.path.join(models_dir, train_end_month[0:4], train_end_month)
-
-        train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
-        conds = init_conds + [
-            ("trade_date", ">=", train_bgn_date),
-            ("trade_date", "<=", train_end_date),
-        ]
-        src_df = features_and_return_lib.read_by_conditions(
-            t_conditions=conds,
-            t_value_columns=x_lbls + y_lbls
-        )
-        x_df, y_df = src_df[x_lbls], src_df[y_lbls]
-
-        # --- normalize
-        scaler_path = os.path.join(
-            model_month_dir,
-            "{}-{}.scl".format(model_grp_id, train_end_month)
+        ml_lm_one_month(
+            train_model=train_model,
+            instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=train_end_month,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls,
         )
-        try:
-            scaler = read_from_sio_obj(scaler_path)
-        except FileNotFoundError:
-            continue
-
-        # --- fit model
-        x_train = np.nan_to_num(scaler.transform(x_df), nan=0)
-        train_model.fit(X=x_train, y=y_df.values[:, 0])
-
-        train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
-        train_model_path = os.path.join(model_month_dir, train_model_file)
-
-        # --- save model
-        save_to_sio_obj(train_model, train_model_path)
-
-        print("... {0} | {3} | {1:>24s} | {2} | fitted |".format(
-            dt.datetime.now(), model_grp_id, train_end_month, model_lbl))
 
     features_and_return_lib.close()
     return 0
@@ -108,3 +144,170 @@ def ml_lm(instrument: str | None, tid: str | None, trn_win: int,
 # sse = np.sum((y - y_h) ** 2)
 # e = sst - ssr - sse
 # r22 = 1 - sse / sst
+
+
+# --- rolling lm from gram matrices of each (instrument, tid, month)
+def cal_month_grams(src_df: pd.DataFrame, x_lbls: list, y_lbl: str) -> tuple[list[tuple[str, str]], list[str], dict[str, np.ndarray]]:
+    """
+    with x_fill = x with nan replaced by 0, and o = 1 if x is not nan else 0,
+    sums of each (instrument, tid, month) are enough to build the regression
+    on nan_to_num(scaler.transform(x), nan=0) of any window and any scaler
+
+    :param src_df: with columns trade_date, instrument, tid, x_lbls and y_lbl
+    :param x_lbls:
+    :param y_lbl:
+    :return: sub_groups, months, sums with shape (len(sub_groups), len(months), ...),
+             keys are xx = x_fill'x_fill, xo = x_fill'o, oo = o'o, xy = x_fill'y, oy = o'y, y = sum of y, n
+    """
+    src_df = src_df.assign(month=src_df["trade_date"].str.slice(0, 6))
+    sub_groups = sorted(src_df[["instrument", "tid"]].drop_duplicates().itertuples(index=False, name=None))
+    months = sorted(src_df["month"].unique())
+    k, sub_group_idx, month_idx = len(x_lbls), {g: i for i, g in enumerate(sub_groups)}, {m: i for i, m in enumerate(months)}
+    shape = (len(sub_groups), len(months))
+    sums = {
+        "xx": np.zeros(shape + (k, k)), "xo": np.zeros(shape + (k, k)), "oo": np.zeros(shape + (k, k)),
+        "xy": np.zeros(shape + (k,)), "oy": np.zeros(shape + (k,)), "y": np.zeros(shape), "n": np.zeros(shape),
+    }
+    for (instrument, tid, month), block_df in src_df.groupby(by=["instrument", "tid", "month"]):
+        i, j = sub_group_idx[(instrument, tid)], month_idx[month]
+        x = block_df[x_lbls].to_numpy(dtype=np.float64)
+        y = block_df[y_lbl].to_numpy(dtype=np.float64)
+        if np.isinf(x).any() or not np.isfinite(y).all():
+            # nan in x is filled by 0 as ml_lm does, nan in y or inf anywhere would turn all coefficients into nan
+            print("... features or {} of {}-{} @ {} are not finite, please check again".format(y_lbl, instrument, tid, month))
+            print("... this program will terminate at once")
+            sys.exit()
+        o = (~np.isnan(x)).astype(np.float64)
+        x = np.nan_to_num(x, nan=0)
+        sums["xx"][i, j], sums["xo"][i, j], sums["oo"][i, j] = x.T @ x, x.T @ o, o.T @ o
+        sums["xy"][i, j], sums["oy"][i, j], sums["y"][i, j], sums["n"][i, j] = x.T @ y, o.T @ y, y.sum(), len(y)
+    return sub_groups, months, sums
+
+
+def _solve_lm_from_sums(sums: dict[str, np.ndarray], mean: np.ndarray, scale: np.ndarray):
+    """
+    least squares with intercept of y on z = nan_to_num((x - mean) / scale, nan=0),
+    all arguments have a leading batch axis, the minimum norm solution is used for
+    rank deficient z, like scipy.linalg.lstsq used by LinearRegression.
+    eigenvalues of z'z below eps * max(n, p) times the largest one are taken as 0,
+    which is the rounding error of z'z itself, so only directions lost in the sums are dropped
+
+    """
+    mm = mean[:, :, None] * mean[:, None, :]
+    xo_m = sums["xo"] * mean[:, None, :]
+    zz = (sums["xx"] - xo_m - xo_m.transpose(0, 2, 1) + sums["oo"] * mm) / (scale[:, :, None] * scale[:, None, :])
+    zy = (sums["xy"] - mean * sums["oy"]) / scale
+    z_sum = (np.diagonal(sums["xo"], axis1=1, axis2=2) - mean * np.diagonal(sums["oo"], axis1=1, axis2=2)) / scale
+    n = sums["n"]
+    z_bar, y_bar = z_sum / n[:, None], sums["y"] / n
+
+    # centered, as LinearRegression does with fit_intercept = True
+    zz_c = zz - n[:, None, None] * z_bar[:, :, None] * z_bar[:, None, :]
+    zy_c = zy - n[:, None] * z_bar * y_bar[:, None]
+    rcond = np.finfo(np.float64).eps * np.maximum(n, zz_c.shape[-1])
+    coef = (np.linalg.pinv(zz_c, rcond=rcond, hermitian=True) @ zy_c[:, :, None])[:, :, 0]
+    intercept = y_bar - (z_bar * coef).sum(axis=1)
+
+    # singular values of centered z, eigenvalues cut by pinv are taken as 0
+    eig = np.linalg.eigvalsh(zz_c)[:, ::-1]
+    eig[eig <= rcond[:, None] * eig[:, :1]] = 0
+    singular, rank = np.sqrt(eig), (eig > 0).sum(axis=1)
+    return coef, intercept, singular, rank
+
+
+def ml_lm_gram(instruments: list[str | None], tids: list[str | None], train_windows: list[int],
+               bgn_date: str, stp_date: str,
+               calendar_path: str,
+               features_and_return_dir: str, models_dir: str,
+               sqlite3_tables: dict,
+               x_lbls: list, y_lbls: list,
+               features_lib_type: str = "sqlite",
+               ):
+    """
+    same models as ml_lm for every group in product(instruments, tids, train_windows),
+    the features table is read once, and sums in cal_month_grams are calculated once for
+    each (instrument, tid, month). The regression of a window is solved from the sums of its
+    months, with the mean_ and scale_ of the scaler saved by ml_normalize, and all
+    regressions are solved in one batch.
+
+    :param instruments: like ["IC.CFE", None], None for all instruments
+    :param tids: like ["T01", None], None for all tids
+    :param train_windows: [6,12,24]
+    :param bgn_date: format = [YYYYMMDD]
+    :param stp_date: format = [YYYYMMDD], can be skip, and program will use bgn only
+    :param calendar_path:
+    :param features_and_return_dir:
+    :param models_dir:
+    :param sqlite3_tables:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it, and only the first one is used, same as ml_lm
+    :param features_lib_type: "sqlite" or "parquet"
+    :return:
+    """
+
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendarMonthly(calendar_path)
+
+    # --- load month grams
+    features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+    src_df = features_and_return_lib.read(t_value_columns=["trade_date", "instrument", "tid"] + x_lbls + y_lbls[0:1])
+    features_and_return_lib.close()
+    sub_groups, months, month_sums = cal_month_grams(src_df, x_lbls, y_lbls[0])
+    months = np.array(months)
+
+    # --- dates
+    iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
+
+    # --- collect windows of all groups
+    model_lbl = "lm"
+    batch_paths, batch_sums, batch_mean, batch_scale = [], {k: [] for k in month_sums}, [], []
+    for instrument, tid in ittl.product(instruments, tids):
+        sub_filter = [(instrument is None or g[0] == instrument) and (tid is None or g[1] == tid) for g in sub_groups]
+        # cumulative sums along months, with a leading zero
+        grp_cum_sums = {k: np.concatenate([np.zeros((1,) + v.shape[2:]), v[sub_filter].sum(axis=0).cumsum(axis=0)])
+                        for k, v in month_sums.items()}
+        for trn_win in train_windows:
+            model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+            for train_end_month in iter_months:
+                model_month_dir = os.path.join(models_dir, train_end_month[0:4], train_end_month)
+                train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+                i0 = np.searchsorted(months, train_bgn_date[0:6], side="left")
+                i1 = np.searchsorted(months, train_end_date[0:6], side="right")
+
+                scaler_path = os.path.join(
+                    model_month_dir,
+                    "{}-{}.scl".format(model_grp_id, train_end_month)
+                )
+                try:
+                    scaler = read_from_sio_obj(scaler_path)
+                except FileNotFoundError:
+                    continue
+
+                train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
+                batch_paths.append((model_grp_id, train_end_month, os.path.join(model_month_dir, train_model_file)))
+                for k, v in grp_cum_sums.items():
+                    batch_sums[k].append(v[i1] - v[i0])
+                batch_mean.append(scaler.mean_)
+                batch_scale.append(scaler.scale_)
+
+    if not batch_paths:
+        return 0
+
+    # --- solve all in one batch
+    coef, intercept, singular, rank = _solve_lm_from_sums(
+        {k: np.array(v) for k, v in batch_sums.items()}, np.array(batch_mean), np.array(batch_scale))
+
+    # --- save model
+    for (model_grp_id, train_end_month, train_model_path), b, a, s, r in zip(batch_paths, coef, intercept, singular, rank):
+        train_model = LinearRegression()
+        train_model.n_features_in_ = len(x_lbls)
+        train_model.coef_, train_model.intercept_ = b, float(a)
+        train_model.singular_, train_model.rank_ = s, int(r)
+        save_to_sio_obj(train_model, train_model_path)
+
+        print("... {0} | {3} | {1:>24s} | {2} | fitted |".format(
+            dt.datetime.now(), model_grp_id, train_end_month, model_lbl))
+    return 0
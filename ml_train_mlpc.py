@@ -1,13 +1,89 @@
 import os
+import time
 import datetime as dt
 import numpy as np
+import pandas as pd
 import itertools as ittl
 import multiprocessing as mp
 from sklearn.neural_network import MLPClassifier
-from skyrim.falkreath import CManagerLibReader, CTable
 from skyrim.whiterun import CCalendarMonthly
+from skyrim.winterhold import check_and_mkdir
 from xfuns import save_to_sio_obj
 from xfuns import read_from_sio_obj
+from xfuns import reset_mlp_for_warm_start, get_train_model
+from xlibs import get_features_and_return_lib, CFeaturesPanel
+
+
+def ml_mlpc_one_month(train_model: MLPClassifier, instrument: str | None, tid: str | None, trn_win: int,
+                      train_end_month: str,
+                      calendar: CCalendarMonthly, features_and_return_lib,
+                      models_dir: str,
+                      x_lbls: list, y_lbls: list,
+                      ) -> dict | None:
+    """
+    fit and save the model of one month, with the scaler saved by ml_normalize
+
+    :param train_model: from xfuns.get_train_model, with warm_start, it should be used for months in order
+    :param instrument: like IC.CFE
+    :param tid: ['T01',...,'T07']
+    :param trn_win: [6,12,24]
+    :param train_end_month: format = [YYYYMM]
+    :param calendar:
+    :param features_and_return_lib: a reader with read_array_by_conditions
+    :param models_dir:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :return: fit log of this month, None if the scaler is not found
+    """
+    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
+    model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+    model_lbl = "mlpc"
+    model_month_dir = os.path.join(models_dir, train_end_month[0:4], train_end_month)
+
+    train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
+    conds = init_conds + [
+        ("trade_date", ">=", train_bgn_date),
+        ("trade_date", "<=", train_end_date),
+    ]
+    src_data = features_and_return_lib.read_array_by_conditions(
+        t_conditions=conds,
+        t_value_columns=x_lbls + y_lbls
+    )
+    x_data, y_data = src_data[:, :len(x_lbls)], src_data[:, len(x_lbls)]
+
+    # --- normalize
+    scaler_path = os.path.join(
+        model_month_dir,
+        "{}-{}.scl".format(model_grp_id, train_end_month)
+    )
+    try:
+        scaler = read_from_sio_obj(scaler_path)
+    except FileNotFoundError:
+        return None
+
+    # --- fit model, same as scaler.transform, which expects a DataFrame with feature names
+    x_train = np.nan_to_num((x_data - scaler.mean_) / scaler.scale_, nan=0)
+    reset_mlp_for_warm_start(train_model)
+    t0 = time.time()
+    train_model.fit(X=x_train, y=(y_data >= 0).astype(int))
+    month_fit_log = {
+        "train_end_month": train_end_month,
+        "train_size": len(x_train),
+        "n_iter": train_model.n_iter_,
+        "fit_time": time.time() - t0,
+        "loss": train_model.loss_,
+        "best_validation_score": train_model.best_validation_score_ if train_model.early_stopping else np.nan,
+    }
+
+    train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
+    train_model_path = os.path.join(model_month_dir, train_model_file)
+
+    # --- save model
+    save_to_sio_obj(train_model, train_model_path)
+
+    print("... {0} | {3} | {1:>24s} | {2} | fitted |".format(
+        dt.datetime.now(), model_grp_id, train_end_month, model_lbl))
+    return month_fit_log
 
 
 def ml_mlpc(instrument: str | None, tid: str | None, trn_win: int,
@@ -16,6 +92,9 @@ def ml_mlpc(instrument: str | None, tid: str | None, trn_win: int,
             features_and_return_dir: str, models_dir: str,
             sqlite3_tables: dict,
             x_lbls: list, y_lbls: list,
+            features_lib_type: str = "sqlite",
+            features_panel: CFeaturesPanel | None = None,
+            warm_start: bool = False,
             ):
     """
 
@@ -30,10 +109,15 @@ def ml_mlpc(instrument: str | None, tid: str | None, trn_win: int,
     :param sqlite3_tables:
     :param x_lbls:
     :param y_lbls: "rtm" must be in it
+    :param features_lib_type: "sqlite" or "parquet"
+    :param features_panel: if provided, features are read from it instead of the lib of features_lib_type
+    :param warm_start: if True, each month starts from the weights of the last fitted month,
+                       and stops early when the score on 10% of the window does not improve.
+                       n_iter_, fit time and loss of every fit are saved to models_dir/fit_logs,
+                       use another models_dir to compare models with the cold start ones.
     :return:
     """
 
-    init_conds = [(k, "=", v) for k, v in zip(("instrument", "tid"), (instrument, tid)) if v is not None]
     model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
 
     if stp_date is None:
@@ -43,56 +127,31 @@ def ml_mlpc(instrument: str | None, tid: str | None, trn_win: int,
     calendar = CCalendarMonthly(calendar_path)
 
     # --- load lib reader
-    features_and_return_lib = CManagerLibReader(
-        t_db_save_dir=features_and_return_dir,
-        t_db_name="features_and_return.db"
-    )
-    features_and_return_db_stru = sqlite3_tables["features_and_return"]
-    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
-    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    if features_panel is None:
+        features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+    else:
+        features_and_return_lib = features_panel
 
     # --- dates
     iter_months = calendar.map_iter_dates_to_iter_months(bgn_date, stp_date)
 
     # --- main core
-    train_model, model_lbl = \
-        MLPClassifier(hidden_layer_sizes=(5, 5), solver="adam", random_state=0, alpha=1.0, max_iter=2000), "mlpc"
+    train_model, model_lbl = get_train_model("mlpc", warm_start=warm_start), "mlpc"
+    fit_log = []
     for train_end_month in iter_months:
-        model_month_dir = os.path.join(models_dir, train_end_month[0:4], train_end_month)
-
-        train_bgn_date, train_end_date = calendar.get_bgn_and_end_dates_for_trailing_window(train_end_month, trn_win)
-        conds = init_conds + [
-            ("trade_date", ">=", train_bgn_date),
-            ("trade_date", "<=", train_end_date),
-        ]
-        src_df = features_and_return_lib.read_by_conditions(
-            t_conditions=conds,
-            t_value_columns=x_lbls + y_lbls
+        month_fit_log = ml_mlpc_one_month(
+            train_model=train_model,
+            instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=train_end_month,
+            calendar=calendar, features_and_return_lib=features_and_return_lib,
+            models_dir=models_dir, x_lbls=x_lbls, y_lbls=y_lbls,
         )
-        x_df, y_df = src_df[x_lbls], src_df[y_lbls]
-
-        # --- normalize
-        scaler_path = os.path.join(
-            model_month_dir,
-            "{}-{}.scl".format(model_grp_id, train_end_month)
-        )
-        try:
-            scaler = read_from_sio_obj(scaler_path)
-        except FileNotFoundError:
-            continue
-
-        # --- fit model
-        x_train = np.nan_to_num(scaler.transform(x_df), nan=0)
-        train_model.fit(X=x_train, y=list(map(lambda z: 1 if z >= 0 else 0, y_df.values[:, 0])))
+        if month_fit_log is not None:
+            fit_log.append(month_fit_log)
 
-        train_model_file = "{}-{}.{}".format(model_grp_id, train_end_month, model_lbl)
-        train_model_path = os.path.join(model_month_dir, train_model_file)
-
-        # --- save model
-        save_to_sio_obj(train_model, train_model_path)
-
-        print("... {0} | {3} | {1:>24s} | {2} | fitted |".format(
-            dt.datetime.now(), model_grp_id, train_end_month, model_lbl))
+    # --- save fit log
+    check_and_mkdir(fit_logs_dir := os.path.join(models_dir, "fit_logs"))
+    fit_log_file = "{}-{}-{}-fit_log.csv".format(model_grp_id, model_lbl, "warm" if warm_start else "cold")
+    pd.DataFrame(fit_log).to_csv(os.path.join(fit_logs_dir, fit_log_file), index=False, float_format="%.6f")
 
     features_and_return_lib.close()
     return 0
@@ -120,6 +179,9 @@ def process_target_fun_for_ml_mlpc(group_id: int, group_n: int,
                                    features_and_return_dir: str, models_dir: str,
                                    sqlite3_tables: dict,
                                    x_lbls: list, y_lbls: list,
+                                   features_lib_type: str = "sqlite",
+                                   features_panel: CFeaturesPanel | None = None,
+                                   warm_start: bool = False,
                                    ):
     for i, (instrument, tid, trn_win) in enumerate(ittl.product(instruments, tids, train_windows)):
         if i % group_n == group_id:
@@ -130,7 +192,10 @@ def process_target_fun_for_ml_mlpc(group_id: int, group_n: int,
                 features_and_return_dir=features_and_return_dir,
                 models_dir=models_dir,
                 sqlite3_tables=sqlite3_tables,
-                x_lbls=x_lbls, y_lbls=y_lbls
+                x_lbls=x_lbls, y_lbls=y_lbls,
+                features_lib_type=features_lib_type,
+                features_panel=features_panel,
+                warm_start=warm_start,
             )
     return 0
 
@@ -142,7 +207,22 @@ def multi_process_fun_for_ml_mlpc(group_n: int,
                                   features_and_return_dir: str, models_dir: str,
                                   sqlite3_tables: dict,
                                   x_lbls: list, y_lbls: list,
+                                  features_lib_type: str = "sqlite",
+                                  use_features_panel: bool = False,
+                                  warm_start: bool = False,
                                   ):
+    """
+    groups are shared by group_n processes.
+    If use_features_panel, features are loaded once into a CFeaturesPanel in shared memory,
+    and all processes read from it.
+
+    """
+    features_panel = None
+    if use_features_panel:
+        features_and_return_lib = get_features_and_return_lib(features_and_return_dir, sqlite3_tables, features_lib_type)
+        features_panel = CFeaturesPanel.from_lib(features_and_return_lib, x_lbls + y_lbls)
+        features_and_return_lib.close()
+
     to_join_list = []
     for group_id in range(group_n):
         t = mp.Process(target=process_target_fun_for_ml_mlpc, args=(
@@ -153,9 +233,15 @@ def multi_process_fun_for_ml_mlpc(group_n: int,
             features_and_return_dir, models_dir,
             sqlite3_tables,
             x_lbls, y_lbls,
+            features_lib_type,
+            features_panel,
+            warm_start,
         ))
         t.start()
         to_join_list.append(t)
     for t in to_join_list:
         t.join()
+
+    if features_panel is not None:
+        features_panel.unlink()
     return 0
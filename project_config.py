@@ -40,6 +40,10 @@ sqlite3_tables = {
             "alpha19": "REAL",
             "alpha20": "REAL",
             "rtm": "REAL",
+        },
+        "indexes": {
+            "idx_instrument_tid_trade_date": ("instrument", "tid", "trade_date"),
+            "idx_tid_trade_date": ("tid", "trade_date"),
         }
     },
 
@@ -48,7 +52,9 @@ sqlite3_tables = {
 x_lbls = ["alpha{:02d}".format(_) for _ in range(19)]
 y_lbls = ["rtm"]
 instruments_universe = ["IC.CFE", "IH.CFE", "IF.CFE", "IM.CFE"]
-tids = ["T{:02d}".format(t) for t in range(1, 8)]
+tot_bar_num = 240
+sub_win_width = 30  # minutes between two checkpoints, 30 -> T01~T07, 5 -> T01~T47
+tids = ["T{:02d}".format(t) for t in range(1, int(tot_bar_num / sub_win_width))]
 train_windows = (6, 12, 24)
 model_lbls = ["lm", "mlpc", "mlpr"]
 for instrument, tid, trn_win, model_lbl in ittl.product(
@@ -58,10 +58,12 @@ research_data_root_dir = "/ProjectsData"
 research_project_name = os.getcwd().split("\\")[-1]
 research_project_data_dir = os.path.join(research_data_root_dir, research_project_name)
 research_features_and_return_dir = os.path.join(research_project_data_dir, "features_and_return")
+research_m01_cache_dir = os.path.join(research_project_data_dir, "m01_cache")
 research_models_dir = os.path.join(research_project_data_dir, "models")
 research_predictions_dir = os.path.join(research_project_data_dir, "predictions")
 research_navs_dir = os.path.join(research_project_data_dir, "navs")
 research_summary_dir = os.path.join(research_project_data_dir, "summary")
+research_manifest_path = os.path.join(research_project_data_dir, "manifest.json")
 
 if __name__ == "__main__":
     from skyrim.winterhold import check_and_mkdir
@@ -69,6 +71,7 @@ if __name__ == "__main__":
     check_and_mkdir(research_data_root_dir)
     check_and_mkdir(research_project_data_dir)
     check_and_mkdir(research_features_and_return_dir)
+    check_and_mkdir(research_m01_cache_dir)
     check_and_mkdir(research_models_dir)
     check_and_mkdir(research_predictions_dir)
     check_and_mkdir(research_navs_dir)
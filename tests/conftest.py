@@ -0,0 +1,91 @@
+import os
+import sys
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def research_env(tmp_path_factory) -> dict:
+    """
+    a calendar of 202201 - 202207 and a features_and_return.db of IC.CFE and IH.CFE x T01 - T03,
+    IH.CFE starts from 202203, and 202207 has no rows. About 5% of alphas are nan, alpha18 is constant.
+
+    :return: keys are calendar_path, features_and_return_dir, sqlite3_tables, x_lbls and y_lbls
+    """
+    pytest.importorskip("skyrim")
+    from project_config import sqlite3_tables, x_lbls, y_lbls
+    from dp_01_convert_csv_to_sqlite3 import init_features_and_return_table, build_features_and_return_indexes
+
+    root_dir = tmp_path_factory.mktemp("research")
+    trade_dates = ["2022{:02d}{:02d}".format(m, d) for m in range(1, 8) for d in range(3, 11)]
+    calendar_path = str(root_dir / "calendar.csv")
+    pd.DataFrame({"trade_date": trade_dates}).to_csv(calendar_path, index=False)
+
+    features_and_return_dir = str(root_dir / "features_and_return")
+    os.makedirs(features_and_return_dir)
+    columns, insert_sql = init_features_and_return_table("o", features_and_return_dir, sqlite3_tables)
+    alpha_num = len(sqlite3_tables["features_and_return"]["value_columns"]) - 1
+    rng = np.random.default_rng(0)
+    rows = []
+    for trade_date in trade_dates:
+        if trade_date >= "20220701":
+            continue
+        for instrument in ("IC.CFE", "IH.CFE"):
+            if instrument == "IH.CFE" and trade_date < "20220301":
+                continue
+            for tid in ("T01", "T02", "T03"):
+                for timestamp in range(4):
+                    alphas = rng.normal(loc=0.3, scale=2.0, size=alpha_num)
+                    alphas[rng.uniform(size=alpha_num) < 0.05] = np.nan
+                    alphas[18] = 0.25
+                    rtm = np.nan_to_num(alphas[0:6], nan=0) @ np.array([0.5, -0.2, 0.1, 0, 0.3, -0.1]) + rng.normal()
+                    rows.append((trade_date, instrument, instrument[0:2] + "2203.CFE", tid, timestamp,
+                                 *[None if np.isnan(_) else float(_) for _ in alphas], float(rtm)))
+    connection = sqlite3.connect(os.path.join(features_and_return_dir, "features_and_return.db"))
+    connection.executemany(insert_sql, rows)
+    connection.commit()
+    connection.close()
+    build_features_and_return_indexes(features_and_return_dir, sqlite3_tables)
+    return {
+        "calendar_path": calendar_path,
+        "features_and_return_dir": features_and_return_dir,
+        "sqlite3_tables": sqlite3_tables,
+        "x_lbls": x_lbls,
+        "y_lbls": y_lbls,
+    }
+
+
+@pytest.fixture(scope="session")
+def research_models(research_env, tmp_path_factory) -> dict:
+    """
+    scalers and lm, mlpr and mlpc models of 202201 - 202206 trained on research_env, with a train window
+    of 2 months, for IH.CFE-T02, which has no scaler before 202203, and T02 of all instruments
+
+    :return: research_env with models_dir and the groups
+    """
+    import warnings
+    from ml_normalize import ml_normalize_rolling
+    from ml_train_lm import ml_lm
+    from ml_train_mlpr import ml_mlpr
+    from ml_train_mlpc import ml_mlpc
+
+    models_dir = str(tmp_path_factory.mktemp("models"))
+    kwargs = {k: research_env[k] for k in ("calendar_path", "features_and_return_dir", "sqlite3_tables", "x_lbls")}
+    instruments, tids, train_windows = ["IH.CFE", None], ["T02"], [2]
+    ml_normalize_rolling(instruments=instruments, tids=tids, train_windows=train_windows,
+                         bgn_date="20220101", stp_date="20220701", models_dir=models_dir, minimum_data_size=20, **kwargs)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for instrument, tid, trn_win in [(i, t, w) for i in instruments for t in tids for w in train_windows]:
+            for train_fun in (ml_lm, ml_mlpr, ml_mlpc):
+                train_fun(instrument=instrument, tid=tid, trn_win=trn_win, bgn_date="20220101", stp_date="20220701",
+                          models_dir=models_dir, y_lbls=research_env["y_lbls"], **kwargs)
+    return research_env | {
+        "models_dir": models_dir,
+        "groups": [(i, t, w) for i in instruments for t in tids for w in train_windows],
+        "train_end_months": ["2022{:02d}".format(m) for m in range(1, 7)],
+    }
@@ -0,0 +1,97 @@
+import datetime as dt
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from xfuns import cal_features_and_return_one_day, cal_features_and_return_one_day_np, replay_features_and_return_one_day
+from xfuns import _masked_avg_rank
+
+# alphas from bars sorted by volume, they may differ when volumes tie at the edge of the top bars
+volume_order_alphas = ["alpha{:02d}".format(_) for _ in range(7, 16)]
+call_kwargs = dict(instrument="IC.CFE", contract="IC2306.CFE", contract_multiplier=200, pre_settle=3995.0, pre_spot_close=3980.0)
+
+
+def make_day(seed: int, ties: bool = False, zero_vol: int = 0, date: str = "2023-05-10") -> pd.DataFrame:
+    """
+
+    :param ties: volumes are drawn from a few values, so many bars tie
+    :param zero_vol: number of bars without volume at the open
+    :return: 240 minute bars of a synthetic day
+    """
+    rng = np.random.default_rng(seed)
+    ts = [int((dt.datetime.fromisoformat(date + " 09:30") + dt.timedelta(minutes=i)).timestamp()) for i in range(120)]
+    ts += [int((dt.datetime.fromisoformat(date + " 13:00") + dt.timedelta(minutes=i)).timestamp()) for i in range(120)]
+    price = 4000 * np.exp(np.cumsum(rng.normal(0, 5e-4, 240)))
+    volume = (rng.integers(1, 30, 240) if ties else rng.integers(100, 10_000_000, 240)).astype(float)
+    volume[:zero_vol] = 0
+    high = price * (1 + np.abs(rng.normal(0, 3e-4, 240)))
+    low = price * (1 - np.abs(rng.normal(0, 3e-4, 240)))
+    return pd.DataFrame({
+        "timestamp": ts, "open": price, "high": high, "low": low, "close": price,
+        "volume": volume, "amount": price * volume * 200 / 1e4, "oi": 0.0,
+        "daily_open": price[0], "daily_high": np.maximum.accumulate(high), "daily_low": np.minimum.accumulate(low),
+        "preclose": 3990.0, "preoi": 0.0,
+    })
+
+
+def assert_same_features(a: pd.DataFrame, b: pd.DataFrame, skip_cols: list[str] = ()):
+    assert list(a.columns) == list(b.columns)
+    assert list(a.index) == list(b.index)
+    for col in a.columns:
+        if col in skip_cols:
+            continue
+        if a[col].dtype == object:
+            assert (a[col] == b[col]).all(), col
+        else:
+            np.testing.assert_allclose(
+                a[col].to_numpy(dtype=float), b[col].to_numpy(dtype=float), rtol=1e-9, atol=1e-12, err_msg=col)
+
+
+@pytest.mark.parametrize("sub_win_width", [30, 15, 10, 5])
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("zero_vol", [0, 3])
+def test_np_kernel_same_as_original(sub_win_width: int, seed: int, zero_vol: int):
+    m01 = make_day(seed, zero_vol=zero_vol)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        a = cal_features_and_return_one_day(m01.copy(), sub_win_width=sub_win_width, **call_kwargs)
+    b = cal_features_and_return_one_day_np(m01.copy(), sub_win_width=sub_win_width, **call_kwargs)
+    assert (a.dtypes == b.dtypes).all()
+    assert_same_features(a, b)
+
+
+@pytest.mark.parametrize("sub_win_width", [30, 15, 10, 5])
+@pytest.mark.parametrize("seed", range(5))
+def test_np_kernel_same_as_original_with_volume_ties(sub_win_width: int, seed: int):
+    m01 = make_day(seed, ties=True)
+    assert m01["volume"].duplicated().any()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        a = cal_features_and_return_one_day(m01.copy(), sub_win_width=sub_win_width, **call_kwargs)
+    b = cal_features_and_return_one_day_np(m01.copy(), sub_win_width=sub_win_width, **call_kwargs)
+    assert_same_features(a, b, skip_cols=volume_order_alphas)
+
+
+@pytest.mark.parametrize("sub_win_width", [30, 15, 10, 5])
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("day_kwargs", [{}, {"zero_vol": 3}, {"ties": True}])
+def test_replay_same_as_np_kernel(sub_win_width: int, seed: int, day_kwargs: dict):
+    m01 = make_day(seed, **day_kwargs)
+    a = cal_features_and_return_one_day_np(m01.copy(), sub_win_width=sub_win_width, **call_kwargs)
+    b = replay_features_and_return_one_day(m01.copy(), sub_win_width=sub_win_width, **call_kwargs)
+    assert (a.dtypes == b.dtypes).all()
+    assert_same_features(a, b)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_masked_avg_rank_same_as_pandas(seed: int):
+    rng = np.random.default_rng(seed)
+    x = rng.integers(0, 20, size=(3, 240)).astype(float)
+    x[rng.uniform(size=x.shape) < 0.05] = np.nan
+    mask = rng.uniform(size=(3, 6, 240)) < 0.6
+    ranks = _masked_avg_rank(x, mask)
+    for d in range(3):
+        for k in range(6):
+            m = mask[d, k] & ~np.isnan(x[d])
+            assert np.array_equal(ranks[d, k, m], pd.Series(x[d, m]).rank(method="average").to_numpy()), (d, k)
+    assert (ranks[np.broadcast_to(np.isnan(x)[:, None, :], mask.shape)] == 0.5).all()
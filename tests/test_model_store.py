@@ -0,0 +1,68 @@
+import os
+import glob
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("skyrim")
+from xfuns import read_from_sio_obj, save_to_sio_obj  # noqa: E402
+from xlibs import CModelStore  # noqa: E402
+
+
+def apply_artifact(obj, x: np.ndarray, x_lbls: list) -> list[np.ndarray]:
+    if hasattr(obj, "transform"):
+        return [obj.transform(pd.DataFrame(x, columns=x_lbls))]
+    if hasattr(obj, "predict_proba"):
+        return [obj.predict(x), obj.predict_proba(x)]
+    return [obj.predict(x)]
+
+
+def test_packed_artifacts_same_as_skops_files(research_models, tmp_path):
+    models_dir = str(tmp_path / "models")
+    shutil.copytree(research_models["models_dir"], models_dir)
+    artifact_paths = sorted(glob.glob(os.path.join(models_dir, "*", "*", "M-*")))
+    expected = {_: read_from_sio_obj(_) for _ in artifact_paths}
+    assert {os.path.splitext(_)[1] for _ in artifact_paths} == {".scl", ".lm", ".mlpr", ".mlpc"}
+
+    # skops files are removed, so every artifact must be read from the stores
+    model_store = CModelStore(models_dir)
+    for month in research_models["train_end_months"]:
+        month_files = [_ for _ in artifact_paths if os.path.basename(os.path.dirname(_)) == month]
+        assert model_store.pack_month(month, t_remove_files=True) == len(month_files)
+    assert not glob.glob(os.path.join(models_dir, "*", "*", "M-*"))
+
+    x_lbls = research_models["x_lbls"]
+    x = np.random.default_rng(3).normal(size=(40, len(x_lbls)))
+    reader = CModelStore(models_dir)
+    for artifact_path, obj in expected.items():
+        month, artifact_file = os.path.basename(os.path.dirname(artifact_path)), os.path.basename(artifact_path)
+        packed = reader.read(month, artifact_file)
+        assert type(packed) is type(obj), artifact_file
+        for packed_res, res in zip(apply_artifact(packed, x, x_lbls), apply_artifact(obj, x, x_lbls)):
+            assert np.array_equal(packed_res, res), artifact_file
+
+
+def test_model_store_keeps_packed_and_reads_newer_files(research_models, tmp_path):
+    models_dir = str(tmp_path / "models")
+    shutil.copytree(research_models["models_dir"], models_dir)
+    month = "202204"
+    model_month_dir = os.path.join(models_dir, month[0:4], month)
+    lm_file, mlpr_file = "M-T02-TMW02-{}.lm".format(month), "M-T02-TMW02-{}.mlpr".format(month)
+    artifact_num = len(os.listdir(model_month_dir))
+    model_store = CModelStore(models_dir)
+    model_store.pack_month(month, t_remove_files=True)
+
+    # a retrained model saved after packing is read from its file, and packed again with the others
+    lm = read_from_sio_obj(os.path.join(research_models["models_dir"], month[0:4], month, lm_file))
+    lm.intercept_ += 1.0
+    save_to_sio_obj(lm, os.path.join(model_month_dir, lm_file))
+    os.utime(os.path.join(model_month_dir, lm_file), (os.path.getmtime(model_store.get_store_path(month)) + 1,) * 2)
+    assert CModelStore(models_dir).read(month, lm_file).intercept_ == lm.intercept_
+    assert model_store.pack_month(month, t_remove_files=True) == artifact_num
+
+    reader = CModelStore(models_dir)
+    assert reader.read(month, lm_file).intercept_ == lm.intercept_
+    mlpr = read_from_sio_obj(os.path.join(research_models["models_dir"], month[0:4], month, mlpr_file))
+    x = np.random.default_rng(4).normal(size=(10, len(research_models["x_lbls"])))
+    assert np.array_equal(reader.read(month, mlpr_file).predict(x), mlpr.predict(x))
@@ -0,0 +1,32 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip("skyrim")
+from skyrim.whiterun import CCalendarMonthly  # noqa: E402
+from ml_test import ml_model_test_one_month, ml_model_test_months  # noqa: E402
+from xlibs import get_features_and_return_lib  # noqa: E402
+
+
+# mlpr and mlpc are bit-identical, the BLAS product of LinearRegression.predict depends on array alignment
+@pytest.mark.parametrize("model_lbl, atol", [("lm", 1e-13), ("mlpr", 0), ("mlpc", 0)])
+def test_months_same_as_one_month(research_models, model_lbl, atol):
+    calendar = CCalendarMonthly(research_models["calendar_path"])
+    models_dir, train_end_months = research_models["models_dir"], research_models["train_end_months"]
+    features_and_return_lib = get_features_and_return_lib(research_models["features_and_return_dir"], research_models["sqlite3_tables"])
+    kwargs = dict(model_lbl=model_lbl, calendar=calendar, features_and_return_lib=features_and_return_lib,
+                  models_dir=models_dir, x_lbls=research_models["x_lbls"], y_lbls=research_models["y_lbls"])
+    for instrument, tid, trn_win in research_models["groups"]:
+        model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+        one_month_dfs = {m: ml_model_test_one_month(instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=m, **kwargs)
+                         for m in train_end_months}
+        # 202207, the test month of 202206, has no rows, and IH.CFE has no scaler at 202202 but test rows in 202203
+        assert one_month_dfs["202206"] is None
+        if instrument == "IH.CFE":
+            assert one_month_dfs["202202"] is None
+            assert not os.path.exists(os.path.join(models_dir, "2022", "202202", "{}-202202.scl".format(model_grp_id)))
+        expected_df = pd.concat([_ for _ in one_month_dfs.values() if _ is not None], axis=0, ignore_index=True)
+
+        months_df = ml_model_test_months(instrument=instrument, tid=tid, trn_win=trn_win, train_end_months=train_end_months, **kwargs)
+        pd.testing.assert_frame_equal(months_df.reset_index(drop=True), expected_df, check_exact=atol == 0, rtol=0, atol=atol)
+    features_and_return_lib.close()
@@ -0,0 +1,38 @@
+import os
+import glob
+import numpy as np
+import pytest
+
+pytest.importorskip("skyrim")
+from ml_normalize import ml_normalize, ml_normalize_rolling  # noqa: E402
+from xfuns import read_from_sio_obj  # noqa: E402
+
+
+def test_rolling_scalers_same_as_fit(research_env, tmp_path):
+    kwargs = {k: research_env[k] for k in ("calendar_path", "features_and_return_dir", "sqlite3_tables", "x_lbls")}
+    instruments, tids, train_windows = ["IC.CFE", "IH.CFE", None], ["T02", None], [1, 2, 4]
+    models_dirs = {"fit": str(tmp_path / "fit"), "rolling": str(tmp_path / "rolling")}
+    for instrument, tid, trn_win in [(i, t, w) for i in instruments for t in tids for w in train_windows]:
+        ml_normalize(instrument=instrument, tid=tid, trn_win=trn_win, bgn_date="20220101", stp_date="20220801",
+                     models_dir=models_dirs["fit"], y_lbls=research_env["y_lbls"], minimum_data_size=20, **kwargs)
+    ml_normalize_rolling(instruments=instruments, tids=tids, train_windows=train_windows,
+                         bgn_date="20220101", stp_date="20220801",
+                         models_dir=models_dirs["rolling"], minimum_data_size=20, **kwargs)
+
+    fit_files = {os.path.relpath(_, models_dirs["fit"]) for _ in glob.glob(os.path.join(models_dirs["fit"], "*", "*", "*.scl"))}
+    rolling_files = {os.path.relpath(_, models_dirs["rolling"]) for _ in glob.glob(os.path.join(models_dirs["rolling"], "*", "*", "*.scl"))}
+    assert fit_files == rolling_files
+    # pooled groups over windows with months of IC.CFE only, IH.CFE without scaler before 202203
+    assert any("M-TMW04-202204" in _ for _ in fit_files) and any("M-T02-TMW04-202207" in _ for _ in fit_files)
+    assert not any("M-IH.CFE-T02-TMW01-202202" in _ for _ in fit_files)
+
+    for scl_file in sorted(fit_files):
+        fit = read_from_sio_obj(os.path.join(models_dirs["fit"], scl_file))
+        rolling = read_from_sio_obj(os.path.join(models_dirs["rolling"], scl_file))
+        assert np.array_equal(rolling.n_samples_seen_, fit.n_samples_seen_), scl_file
+        assert list(rolling.feature_names_in_) == list(fit.feature_names_in_), scl_file
+        np.testing.assert_allclose(rolling.mean_, fit.mean_, rtol=1e-12, atol=1e-15, err_msg=scl_file)
+        np.testing.assert_allclose(rolling.var_, fit.var_, rtol=1e-12, atol=1e-15, err_msg=scl_file)
+        np.testing.assert_allclose(rolling.scale_, fit.scale_, rtol=1e-12, atol=1e-15, err_msg=scl_file)
+        # alpha18 is constant
+        assert rolling.scale_[18] == fit.scale_[18] == 1.0, scl_file
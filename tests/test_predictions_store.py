@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("skyrim")
+pytest.importorskip("pyarrow")
+from xlibs import CPredictionsStore  # noqa: E402
+
+
+def make_pred_df(trade_dates: list[str], pred: float) -> pd.DataFrame:
+    return pd.DataFrame({
+        "trade_date": np.repeat(trade_dates, 2),
+        "instrument": "IC.CFE", "tid": np.tile(["T01", "T02"], len(trade_dates)),
+        "rtm": np.arange(len(trade_dates) * 2, dtype=np.float64), "pred": pred,
+    })
+
+
+def test_last_write_wins_and_compact(tmp_path):
+    lib_dir = str(tmp_path / "predictions.parquet")
+    writer_a, writer_b = CPredictionsStore(lib_dir), CPredictionsStore(lib_dir)
+    jan_feb = ["20220105", "20220106", "20220201", "20220202"]
+    writer_a.append("lm", "IC.CFE", None, 6, make_pred_df(jan_feb, 1.0))
+    writer_a.append("mlpr", None, None, 6, make_pred_df(jan_feb, 1.0))
+    writer_b.append("lm", "IC.CFE", None, 6, make_pred_df(["20220202", "20220203"], 2.0))
+    writer_a.close()
+    writer_b.close()
+
+    def read_lm_preds() -> dict[str, float]:
+        src_df = CPredictionsStore(lib_dir).read(t_value_columns=["trade_date", "tid", "pred"], t_model_lbls=["lm"])
+        return {"{}-{}".format(d, t): p for d, t, p in src_df.itertuples(index=False, name=None)}
+
+    expected = {"{}-{}".format(d, t): 1.0 for d in jan_feb for t in ("T01", "T02")}
+    expected.update({"{}-{}".format(d, t): 2.0 for d in ("20220202", "20220203") for t in ("T01", "T02")})
+    assert read_lm_preds() == expected
+
+    # files of each partition are merged into one, and reads are the same
+    CPredictionsStore(lib_dir).compact()
+    for model_dir in os.listdir(lib_dir):
+        for month_dir in os.listdir(os.path.join(lib_dir, model_dir)):
+            assert len(os.listdir(os.path.join(lib_dir, model_dir, month_dir))) == 1
+    assert read_lm_preds() == expected
+
+    # a write after compact still replaces the compacted rows
+    writer_a.append("lm", "IC.CFE", None, 6, make_pred_df(["20220201"], 3.0))
+    writer_a.close()
+    expected.update({"20220201-T01": 3.0, "20220201-T02": 3.0})
+    assert read_lm_preds() == expected
+
+    # only the requested columns, models and dates are read, sorted by keys
+    src_df = CPredictionsStore(lib_dir).read(t_value_columns=["instrument_grp", "tid_grp", "trade_date", "pred"],
+                                             t_model_lbls=["lm"], t_bgn_date="20220202")
+    assert list(src_df.columns) == ["instrument_grp", "tid_grp", "trade_date", "pred"]
+    assert list(src_df["trade_date"]) == ["20220202", "20220202", "20220203", "20220203"]
+    assert (src_df["instrument_grp"] == "IC.CFE").all() and (src_df["tid_grp"] == "").all()
+    assert list(src_df["pred"]) == [2.0, 2.0, 2.0, 2.0]
+    mlpr_df = CPredictionsStore(lib_dir).read(t_value_columns=["model_lbl", "instrument_grp", "pred"], t_model_lbls=["mlpr"])
+    assert len(mlpr_df) == 8 and (mlpr_df["model_lbl"] == "mlpr").all() and (mlpr_df["instrument_grp"] == "").all()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from test_features import make_day
+
+pytest.importorskip("skyrim")
+from ml_serve import CInferenceService  # noqa: E402
+
+
+class CFakeModels(object):
+    def __init__(self):
+        """
+        with the same predict as CInferenceModels, it fails once if m_fail is set
+
+        """
+        self.m_fail = False
+
+    def predict(self, instrument: str, tid: str, alphas: dict) -> dict:
+        if self.m_fail:
+            self.m_fail = False
+            raise IndexError("no model for {}".format(tid))
+        return {"M-{}-{}-pred-lm".format(instrument, tid): alphas["alpha00"]}
+
+
+def make_request(bars: list[dict], bar_num: int = 0) -> dict:
+    return {
+        "cmd": "bars", "trade_date": "20230510", "instrument": "IC.CFE", "contract": "IC2306.CFE",
+        "contract_multiplier": 200, "pre_settle": 3990.0, "pre_spot_close": 4000.0,
+        "bar_num": bar_num, "bars": bars,
+    }
+
+
+def test_failed_bars_reset_the_engine():
+    bars = make_day(seed=1).to_dict(orient="records")
+    expected = CInferenceService(CFakeModels()).handle(make_request(bars[0:90]))["signals"]
+    assert len(expected) == 3
+
+    models = CFakeModels()
+    service = CInferenceService(models)
+    models.m_fail = True
+    response = service.handle(make_request(bars[0:90]))
+    assert "IndexError" in response["error"] and "bar_num = 0" in response["error"]
+    assert "IC.CFE" not in service.m_engines
+
+    # resent from bar_num = 0, the failed batch leaves nothing behind
+    response = service.handle(make_request(bars[0:90]))
+    assert [s["tid"] for s in response["signals"]] == [s["tid"] for s in expected]
+    for s, e in zip(response["signals"], expected):
+        np.testing.assert_allclose(list(s["predictions"].values()), list(e["predictions"].values()), rtol=0, atol=0)
+
+
+def test_bad_request_keeps_the_service():
+    service = CInferenceService(CFakeModels())
+    assert "error" in service.handle({"cmd": "bars", "instrument": ["IC.CFE"]})
+    assert "error" in service.handle({"cmd": "unknown"})
+    assert service.handle({"cmd": "metrics"})["requests"] == 0
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression
+from sklearn.neural_network import MLPRegressor, MLPClassifier
+
+pytest.importorskip("skyrim")
+from xlibs import CStackedModels  # noqa: E402
+
+month = "202301"
+x_num = 19
+
+
+class CDictStore(object):
+    def __init__(self, t_artifacts: dict):
+        """
+        artifacts in memory, with the same read as CModelStore
+
+        """
+        self.m_artifacts = t_artifacts
+
+    def read(self, t_month: str, t_artifact_file: str):
+        if (t_month, t_artifact_file) not in self.m_artifacts:
+            raise FileNotFoundError(t_artifact_file)
+        return self.m_artifacts[(t_month, t_artifact_file)]
+
+
+def fit_group(seed: int, model_lbls: list[str], y_classes: int = 2) -> dict:
+    rng = np.random.default_rng(seed)
+    x = rng.normal(loc=rng.normal(size=x_num), scale=rng.uniform(0.5, 3, size=x_num), size=(200, x_num))
+    y = x @ rng.normal(size=x_num) + rng.normal(size=200)
+    scaler = StandardScaler().fit(x)
+    x_norm = (x - scaler.mean_) / scaler.scale_
+    res = {"scl": scaler}
+    for model_lbl in model_lbls:
+        if model_lbl == "lm":
+            res[model_lbl] = LinearRegression().fit(x_norm, y)
+        elif model_lbl == "mlpr":
+            res[model_lbl] = MLPRegressor(hidden_layer_sizes=(5, 5), random_state=seed, max_iter=50).fit(x_norm, y)
+        else:
+            y_cls = np.digitize(y, np.quantile(y, np.linspace(0, 1, y_classes + 1)[1:-1]))
+            res[model_lbl] = MLPClassifier(hidden_layer_sizes=(5, 5), random_state=seed, max_iter=50).fit(x_norm, y_cls)
+    return res
+
+
+def make_store(groups: dict[str, dict]) -> CDictStore:
+    return CDictStore({(month, "{}-{}.{}".format(grp_id, month, k)): v for grp_id, models in groups.items() for k, v in models.items()})
+
+
+@pytest.mark.filterwarnings("ignore::sklearn.exceptions.ConvergenceWarning")
+def test_forward_same_as_sklearn_predict():
+    model_lbls = ["lm", "mlpr", "mlpc"]
+    groups = {
+        "M-IC.CFE-T01-TMW06": fit_group(0, model_lbls),
+        "M-IC.CFE-TMW06": fit_group(1, model_lbls),
+        "M-T01-TMW06": fit_group(2, ["lm", "mlpc"]),  # mlpr is missing
+    }
+    stacked = CStackedModels.from_store(make_store(groups), month, list(groups) + ["M-TMW06"], model_lbls)
+    assert stacked.m_grp_ids == list(groups)
+
+    x = np.random.default_rng(9).normal(scale=3, size=(300, x_num))
+    x[5, 3] = np.nan
+    preds = stacked.forward(x)
+    for g, (grp_id, models) in enumerate(groups.items()):
+        x_norm = np.nan_to_num(models["scl"].transform(x), nan=0)
+        for model_lbl in model_lbls:
+            assert preds[model_lbl].shape == (len(groups), len(x))
+            if model_lbl not in models:
+                assert np.isnan(preds[model_lbl][g]).all()
+                continue
+            np.testing.assert_allclose(preds[model_lbl][g], models[model_lbl].predict(x_norm), rtol=0, atol=1e-10)
+
+
+@pytest.mark.filterwarnings("ignore::sklearn.exceptions.ConvergenceWarning")
+def test_save_load_and_take(tmp_path):
+    model_lbls = ["lm", "mlpr", "mlpc"]
+    groups = {"M-IC.CFE-T01-TMW06": fit_group(0, model_lbls), "M-IH.CFE-T01-TMW06": fit_group(1, model_lbls)}
+    stacked = CStackedModels.from_store(make_store(groups), month, list(groups), model_lbls)
+    stacked.save(path := str(tmp_path / "stacked.npz"))
+    loaded = CStackedModels.load(path).take([1, 0])
+    assert loaded.m_grp_ids == list(groups)[::-1]
+
+    x = np.random.default_rng(3).normal(size=(50, x_num))
+    preds, loaded_preds = stacked.forward(x), loaded.forward(x)
+    for model_lbl in model_lbls:
+        np.testing.assert_array_equal(loaded_preds[model_lbl], preds[model_lbl][::-1])
+
+
+@pytest.mark.filterwarnings("ignore::sklearn.exceptions.ConvergenceWarning")
+def test_multiclass_mlpc_is_refused():
+    groups = {"M-IC.CFE-T01-TMW06": fit_group(0, ["mlpc"], y_classes=3)}
+    with pytest.raises(SystemExit):
+        CStackedModels.from_store(make_store(groups), month, list(groups), ["mlpc"])
@@ -0,0 +1,153 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("skyrim")
+from skyrim.falkreath import CManagerLibWriter, CTable  # noqa: E402
+from project_config import sqlite3_tables, cost_rate  # noqa: E402
+from ml_summary import ml_summary_incremental, ml_summary_all, summary_state_file  # noqa: E402
+from ml_summary import ml_summary_model, cal_precision_and_recall, cal_precision_and_recall_grouped  # noqa: E402
+
+model_lbls = ["lm", "mlpr", "mlpc"]
+instruments_universe, tids, train_windows = ["IC.CFE", "IH.CFE"], ["T01"], [6]
+trade_dates = ["2022{:02d}{:02d}".format(m, d) for m in (1, 2) for d in range(3, 13)]
+
+
+def make_predictions(seed: int) -> dict[str, pd.DataFrame]:
+    """
+    predictions of all groups in 202201 and 202202, M-IC.CFE-T01 starts from 202202,
+    and M-IH.CFE-T01 stops at 202201. mlpc predicts probabilities, some of them are 0.5, and some rtm are 0
+
+    :return: pred_id -> predictions with columns of the table in sqlite3_tables[pred_id]
+    """
+    rng = np.random.default_rng(seed)
+    res = {}
+    for model_lbl in model_lbls:
+        for instrument in instruments_universe + [None]:
+            for tid in tids + [None]:
+                pred_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW06"])) + "-pred-{}".format(model_lbl)
+                grp_dates = trade_dates
+                if (instrument, tid) == ("IC.CFE", "T01"):
+                    grp_dates = [_ for _ in trade_dates if _ >= "20220201"]
+                elif (instrument, tid) == ("IH.CFE", "T01"):
+                    grp_dates = [_ for _ in trade_dates if _ < "20220201"]
+                rows = len(grp_dates) * 3
+                pred = rng.uniform(size=rows) if model_lbl == "mlpc" else rng.normal(scale=0.5, size=rows)
+                rtm = rng.normal(scale=1.5, size=rows)
+                pred[::7], rtm[::11] = 0.5 if model_lbl == "mlpc" else 0.0, 0.0
+                res[pred_id] = pd.DataFrame({
+                    "trade_date": np.repeat(grp_dates, 3),
+                    "instrument": instrument or "IC.CFE", "contract": "IC2203.CFE", "tid": tid or "T02",
+                    "timestamp": np.tile([0, 1, 2], len(grp_dates)),
+                    "rtm": rtm, "pred": pred,
+                })
+    return res
+
+
+def write_predictions(predictions_dir: str, pred_dfs: dict[str, pd.DataFrame]):
+    for pred_id, pred_df in pred_dfs.items():
+        predictions_lib = CManagerLibWriter(t_db_save_dir=predictions_dir, t_db_name=pred_id + ".db")
+        predictions_lib.initialize_table(CTable(t_table_struct=sqlite3_tables[pred_id]))
+        predictions_lib.update(t_update_df=pred_df, t_using_index=False)
+        predictions_lib.close()
+    return 0
+
+
+def make_dirs(root_dir) -> dict[str, str]:
+    res = {}
+    for k in ("predictions_dir", "navs_dir", "research_summary_dir"):
+        os.makedirs(res.setdefault(k, str(root_dir / k)))
+    return res
+
+
+def read_nav(navs_dir: str, pred_id: str) -> pd.DataFrame:
+    return pd.read_csv(os.path.join(navs_dir, pred_id + "-nav.csv.gz"), dtype={"trade_date": str}).set_index("trade_date")
+
+
+def test_incremental_summary_same_as_one_pass(tmp_path):
+    kwargs = dict(model_lbls=model_lbls, instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
+                  sqlite3_tables=sqlite3_tables, cost_rate=cost_rate)
+    pred_dfs = make_predictions(seed=0)
+
+    # two runs, the second one after predictions of 202202 are appended
+    inc_dirs = make_dirs(tmp_path / "inc")
+    write_predictions(inc_dirs["predictions_dir"], {k: v.loc[v["trade_date"] < "20220201"] for k, v in pred_dfs.items()})
+    ml_summary_incremental(**kwargs, **inc_dirs)
+    write_predictions(inc_dirs["predictions_dir"], {k: v.loc[v["trade_date"] >= "20220201"] for k, v in pred_dfs.items()})
+    ml_summary_incremental(**kwargs, **inc_dirs)
+
+    # one run on both months
+    one_dirs = make_dirs(tmp_path / "one")
+    write_predictions(one_dirs["predictions_dir"], pred_dfs)
+    ml_summary_incremental(**kwargs, **one_dirs)
+    all_dirs = make_dirs(tmp_path / "all")
+    ml_summary_all(**kwargs, **(all_dirs | {"predictions_dir": one_dirs["predictions_dir"]}))
+
+    inc_state = pd.read_csv(os.path.join(inc_dirs["research_summary_dir"], summary_state_file), dtype={"last_trade_date": str})
+    one_state = pd.read_csv(os.path.join(one_dirs["research_summary_dir"], summary_state_file), dtype={"last_trade_date": str})
+    exact_cols = ["model", "instrument", "tid", "tmw", "last_trade_date", "tn", "fp", "fn", "tp", "days"]
+    pd.testing.assert_frame_equal(inc_state[exact_cols], one_state[exact_cols])
+    float_cols = ["ret_sum", "ret_sq_sum", "nav", "nav_peak", "max_drawdown"]
+    pd.testing.assert_frame_equal(inc_state[float_cols], one_state[float_cols], check_exact=False, rtol=1e-12, atol=1e-15)
+
+    for model_lbl in model_lbls:
+        trades_file = "summary.{}.trades.incremental.csv.gz".format(model_lbl)
+        inc_trades = pd.read_csv(os.path.join(inc_dirs["research_summary_dir"], trades_file))
+        one_trades = pd.read_csv(os.path.join(one_dirs["research_summary_dir"], trades_file))
+        pd.testing.assert_frame_equal(inc_trades, one_trades, check_exact=False, rtol=0, atol=2e-6)
+
+    for pred_id in pred_dfs:
+        inc_nav, one_nav, all_nav = [read_nav(d["navs_dir"], pred_id) for d in (inc_dirs, one_dirs, all_dirs)]
+        assert list(inc_nav.index) == list(all_nav.index) == sorted(pred_dfs[pred_id]["trade_date"].unique()), pred_id
+        pd.testing.assert_frame_equal(inc_nav, all_nav, check_exact=False, rtol=0, atol=2e-8)
+        pd.testing.assert_frame_equal(one_nav, all_nav, check_exact=False, rtol=0, atol=2e-8)
+
+        # the peak of nav starts from 1
+        state = one_state.iloc[list(pred_dfs).index(pred_id)]
+        nav = all_nav["nav"].to_numpy()
+        assert state["days"] == len(nav) and state["nav"] == pytest.approx(nav[-1], abs=1e-8), pred_id
+        assert state["max_drawdown"] == pytest.approx((1 - nav / np.maximum.accumulate(np.maximum(nav, 1))).max(), abs=1e-8), pred_id
+
+
+def test_precision_and_recall_grouped_same_as_one_group():
+    rng = np.random.default_rng(1)
+    grp = rng.integers(0, 5, size=400)
+    y_actu, y_pred = rng.integers(0, 2, size=400), rng.integers(0, 2, size=400)
+    grouped_df = cal_precision_and_recall_grouped(grp, 6, y_actu, y_pred)
+    for g in range(5):
+        expected = cal_precision_and_recall(t_value=1, t_y_actu=y_actu[grp == g], t_y_pred=y_pred[grp == g])
+        assert grouped_df.iloc[g].to_dict() == pytest.approx(expected, rel=1e-15), g
+    assert grouped_df.at[5, "obs"] == 0 and grouped_df.iloc[5].drop("obs").isna().all()
+
+
+def test_summary_all_same_as_summary_model(tmp_path):
+    pred_dfs = make_predictions(seed=2)
+    all_dirs = make_dirs(tmp_path / "all")
+    write_predictions(all_dirs["predictions_dir"], pred_dfs)
+    ml_summary_all(model_lbls=model_lbls, instruments_universe=instruments_universe, tids=tids, train_windows=train_windows,
+                   sqlite3_tables=sqlite3_tables, cost_rate=cost_rate, **all_dirs)
+
+    model_dirs = make_dirs(tmp_path / "model")
+    for model_lbl in model_lbls:
+        res_models, res_trades = [], []
+        for instrument in instruments_universe + [None]:
+            for tid in tids + [None]:
+                for trn_win in train_windows:
+                    summary_model, summary_trades = ml_summary_model(
+                        model_lbl=model_lbl, instrument=instrument, tid=tid, trn_win=trn_win,
+                        predictions_dir=all_dirs["predictions_dir"], navs_dir=model_dirs["navs_dir"],
+                        sqlite3_tables=sqlite3_tables, cost_rate=cost_rate)
+                    res_models.append(summary_model)
+                    res_trades.append(summary_trades)
+
+        # outputs of ml_summary_all are saved with float_format = "%.6f"
+        for res, file_type in ((res_models, "models"), (res_trades, "trades")):
+            all_df = pd.read_csv(os.path.join(all_dirs["research_summary_dir"], "summary.{}.{}.csv.gz".format(model_lbl, file_type)))
+            model_df = pd.DataFrame(res).fillna({"instrument": np.nan, "tid": np.nan})
+            assert list(all_df.columns) == list(model_df.columns), file_type
+            pd.testing.assert_frame_equal(all_df, model_df, check_exact=False, check_dtype=False, rtol=0, atol=1e-6)
+
+    for pred_id in pred_dfs:
+        all_nav, model_nav = read_nav(all_dirs["navs_dir"], pred_id), read_nav(model_dirs["navs_dir"], pred_id)
+        pd.testing.assert_frame_equal(all_nav, model_nav)
@@ -0,0 +1,94 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LinearRegression
+
+pytest.importorskip("skyrim")
+from ml_train_lm import cal_month_grams, _solve_lm_from_sums, ml_lm, ml_lm_gram  # noqa: E402
+from ml_normalize import ml_normalize_rolling  # noqa: E402
+from xfuns import read_from_sio_obj  # noqa: E402
+
+x_lbls = ["alpha{:02d}".format(_) for _ in range(6)]
+
+
+def make_src_df(seed: int, rows: int = 300, collinear_scale: float | None = None) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    x = rng.normal(size=(rows, len(x_lbls)))
+    y = x @ rng.normal(size=len(x_lbls)) + rng.normal(size=rows)
+    if collinear_scale is not None:
+        # y depends on the tiny difference between alpha04 and alpha05
+        noise = rng.normal(size=rows)
+        x[:, 5] = x[:, 4] + collinear_scale * noise
+        y += noise
+    x[:, 0:4][rng.uniform(size=(rows, 4)) < 0.05] = np.nan
+    src_df = pd.DataFrame(x, columns=x_lbls)
+    src_df["rtm"] = y
+    src_df["trade_date"] = ["2023{:02d}15".format(1 + i % 3) for i in range(rows)]
+    src_df["instrument"], src_df["tid"] = "IC.CFE", "T01"
+    return src_df
+
+
+def solve_and_fit(src_df: pd.DataFrame) -> tuple[np.ndarray, float, LinearRegression]:
+    scaler = StandardScaler().fit(src_df[x_lbls])
+    _, _, month_sums = cal_month_grams(src_df, x_lbls, "rtm")
+    sums = {k: v[0].sum(axis=0)[None] for k, v in month_sums.items()}
+    coef, intercept, _, _ = _solve_lm_from_sums(sums, scaler.mean_[None], scaler.scale_[None])
+    x_train = np.nan_to_num((src_df[x_lbls].to_numpy() - scaler.mean_) / scaler.scale_, nan=0)
+    lm = LinearRegression().fit(X=x_train, y=src_df["rtm"].to_numpy())
+    return coef[0], float(intercept[0]), lm
+
+
+# the condition number of z'z is the square of that of z, so digits are lost on nearly collinear alphas,
+# but the direction must not be dropped
+@pytest.mark.parametrize("collinear_scale, tol", [(None, 1e-9), (1e-6, 1e-3)])
+def test_solve_lm_from_sums_same_as_sklearn(collinear_scale, tol):
+    src_df = make_src_df(seed=3, collinear_scale=collinear_scale)
+    coef, intercept, lm = solve_and_fit(src_df)
+    assert np.abs(coef - lm.coef_).max() <= tol * np.abs(lm.coef_).max()
+    assert intercept == pytest.approx(lm.intercept_, rel=tol)
+
+    x_test = np.nan_to_num(make_src_df(seed=4)[x_lbls].to_numpy(), nan=0)
+    pred, pred_lm = x_test @ coef + intercept, lm.predict(x_test)
+    assert np.abs(pred - pred_lm).max() <= tol * np.abs(pred_lm).max()
+
+
+def test_cal_month_grams_exits_on_nan_return():
+    src_df = make_src_df(seed=5)
+    src_df.loc[7, "rtm"] = np.nan
+    with pytest.raises(SystemExit):
+        cal_month_grams(src_df, x_lbls, "rtm")
+
+
+def test_ml_lm_gram_same_as_ml_lm(research_env, tmp_path):
+    kwargs = {k: research_env[k] for k in ("calendar_path", "features_and_return_dir", "sqlite3_tables")}
+    x_lbls, y_lbls = research_env["x_lbls"], research_env["y_lbls"]
+    instruments, tids, train_windows = ["IC.CFE", "IH.CFE", None], ["T01", None], [1, 3]
+    models_dirs = {"lm": str(tmp_path / "lm"), "gram": str(tmp_path / "gram")}
+    for models_dir in models_dirs.values():
+        ml_normalize_rolling(instruments=instruments, tids=tids, train_windows=train_windows,
+                             bgn_date="20220101", stp_date="20220701", models_dir=models_dir,
+                             x_lbls=x_lbls, minimum_data_size=20, **kwargs)
+    for instrument, tid, trn_win in [(i, t, w) for i in instruments for t in tids for w in train_windows]:
+        ml_lm(instrument=instrument, tid=tid, trn_win=trn_win, bgn_date="20220101", stp_date="20220701",
+              models_dir=models_dirs["lm"], x_lbls=x_lbls, y_lbls=y_lbls, **kwargs)
+    ml_lm_gram(instruments=instruments, tids=tids, train_windows=train_windows, bgn_date="20220101", stp_date="20220701",
+               models_dir=models_dirs["gram"], x_lbls=x_lbls, y_lbls=y_lbls, **kwargs)
+
+    lm_files = {os.path.relpath(_, models_dirs["lm"]) for _ in glob.glob(os.path.join(models_dirs["lm"], "*", "*", "*.lm"))}
+    gram_files = {os.path.relpath(_, models_dirs["gram"]) for _ in glob.glob(os.path.join(models_dirs["gram"], "*", "*", "*.lm"))}
+    assert lm_files == gram_files
+    # pooled groups, trailing windows of 3 months, and IH.CFE, which has no scaler before 202203
+    assert any("M-TMW03-" in _ for _ in lm_files) and any("M-IC.CFE-TMW03-" in _ for _ in lm_files)
+    assert not any("M-IH.CFE-T01-TMW01-202202" in _ for _ in lm_files)
+
+    x_test = np.random.default_rng(9).normal(size=(50, len(x_lbls)))
+    for lm_file in sorted(lm_files):
+        lm = read_from_sio_obj(os.path.join(models_dirs["lm"], lm_file))
+        gram = read_from_sio_obj(os.path.join(models_dirs["gram"], lm_file))
+        assert gram.rank_ == lm.rank_, lm_file
+        assert np.abs(gram.coef_ - lm.coef_).max() <= 1e-9 * np.abs(lm.coef_).max(), lm_file
+        pred = lm.predict(x_test)
+        assert np.abs(gram.predict(x_test) - pred).max() <= 1e-9 * np.abs(pred).max(), lm_file
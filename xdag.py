@@ -0,0 +1,486 @@
+import os
+import sys
+import heapq
+import queue
+import sqlite3
+import datetime as dt
+import itertools as ittl
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+from skyrim.whiterun import CCalendarMonthly
+from xfuns import get_train_model, read_from_sio_obj, cal_features_and_return_one_day_np
+from xlibs import get_features_and_return_lib, get_predictions_store, CManagerLibParquet, features_and_return_parquet_name
+from dp_00_features_and_return import split_spot_daily_k, load_features_and_return_env
+from dp_00_features_and_return import cal_features_and_return_for_date, save_features_and_return_for_date
+from dp_01_convert_csv_to_sqlite3 import init_features_and_return_table, build_features_and_return_indexes
+from dp_01_convert_csv_to_sqlite3 import _read_features_and_return_rows
+from ml_normalize import ml_normalize_one_month
+from ml_test import ml_model_test_one_month
+from ml_summary import ml_summary_all, load_predictions_for_summary, cal_precision_and_recall_grouped
+from ml_scheduler import train_one_month_funs, save_ml_group_results
+from xmanifest import CManifest, cal_code_version, cal_inputs_hash
+
+research_dag_stages = ("features", "ingest", "normalize", "train", "test", "summary")
+
+
+def _run_dag_task(fun, args: tuple) -> tuple[bool, object]:
+    # sys.exit in a pool worker would kill the worker and hang the pool, so it is returned as a failure
+    try:
+        return True, fun(*args)
+    except SystemExit:
+        return False, "sys.exit is called"
+
+
+class CDagRunner(object):
+    def __init__(self, t_proc_num: int, t_initializer=None, t_initargs: tuple = ()):
+        """
+        tasks run on a pool of t_proc_num processes as soon as all their dependencies are done,
+        at most t_proc_num tasks are in the pool, so that a ready task of a higher priority
+        does not wait behind the queue of lower ones. Results come back to the main process,
+        where on_done of a task is called before its dependents are released.
+
+        """
+        self.m_proc_num = t_proc_num
+        self.m_initializer = t_initializer
+        self.m_initargs = t_initargs
+        self.m_tasks: dict[tuple, dict] = {}
+
+    def add_task(self, t_task_id: tuple, t_fun, t_args: tuple = (), t_deps: list[tuple] = (), t_on_done=None, t_priority: int = 0,
+                 t_is_current=None, t_on_skip=None):
+        """
+
+        :param t_task_id: like ("train", "mlpr", "IC.CFE", "T01", 6, "202301")
+        :param t_fun: a module level function, run in the pool, None for a task done in the main process at once
+        :param t_args:
+        :param t_deps: ids of tasks added before, ids not added are taken as done,
+                       so a part of the graph can run with outputs of other parts on disk
+        :param t_on_done: called with the output of t_fun in the main process
+        :param t_priority: ready tasks of higher priority are submitted first
+        :param t_is_current: called in the main process once the task is ready, if it returns True,
+                             the task is not run, and t_on_skip is called instead of t_on_done
+        :param t_on_skip:
+        :return:
+        """
+        self.m_tasks[t_task_id] = {
+            "fun": t_fun, "args": t_args,
+            "deps": [d for d in dict.fromkeys(t_deps) if d in self.m_tasks],
+            "on_done": t_on_done,
+            "priority": t_priority,
+            "order": len(self.m_tasks),
+            "is_current": t_is_current,
+            "on_skip": t_on_skip,
+        }
+        return 0
+
+    def run(self):
+        children, waiting = {k: [] for k in self.m_tasks}, {}
+        for task_id, task in self.m_tasks.items():
+            waiting[task_id] = len(task["deps"])
+            for dep in task["deps"]:
+                children[dep].append(task_id)
+        ready = [(-t["priority"], t["order"], k) for k, t in self.m_tasks.items() if waiting[k] == 0]
+        heapq.heapify(ready)
+
+        def _done(task_id: tuple, res, is_skipped: bool = False):
+            if is_skipped:
+                if (on_skip := self.m_tasks[task_id]["on_skip"]) is not None:
+                    on_skip()
+            elif (on_done := self.m_tasks[task_id]["on_done"]) is not None:
+                on_done(res)
+            for child in children[task_id]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    heapq.heappush(ready, (-self.m_tasks[child]["priority"], self.m_tasks[child]["order"], child))
+            return 1
+
+        done_queue, done_num, in_flight, skipped_num = queue.Queue(), 0, 0, 0
+        with mp.Pool(processes=self.m_proc_num, initializer=self.m_initializer, initargs=self.m_initargs) as pool:
+            while done_num < len(self.m_tasks):
+                while ready and in_flight < self.m_proc_num:
+                    task_id = heapq.heappop(ready)[2]
+                    if (fun := self.m_tasks[task_id]["fun"]) is None:
+                        done_num += _done(task_id, None)
+                        continue
+                    if (is_current := self.m_tasks[task_id]["is_current"]) is not None and is_current():
+                        done_num += _done(task_id, None, is_skipped=True)
+                        skipped_num += 1
+                        continue
+                    pool.apply_async(
+                        _run_dag_task, (fun, self.m_tasks[task_id]["args"]),
+                        callback=lambda z, k=task_id: done_queue.put((k, z)),
+                        error_callback=lambda e, k=task_id: done_queue.put((k, (False, repr(e)))),
+                    )
+                    in_flight += 1
+                if in_flight == 0:
+                    continue
+                task_id, (is_ok, res) = done_queue.get()
+                in_flight -= 1
+                if not is_ok:
+                    print("... {} | task {} failed: {}".format(dt.datetime.now(), task_id, res))
+                    print("... this program will terminate at once, please check again")
+                    pool.terminate()
+                    sys.exit()
+                done_num += _done(task_id, res)
+            pool.close()
+            pool.join()
+        if skipped_num > 0:
+            print("... {} | {} tasks are current and skipped".format(dt.datetime.now(), skipped_num))
+        return 0
+
+
+# --- tasks of the research dag, lookup tables and readers of a pool worker are loaded once when first used
+_worker_env = {}
+
+
+def _init_research_dag_worker(env_kwargs: dict):
+    _worker_env["kwargs"] = env_kwargs
+    return 0
+
+
+def _get_worker_env(name: str):
+    if name not in _worker_env:
+        kw = _worker_env["kwargs"]
+        if name == "features_env":
+            _worker_env[name] = load_features_and_return_env(**kw["features_env_kwargs"])
+            Finalize(None, _worker_env[name]["m01_db"].close, exitpriority=16)
+        elif name == "calendar":
+            _worker_env[name] = CCalendarMonthly(kw["calendar_path"])
+        elif name == "features_and_return_lib":
+            _worker_env[name] = get_features_and_return_lib(kw["features_and_return_dir"], kw["sqlite3_tables"], kw["features_lib_type"])
+            Finalize(None, _worker_env[name].close, exitpriority=16)
+    return _worker_env[name]
+
+
+def _get_month_kwargs(instrument: str | None, tid: str | None, trn_win: int, train_end_month: str) -> dict:
+    kw = _worker_env["kwargs"]
+    return dict(
+        instrument=instrument, tid=tid, trn_win=trn_win, train_end_month=train_end_month,
+        calendar=_get_worker_env("calendar"), features_and_return_lib=_get_worker_env("features_and_return_lib"),
+        models_dir=kw["models_dir"], x_lbls=kw["x_lbls"], y_lbls=kw["y_lbls"],
+    )
+
+
+def _dag_features(trade_date: str):
+    return cal_features_and_return_for_date(trade_date, sub_win_width=_worker_env["kwargs"]["sub_win_width"],
+                                            **_get_worker_env("features_env"))
+
+
+def _dag_ingest(trade_date: str) -> list[tuple]:
+    kw = _worker_env["kwargs"]
+    if not os.path.exists(os.path.join(kw["features_and_return_dir"], trade_date[0:4], trade_date)):
+        return []
+    return _read_features_and_return_rows(trade_date, kw["features_and_return_dir"], kw["equity_indexes"], kw["ingest_columns"])
+
+
+def _dag_normalize(instrument: str | None, tid: str | None, trn_win: int, train_end_month: str):
+    ml_normalize_one_month(minimum_data_size=_worker_env["kwargs"]["minimum_data_size"],
+                           **_get_month_kwargs(instrument, tid, trn_win, train_end_month))
+    return 0
+
+
+def _dag_train(model_lbl: str, instrument: str | None, tid: str | None, trn_win: int, train_end_month: str,
+               prev_train_end_month: str | None) -> dict | None:
+    kw = _worker_env["kwargs"]
+    train_model = get_train_model(model_lbl, warm_start=kw["warm_start"])
+    if kw["warm_start"] and model_lbl != "lm" and prev_train_end_month is not None:
+        # the model of last month is loaded, instead of kept in memory like ml_mlpr
+        model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+        prev_model_path = os.path.join(kw["models_dir"], prev_train_end_month[0:4], prev_train_end_month,
+                                       "{}-{}.{}".format(model_grp_id, prev_train_end_month, model_lbl))
+        if os.path.exists(prev_model_path):
+            train_model = read_from_sio_obj(prev_model_path)
+    return train_one_month_funs[model_lbl](train_model=train_model, **_get_month_kwargs(instrument, tid, trn_win, train_end_month))
+
+
+def _dag_test(model_lbl: str, instrument: str | None, tid: str | None, trn_win: int, train_end_month: str):
+    return ml_model_test_one_month(model_lbl=model_lbl, **_get_month_kwargs(instrument, tid, trn_win, train_end_month))
+
+
+def _dag_summary(model_lbl: str):
+    kw = _worker_env["kwargs"]
+    return ml_summary_all(
+        model_lbls=[model_lbl],
+        instruments_universe=kw["instruments_universe"], tids=kw["tids"], train_windows=kw["train_windows"],
+        sqlite3_tables=kw["sqlite3_tables"],
+        predictions_dir=kw["predictions_dir"], navs_dir=kw["navs_dir"],
+        research_summary_dir=kw["summary_dir"],
+        cost_rate=kw["cost_rate"],
+        predictions_lib_type=kw["predictions_lib_type"],
+    )
+
+
+def run_research_dag(stages: tuple[str, ...],
+                     md_bgn_date: str, md_stp_date: str,
+                     trn_bgn_date: str, trn_stp_date: str,
+                     calendar_path: str,
+                     features_env_kwargs: dict,
+                     equity_index_by_instrument_dir: str,
+                     research_features_and_return_dir: str,
+                     models_dir: str, predictions_dir: str, navs_dir: str, summary_dir: str,
+                     sqlite3_tables: dict,
+                     equity_indexes,
+                     instruments_universe: list[str], tids: list[str], train_windows: list[int],
+                     x_lbls: list, y_lbls: list,
+                     cost_rate: float,
+                     model_lbls: tuple[str, ...] = ("lm", "mlpr", "mlpc"),
+                     sub_win_width: int = 30,
+                     features_sink: str = "csv",
+                     minimum_data_size: int = 100,
+                     warm_start: bool = False,
+                     proc_num: int = 5,
+                     manifest_path: str | None = None,
+                     predictions_lib_type: str = "sqlite",
+                     ):
+    """
+    run stages of main.py as one graph of tasks:
+        features(date) -> ingest(date) -> normalize(group, month) -> train(model, group, month)
+        -> test(model, group, month) -> summary(model)
+    a task runs once the data and artifacts it reads exist, so stages overlap, e.g.
+    mlpc of a month does not wait for mlpr of all months, and test of a group starts once
+    its model of this month is fitted. Groups are product(instruments_universe + [None], tids + [None], train_windows).
+    The main process is the only writer of features_and_return.db, the parquet lib, prediction dbs and fit logs.
+
+    :param stages: a part of research_dag_stages, tasks of other stages are not run,
+                   and their outputs are expected to be on disk already
+    :param md_bgn_date: begin date of features, format = [YYYYMMDD]
+    :param md_stp_date: stop date of features, format = [YYYYMMDD]
+    :param trn_bgn_date: begin date of train end months, format = [YYYYMMDD]
+    :param trn_stp_date: stop date of train end months, format = [YYYYMMDD]
+    :param calendar_path:
+    :param features_env_kwargs: other arguments of load_features_and_return_env, like futures_md_dir
+    :param equity_index_by_instrument_dir:
+    :param research_features_and_return_dir:
+    :param models_dir:
+    :param predictions_dir:
+    :param navs_dir:
+    :param summary_dir:
+    :param sqlite3_tables:
+    :param equity_indexes:
+    :param instruments_universe:
+    :param tids:
+    :param train_windows:
+    :param x_lbls:
+    :param y_lbls: "rtm" must be in it
+    :param cost_rate:
+    :param model_lbls:
+    :param sub_win_width:
+    :param features_sink: "csv" for features_and_return.db by ingest, "parquet" for features_and_return.parquet, no ingest then
+    :param minimum_data_size:
+    :param warm_start: for mlpr and mlpc, train of a month depends on train of last month
+    :param proc_num:
+    :param manifest_path: if provided, a task is skipped if its artifact is current in this CManifest,
+                          i.e. its data range, upstream artifacts, x_lbls, model params and code are unchanged,
+                          so a run with later stop dates only makes new feature days, scalers, models and predictions
+    :param predictions_lib_type: "sqlite" for a db per pred_id, "parquet" for one CPredictionsStore,
+                                 which is flushed once all tests of a model are done, before its summary
+    :return:
+    """
+    if unsupported := [_ for _ in stages if _ not in research_dag_stages]:
+        print("... stages {} are not supported".format(unsupported))
+        sys.exit()
+    if "features" in stages:
+        split_spot_daily_k(equity_index_by_instrument_dir, equity_indexes)
+
+    calendar = CCalendarMonthly(calendar_path)
+    trade_dates = calendar.get_iter_list(md_bgn_date, md_stp_date, True)
+    data_months = sorted(set(_[0:6] for _ in trade_dates))
+    iter_months = calendar.map_iter_dates_to_iter_months(trn_bgn_date, trn_stp_date)
+    groups = list(ittl.product(instruments_universe + [None], tids + [None], train_windows))
+    features_lib_type = "parquet" if features_sink == "parquet" else "sqlite"
+
+    # --- single writers
+    features_and_return_lib = CManagerLibParquet(
+        t_lib_dir=os.path.join(research_features_and_return_dir, features_and_return_parquet_name)
+    ) if features_sink == "parquet" else None
+    predictions_store = get_predictions_store(predictions_dir) if predictions_lib_type == "parquet" else None
+    ingest_columns, connection = [], None
+    if features_sink == "csv" and "ingest" in stages:
+        ingest_columns, insert_sql = init_features_and_return_table("a", research_features_and_return_dir, sqlite3_tables)
+        connection = sqlite3.connect(os.path.join(research_features_and_return_dir, "features_and_return.db"), timeout=60)
+
+    def _on_features_done(trade_date: str, res):
+        if res:
+            save_features_and_return_for_date(trade_date, res, research_features_and_return_dir, features_and_return_lib)
+            if features_and_return_lib is not None:
+                features_and_return_lib.flush()
+        return 0
+
+    def _on_ingest_done(rows: list[tuple] | None):
+        if rows:
+            connection.executemany(insert_sql, rows)
+            connection.commit()
+        return 0
+
+    # --- results of a group are kept until all its months are done, then saved in the order of months
+    grp_results = {}
+
+    def _on_month_done(stage: str, grp_key: tuple, train_end_month: str, res):
+        grp_results.setdefault((stage, grp_key), {})[train_end_month] = res
+        if len(grp_results[(stage, grp_key)]) == len(iter_months):
+            save_ml_group_results(stage, grp_key, grp_results.pop((stage, grp_key)), models_dir, predictions_dir, sqlite3_tables, warm_start,
+                                  merge=manifest is not None, predictions_store=predictions_store)
+        return 0
+
+    # --- manifest, inputs of a task are calculated once it is ready, from the hashes of its upstream artifacts
+    manifest = CManifest(manifest_path) if manifest_path is not None else None
+    manifest_inputs = {}
+    code_versions = {
+        "features": cal_code_version(cal_features_and_return_for_date, cal_features_and_return_one_day_np),
+        "ingest": cal_code_version(_read_features_and_return_rows),
+        "normalize": cal_code_version(ml_normalize_one_month),
+        "test": cal_code_version(ml_model_test_one_month),
+        "summary": cal_code_version(ml_summary_all, load_predictions_for_summary, cal_precision_and_recall_grouped),
+    }
+    code_versions.update({m: cal_code_version(train_one_month_funs[m], get_train_model) for m in model_lbls})
+    data_stage = "features" if features_sink == "parquet" else "ingest"
+
+    def _key(task_id: tuple) -> str:
+        return "/".join(str(_) for _ in task_id)
+
+    def _hash_of(task_id: tuple) -> str | None:
+        return manifest.get_hash(_key(task_id))
+
+    def _data_inputs(months: list[str]) -> list[tuple]:
+        return [(d, _hash_of((data_stage, d))) for d in trade_dates if d[0:6] in months]
+
+    def _add_task(task_id: tuple, fun, args: tuple, deps: list[tuple], priority: int, on_done=None,
+                  inputs_fun=None, artifact: str = "", record_if=None):
+        if manifest is None:
+            return runner.add_task(task_id, fun, args, deps, on_done, priority)
+
+        def _is_current() -> bool:
+            manifest_inputs[task_id] = inputs_fun()
+            return manifest.is_current(_key(task_id), manifest_inputs[task_id])
+
+        def _on_done(res):
+            if on_done is not None:
+                on_done(res)
+            if record_if is None or record_if(res):
+                manifest.record(_key(task_id), manifest_inputs.pop(task_id), artifact)
+            return 0
+
+        return runner.add_task(task_id, fun, args, deps, _on_done, priority,
+                               t_is_current=_is_current, t_on_skip=(lambda: on_done(None)) if on_done is not None else None)
+
+    # --- graph
+    runner = CDagRunner(proc_num, _init_research_dag_worker, ({
+        "features_env_kwargs": dict(features_env_kwargs, equity_indexes=equity_indexes, calendar_path=calendar_path,
+                                    equity_index_by_instrument_dir=equity_index_by_instrument_dir),
+        "sub_win_width": sub_win_width,
+        "equity_indexes": equity_indexes,
+        "ingest_columns": ingest_columns,
+        "calendar_path": calendar_path,
+        "features_and_return_dir": research_features_and_return_dir,
+        "features_lib_type": features_lib_type,
+        "sqlite3_tables": sqlite3_tables,
+        "models_dir": models_dir,
+        "predictions_dir": predictions_dir,
+        "navs_dir": navs_dir,
+        "summary_dir": summary_dir,
+        "x_lbls": x_lbls,
+        "y_lbls": y_lbls,
+        "minimum_data_size": minimum_data_size,
+        "warm_start": warm_start,
+        "instruments_universe": instruments_universe,
+        "tids": tids,
+        "train_windows": train_windows,
+        "cost_rate": cost_rate,
+        "predictions_lib_type": predictions_lib_type,
+    },))
+    for trade_date in trade_dates:
+        if "features" in stages:
+            _add_task(("features", trade_date), _dag_features, (trade_date,), [], 0,
+                      on_done=lambda z, d=trade_date: _on_features_done(d, z),
+                      inputs_fun=lambda d=trade_date: {
+                          "trade_date": d, "sub_win_width": sub_win_width, "equity_indexes": equity_indexes,
+                          "code": code_versions["features"],
+                      },
+                      artifact=os.path.join(research_features_and_return_dir, trade_date[0:4], trade_date) if features_sink == "csv" else "",
+                      record_if=bool)
+        if "ingest" in stages and features_sink == "csv":
+            _add_task(("ingest", trade_date), _dag_ingest, (trade_date,), [("features", trade_date)], 1,
+                      on_done=_on_ingest_done,
+                      inputs_fun=lambda d=trade_date: {"features": _hash_of(("features", d)), "code": code_versions["ingest"]},
+                      record_if=bool)
+    if "ingest" in stages and features_sink == "csv":
+        # indexes are built once all rows are inserted, done in the main process before any read
+        runner.add_task(("indexes",), None, (), [("ingest", d) for d in trade_dates],
+                        lambda z: build_features_and_return_indexes(research_features_and_return_dir, sqlite3_tables))
+    for month in data_months:
+        # all data of a month is ready, done in the main process
+        runner.add_task(("data", month), None, (),
+                        [(stage, d) for d in trade_dates if d[0:6] == month for stage in ("features", "ingest")] + [("indexes",)])
+
+    def _window_months(bgn: str, end: str) -> list[str]:
+        return [m for m in data_months if bgn[0:6] <= m <= end[0:6]]
+
+    for instrument, tid, trn_win in groups:
+        model_grp_id = "-".join(filter(lambda z: z, ["M", instrument, tid, "TMW{:02d}".format(trn_win)]))
+        for i, month in enumerate(iter_months):
+            month_key = (instrument, tid, trn_win, month)
+            model_month_dir = os.path.join(models_dir, month[0:4], month)
+            train_window = calendar.get_bgn_and_end_dates_for_trailing_window(month, trn_win)
+            if "normalize" in stages:
+                _add_task(("normalize",) + month_key, _dag_normalize, month_key,
+                          [("data", m) for m in _window_months(*train_window)], 2,
+                          inputs_fun=lambda w=train_window: {
+                              "train_window": w, "data": _data_inputs(_window_months(*w)),
+                              "x_lbls": x_lbls, "y_lbls": y_lbls, "minimum_data_size": minimum_data_size,
+                              "code": code_versions["normalize"],
+                          },
+                          artifact=os.path.join(model_month_dir, "{}-{}.scl".format(model_grp_id, month)))
+            test_month = calendar.get_next_month(month, 1)
+            test_months = _window_months(calendar.get_first_date_of_month(test_month), calendar.get_last_date_of_month(test_month))
+            for model_lbl in model_lbls:
+                grp_key = (model_lbl, instrument, tid, trn_win)
+                prev_month = iter_months[i - 1] if i > 0 else None
+                train_id, prev_train_id = ("train", model_lbl) + month_key, ("train", model_lbl) + month_key[:3] + (prev_month,)
+                if "train" in stages:
+                    _add_task(train_id, _dag_train, (model_lbl,) + month_key + (prev_month,),
+                              [("normalize",) + month_key] + ([prev_train_id] if warm_start else []), 3,
+                              on_done=lambda z, g=grp_key, m=month: _on_month_done("train", g, m, z),
+                              inputs_fun=lambda k=month_key, ml=model_lbl, p=prev_train_id: {
+                                  "normalize": _hash_of(("normalize",) + k),
+                                  "model_params": get_train_model(ml, warm_start=warm_start).get_params(),
+                                  "x_lbls": x_lbls, "y_lbls": y_lbls,
+                                  "prev": _hash_of(p) if warm_start else None,
+                                  "code": code_versions[ml],
+                              },
+                              artifact=os.path.join(model_month_dir, "{}-{}.{}".format(model_grp_id, month, model_lbl)))
+                if "test" in stages:
+                    _add_task(("test", model_lbl) + month_key, _dag_test, (model_lbl,) + month_key,
+                              [train_id] + [("data", m) for m in test_months], 4,
+                              on_done=lambda z, g=grp_key, m=month: _on_month_done("test", g, m, z),
+                              inputs_fun=lambda t=train_id, tm=test_months: {
+                                  "train": _hash_of(t), "test_data": _data_inputs(tm), "code": code_versions["test"],
+                              })
+    if "summary" in stages:
+        for model_lbl in model_lbls:
+            test_ids = [("test", model_lbl, instrument, tid, trn_win, month) for instrument, tid, trn_win in groups for month in iter_months]
+            summary_deps = test_ids
+            if predictions_store is not None:
+                # predictions of all tests are flushed in the main process, before the summary reads them
+                runner.add_task(("predictions", model_lbl), None, (), test_ids, lambda z: predictions_store.flush())
+                summary_deps = [("predictions", model_lbl)]
+            _add_task(("summary", model_lbl), _dag_summary, (model_lbl,), summary_deps, 5,
+                      inputs_fun=lambda t=test_ids: {
+                          "tests": cal_inputs_hash({_key(z): _hash_of(z) for z in t}), "cost_rate": cost_rate,
+                          "code": code_versions["summary"],
+                      },
+                      artifact=os.path.join(summary_dir, "summary.{}.models.csv.gz".format(model_lbl)))
+
+    print("... {} | {} tasks of {} are added to the dag".format(dt.datetime.now(), len(runner.m_tasks), stages))
+    try:
+        runner.run()
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+    if features_and_return_lib is not None:
+        features_and_return_lib.close()
+    if predictions_store is not None:
+        predictions_store.close()
+        predictions_store.compact()
+    if connection is not None:
+        connection.close()
+    return 0
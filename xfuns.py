@@ -1,8 +1,11 @@
 import sys
+import bisect
 import datetime as dt
 import numpy as np
 import pandas as pd
 import skops.io as sio
+from sklearn.linear_model import LinearRegression
+from sklearn.neural_network import MLPRegressor, MLPClassifier
 
 
 def cal_features_and_return_one_day(m01: pd.DataFrame,
@@ -122,6 +125,426 @@ def cal_features_and_return_one_day(m01: pd.DataFrame,
     return res_df
 
 
+# --- fields of the minute bar tensor used by the array kernel, order matters
+m01_tensor_fields = ("timestamp", "high", "low", "volume", "amount", "daily_open", "daily_high", "daily_low", "preclose")
+
+
+def _ffill_rows(t_a: np.ndarray) -> np.ndarray:
+    # forward fill NaN along the last axis, leading NaN are kept
+    n = t_a.shape[-1]
+    idx = np.where(np.isnan(t_a), 0, np.arange(n))
+    idx = np.maximum.accumulate(idx, axis=-1)
+    return np.take_along_axis(t_a, idx, axis=-1)
+
+
+def _masked_avg_rank(t_x: np.ndarray, t_mask: np.ndarray) -> np.ndarray:
+    """
+
+    :param t_x: shape = (days, bars)
+    :param t_mask: shape = (days, subsets, bars), bool
+    :return: shape = (days, subsets, bars), average rank of each bar inside each subset,
+             values outside the subset are meaningless.
+             One sort per day, then ranks of all subsets are counted by cumsum, O(bars * subsets)
+    """
+    d, n = t_x.shape
+    order = np.argsort(t_x, axis=1, kind="stable")
+    x_sorted = np.take_along_axis(t_x, order, axis=1)
+
+    # first and last sorted positions of the ties of each bar, NaN is not tied with anything
+    is_new = np.ones((d, n), dtype=bool)
+    is_new[:, 1:] = x_sorted[:, 1:] != x_sorted[:, :-1]
+    is_last = np.ones((d, n), dtype=bool)
+    is_last[:, :-1] = is_new[:, 1:]
+    pos = np.arange(n)
+    tie_bgn = np.maximum.accumulate(np.where(is_new, pos, 0), axis=1)
+    tie_end = np.minimum.accumulate(np.where(is_last, pos, n - 1)[:, ::-1], axis=1)[:, ::-1]
+
+    # [d, k, j] = number of bars in subset k before sorted position j, counts are exact in int
+    cnt = np.zeros(t_mask.shape[0:2] + (n + 1,), dtype=np.int32)
+    np.cumsum(np.take_along_axis(t_mask, order[:, None, :], axis=2), axis=2, out=cnt[:, :, 1:])
+    less = np.take_along_axis(cnt, tie_bgn[:, None, :], axis=2)
+    less_or_tie = np.take_along_axis(cnt, tie_end[:, None, :] + 1, axis=2)
+    rank_sorted = (less + less_or_tie) * 0.5 + 0.5
+
+    rank = np.empty_like(rank_sorted)
+    np.put_along_axis(rank, np.broadcast_to(order[:, None, :], rank.shape), rank_sorted, axis=2)
+    # a NaN bar is ranked 0.5 as if it were compared with nothing
+    return np.where(np.isnan(t_x)[:, None, :], 0.5, rank)
+
+
+def _masked_spearman(t_x: np.ndarray, t_y: np.ndarray, t_mask: np.ndarray, t_ry: np.ndarray | None = None) -> np.ndarray:
+    """
+    spearman correlation of x and y inside each subset, pairwise complete observations only,
+    same as pd.DataFrame.corr(method="spearman")
+
+    :param t_x: shape = (days, bars)
+    :param t_y: shape = (days, bars)
+    :param t_mask: shape = (days, subsets, bars), bool
+    :param t_ry: ranks of y inside t_mask from _masked_avg_rank, reused if neither x nor y has NaN
+    :return: shape = (days, subsets)
+    """
+    has_nan = np.isnan(t_x) | np.isnan(t_y)
+    mask = (t_mask & ~has_nan[:, None, :]) if has_nan.any() else t_mask
+    rx = _masked_avg_rank(t_x, mask)
+    ry = t_ry if (t_ry is not None and mask is t_mask) else _masked_avg_rank(t_y, mask)
+    rx, ry = np.where(mask, rx, 0), np.where(mask, ry, 0)
+
+    # mean of average ranks is (obs + 1) / 2, sums below are exact for ranks in halves
+    obs = mask.sum(axis=2)
+    sq_mean = obs * (obs + 1) ** 2 / 4
+    cov = np.einsum("dkn,dkn->dk", rx, ry) - sq_mean
+    divisor = np.sqrt((np.einsum("dkn,dkn->dk", rx, rx) - sq_mean) * (np.einsum("dkn,dkn->dk", ry, ry) - sq_mean))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(divisor != 0, cov / divisor, np.nan)
+
+
+def _masked_mean(t_x: np.ndarray, t_mask: np.ndarray) -> np.ndarray:
+    # t_x: (days, bars), t_mask: (days, subsets, bars), NaN skipped, NaN if subset is empty
+    mask = t_mask & ~np.isnan(t_x)[:, None, :]
+    obs = mask.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(obs > 0, np.where(mask, t_x[:, None, :], 0).sum(axis=2) / obs, np.nan)
+
+
+def _skew_from_moments(t_cnt: np.ndarray, t_s1: np.ndarray, t_s2: np.ndarray, t_s3: np.ndarray) -> np.ndarray:
+    # same as pd.Series.skew(), from count and sums of x, x**2, x**3
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = t_s1 / t_cnt
+        m2 = t_s2 - mu * t_s1
+        m3 = t_s3 - 3 * mu * t_s2 + 2 * mu * mu * t_s1
+        m2 = np.where(np.abs(m2) < 1e-14, 0, m2)
+        m3 = np.where(np.abs(m3) < 1e-14, 0, m3)
+        skewness = (t_cnt * (t_cnt - 1) ** 0.5 / (t_cnt - 2)) * (m3 / m2 ** 1.5)
+    skewness = np.where(m2 == 0, 0, skewness)
+    return np.where(t_cnt < 3, np.nan, skewness)
+
+
+def cal_features_and_return_tensor(m01_tensor: np.ndarray, contract_multiplier: int,
+                                   pre_settle: np.ndarray, pre_spot_close: np.ndarray,
+                                   sub_win_width: int = 30, tot_bar_num: int = 240,
+                                   amount_scale: float = 1e4, ret_scale: int = 100) -> dict[str, np.ndarray]:
+    """
+    array version of cal_features_and_return_one_day, all checkpoints of all days are calculated at once
+
+    :param m01_tensor: shape = (days, tot_bar_num, len(m01_tensor_fields)), fields are in the order of m01_tensor_fields
+    :param contract_multiplier:
+    :param pre_settle: shape = (days,)
+    :param pre_spot_close: shape = (days,)
+    :param sub_win_width:
+    :param tot_bar_num:
+    :param amount_scale:
+    :param ret_scale:
+    :return: a dict, "alpha00" ~ "alpha02" are of shape (days,),
+             "timestamp", "alpha03" ~ "alpha20" and "rtm" are of shape (days, checkpoints)
+    """
+    d = m01_tensor.shape[0]
+    f = {k: m01_tensor[:, :, i] for i, k in enumerate(m01_tensor_fields)}
+    pre_settle = np.broadcast_to(np.asarray(pre_settle, dtype=np.float64), (d,))
+    pre_spot_close = np.broadcast_to(np.asarray(pre_spot_close, dtype=np.float64), (d,))
+
+    # check whether 5/10/15 minutes bars could be aggregated from consecutive minute bars
+    for m_agg_width in (5, 10, 15):
+        bucket = f["timestamp"].reshape(d, -1, m_agg_width) // (60 * m_agg_width)
+        if np.any(bucket != bucket[:, :, 0:1]):
+            print("... data length is wrong! M{:02d} can not be aggregated from {} minute bars".format(
+                m_agg_width, tot_bar_num))
+            print("... this program will terminate at once, please check again")
+            sys.exit()
+
+    # intermediary variables
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = _ffill_rows(f["amount"] / f["volume"] / contract_multiplier * amount_scale)
+        vwap_cum = _ffill_rows(np.cumsum(f["amount"], axis=1) / np.cumsum(f["volume"], axis=1) / contract_multiplier * amount_scale)
+    prev_vwap = np.concatenate([np.full((d, 1), np.nan), vwap[:, :-1]], axis=1)
+    prev_vwap = np.where(np.isnan(prev_vwap), pre_settle[:, None], prev_vwap)
+    m01_return = (vwap / prev_vwap - 1) * ret_scale
+
+    # basic price
+    prev_day_close = f["preclose"][:, 0]
+    this_day_open = f["daily_open"][:, 0]
+    this_day_end_vwap = vwap[:, -1]
+
+    # checkpoints
+    bar_num_before_t = sub_win_width * np.arange(1, int(tot_bar_num / sub_win_width))
+    last_bar, norm_scale = bar_num_before_t - 1, np.sqrt(bar_num_before_t)
+    tn = len(bar_num_before_t)
+
+    res = {
+        "timestamp": f["timestamp"][:, bar_num_before_t].astype(np.int64),
+        "alpha00": (pre_settle / pre_spot_close - 1) * ret_scale,
+        "alpha01": (prev_day_close / pre_settle - 1) * ret_scale,
+        "alpha02": (this_day_open / prev_day_close - 1) * ret_scale,
+        "alpha03": (vwap[:, last_bar] / this_day_open[:, None] - 1) / norm_scale * ret_scale,
+        "alpha04": (vwap_cum[:, last_bar] / this_day_open[:, None] - 1) / norm_scale * ret_scale,
+        "alpha05": (f["daily_high"][:, last_bar] / this_day_open[:, None] - 1) / norm_scale * ret_scale,
+        "alpha06": (f["daily_low"][:, last_bar] / this_day_open[:, None] - 1) / norm_scale * ret_scale,
+    }
+
+    # --- top volume bars: bars are ranked by volume once a day, ties are broken by time
+    # a bar's position among bars before t is the count of bars before t ahead of it in this order
+    order = np.argsort(-f["volume"], axis=1, kind="stable")
+    in_prefix = order[:, None, :] < bar_num_before_t[None, :, None]  # (days, checkpoints, sorted bars)
+    pos = np.cumsum(in_prefix, axis=2)
+    k01, k02, k05 = [(r * bar_num_before_t).astype(int)[None, :, None] for r in (0.1, 0.2, 0.5)]
+    top01, top02, top05 = [in_prefix & (pos <= k) for k in (k01, k02, k05)]
+
+    sorted_return = np.take_along_axis(m01_return, order, axis=1)
+    res["alpha07"] = _masked_mean(sorted_return, top01)
+    res["alpha08"] = _masked_mean(sorted_return, top02 & (pos > k01))
+    res["alpha09"] = _masked_mean(sorted_return, top05 & (pos > k02))
+
+    # --- rank correlation, subsets are mapped back from volume order to time order
+    inv_order = np.argsort(order, axis=1)[:, None, :]
+    subsets = np.concatenate([
+        np.take_along_axis(top01, inv_order, axis=2),
+        np.take_along_axis(top02, inv_order, axis=2),
+        np.take_along_axis(top05, inv_order, axis=2),
+        np.broadcast_to(np.arange(tot_bar_num)[None, None, :] < bar_num_before_t[None, :, None], (d, tn, tot_bar_num)),
+    ], axis=1)
+    volume_rank = _masked_avg_rank(f["volume"], subsets)
+    corr_vwap = _masked_spearman(vwap, f["volume"], subsets, volume_rank)
+    corr_ret = _masked_spearman(m01_return, f["volume"], subsets, volume_rank)
+    for j, lbl in enumerate(["alpha10", "alpha11", "alpha12", "alpha16"]):
+        res[lbl] = corr_vwap[:, j * tn:(j + 1) * tn]
+    for j, lbl in enumerate(["alpha13", "alpha14", "alpha15", "alpha17"]):
+        res[lbl] = corr_ret[:, j * tn:(j + 1) * tn]
+
+    # --- chart, only the first three aggregated bars are used
+    up, down = {}, {}
+    for m_agg_width in (5, 10, 15):
+        agg_low = f["low"][:, 0:3 * m_agg_width].reshape(d, 3, m_agg_width).min(axis=2)
+        agg_high = f["high"][:, 0:3 * m_agg_width].reshape(d, 3, m_agg_width).max(axis=2)
+        up[m_agg_width] = ((agg_low[:, 0] < agg_low[:, 1]) & (agg_low[:, 1] < agg_low[:, 2]))[:, None]
+        down[m_agg_width] = ((agg_high[:, 0] > agg_high[:, 1]) & (agg_high[:, 1] > agg_high[:, 2]))[:, None]
+    conds = [bar_num_before_t >= 15 * 3, bar_num_before_t >= 10 * 3, bar_num_before_t >= 5 * 3]
+    res["alpha18"] = np.select(conds, [up[15], up[10], up[5]], 0).astype(np.int64)
+    res["alpha19"] = np.select(conds, [down[15], down[10], down[5]], 0).astype(np.int64)
+
+    # --- skewness, from prefix sums of return moments
+    valid = ~np.isnan(m01_return)
+    r = np.where(valid, m01_return, 0)
+    cnt = np.cumsum(valid, axis=1)[:, last_bar]
+    s1, s2, s3 = [np.cumsum(r ** p, axis=1)[:, last_bar] for p in (1, 2, 3)]
+    res["alpha20"] = _skew_from_moments(cnt, s1, s2, s3)
+
+    # --- return to mature
+    res["rtm"] = (this_day_end_vwap[:, None] / vwap[:, bar_num_before_t] - 1) * ret_scale
+    return res
+
+
+def cal_features_and_return_one_day_np(m01: pd.DataFrame,
+                                       instrument: str, contract: str, contract_multiplier: int,
+                                       pre_settle: float, pre_spot_close: float,
+                                       sub_win_width: int = 30, tot_bar_num: int = 240,
+                                       amount_scale: float = 1e4, ret_scale: int = 100) -> pd.DataFrame:
+    """
+    same output as cal_features_and_return_one_day, calculated by cal_features_and_return_tensor.
+    Bars with the same volume are ordered by time here, while the order is left
+    to pandas unstable sort in the original one, so alpha07 ~ alpha15 may differ only
+    when there are ties in volume at the edge of the top bars.
+
+    """
+    if len(m01) != tot_bar_num:
+        print("... data length is wrong! Length of M01 is {} != {}".format(len(m01), tot_bar_num))
+        print("... contract = {}".format(contract))
+        print("... this program will terminate at once, please check again")
+        sys.exit()
+    m01_tensor = m01[list(m01_tensor_fields)].to_numpy(dtype=np.float64)[None, :, :]
+    ans = cal_features_and_return_tensor(
+        m01_tensor=m01_tensor, contract_multiplier=contract_multiplier,
+        pre_settle=pre_settle, pre_spot_close=pre_spot_close,
+        sub_win_width=sub_win_width, tot_bar_num=tot_bar_num,
+        amount_scale=amount_scale, ret_scale=ret_scale)
+    res_df = features_and_return_to_table(t_ans=ans, trade_dates=None, instrument=instrument, contracts=[contract])
+    res_df.index = range(1, len(res_df) + 1)
+    return res_df
+
+
+def features_and_return_to_table(t_ans: dict[str, np.ndarray], trade_dates: list[str] | None,
+                                 instrument: str, contracts: list[str]) -> pd.DataFrame:
+    """
+
+    :param t_ans: output of cal_features_and_return_tensor
+    :param trade_dates: trade date of each day in t_ans, if None column "trade_date" is not included
+    :param instrument:
+    :param contracts: contract of each day in t_ans
+    :return: one row for each day and tid, columns are the same as the output of
+             cal_features_and_return_one_day, with "trade_date" ahead if provided
+    """
+    d, tn = t_ans["timestamp"].shape
+    res = {} if trade_dates is None else {"trade_date": np.repeat(trade_dates, tn)}
+    res.update({
+        "instrument": instrument,
+        "contract": np.repeat(contracts, tn),
+        "tid": np.tile(["T{:02d}".format(t) for t in range(1, tn + 1)], d),
+    })
+    for k in ["timestamp"] + ["alpha{:02d}".format(_) for _ in range(21)] + ["rtm"]:
+        res[k] = np.repeat(t_ans[k], tn) if t_ans[k].ndim == 1 else t_ans[k].reshape(-1)
+    return pd.DataFrame(res)
+
+
+class CIntradayFeatures(object):
+    def __init__(self, instrument: str, contract: str, contract_multiplier: int,
+                 pre_settle: float, pre_spot_close: float,
+                 sub_win_width: int = 30, tot_bar_num: int = 240,
+                 amount_scale: float = 1e4, ret_scale: int = 100):
+        """
+        streaming version of cal_features_and_return_one_day for one instrument and one day.
+        Minute bars are fed one at a time by update, and the alphas of a tid are emitted as soon as
+        the last bar before the checkpoint is fed. Bars with the same volume are ordered by time,
+        same as cal_features_and_return_tensor.
+
+        """
+        self.m_instrument, self.m_contract = instrument, contract
+        self.m_contract_multiplier = contract_multiplier
+        self.m_pre_settle, self.m_pre_spot_close = pre_settle, pre_spot_close
+        self.m_tot_bar_num = tot_bar_num
+        self.m_amount_scale, self.m_ret_scale = amount_scale, ret_scale
+        self.m_checkpoints = {sub_win_width * t: t for t in range(1, int(tot_bar_num / sub_win_width))}
+
+        # --- bars fed so far
+        self.m_bar_num = 0
+        self.m_timestamp = np.zeros(tot_bar_num, dtype=np.int64)
+        self.m_high, self.m_low = np.full(tot_bar_num, np.nan), np.full(tot_bar_num, np.nan)
+        self.m_volume = np.full(tot_bar_num, np.nan)
+        self.m_vwap, self.m_m01_return = np.full(tot_bar_num, np.nan), np.full(tot_bar_num, np.nan)
+
+        # --- running states
+        self.m_cum_amount, self.m_cum_volume = 0.0, 0.0
+        self.m_vwap_cum = np.nan
+        self.m_ret_moments = np.zeros(4)  # count, sum of r, r**2, r**3
+        self.m_volume_order: list[tuple[float, int]] = []  # (-volume, bar index), sorted
+        self.m_this_day_open, self.m_prev_day_close = np.nan, np.nan
+
+        # --- output, t -> alphas of this tid
+        self.m_res: dict[int, dict] = {}
+
+    def update(self, bar: dict) -> dict | None:
+        """
+
+        :param bar: a minute bar with keys in m01_tensor_fields
+        :return: alphas of a tid if the bar is the last one before a checkpoint, else None
+        """
+        i = self.m_bar_num
+        if i >= self.m_tot_bar_num:
+            print("... too many bars for {} @ {}".format(self.m_contract, bar["timestamp"]))
+            print("... this program will terminate at once, please check again")
+            sys.exit()
+        if i == 0:
+            self.m_this_day_open, self.m_prev_day_close = bar["daily_open"], bar["preclose"]
+
+        amount, volume = np.float64(bar["amount"]), np.float64(bar["volume"])
+        self.m_cum_amount += amount
+        self.m_cum_volume += volume
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vwap = amount / volume / self.m_contract_multiplier * self.m_amount_scale
+            vwap_cum = self.m_cum_amount / self.m_cum_volume / self.m_contract_multiplier * self.m_amount_scale
+        prev_vwap = self.m_vwap[i - 1] if i > 0 else np.nan
+        vwap = prev_vwap if np.isnan(vwap) else vwap
+        self.m_vwap_cum = self.m_vwap_cum if np.isnan(vwap_cum) else vwap_cum
+        m01_return = (vwap / (self.m_pre_settle if np.isnan(prev_vwap) else prev_vwap) - 1) * self.m_ret_scale
+
+        self.m_timestamp[i], self.m_high[i], self.m_low[i] = bar["timestamp"], bar["high"], bar["low"]
+        self.m_volume[i], self.m_vwap[i], self.m_m01_return[i] = volume, vwap, m01_return
+        if not np.isnan(m01_return):
+            self.m_ret_moments += (1, m01_return, m01_return ** 2, m01_return ** 3)
+        bisect.insort(self.m_volume_order, (-volume, i))
+        self.m_bar_num = i + 1
+
+        if (t := self.m_checkpoints.get(self.m_bar_num)) is None:
+            return None
+        self.m_res[t] = self.cal_alphas(bar)
+        return self.m_res[t]
+
+    def cal_alphas(self, bar: dict) -> dict:
+        n = self.m_bar_num
+        norm_scale, ret_scale = np.sqrt(n), self.m_ret_scale
+        res = {
+            "tid": "T{:02d}".format(self.m_checkpoints[n]),
+            "alpha00": (self.m_pre_settle / self.m_pre_spot_close - 1) * ret_scale,
+            "alpha01": (self.m_prev_day_close / self.m_pre_settle - 1) * ret_scale,
+            "alpha02": (self.m_this_day_open / self.m_prev_day_close - 1) * ret_scale,
+            "alpha03": (self.m_vwap[n - 1] / self.m_this_day_open - 1) / norm_scale * ret_scale,
+            "alpha04": (self.m_vwap_cum / self.m_this_day_open - 1) / norm_scale * ret_scale,
+            "alpha05": (bar["daily_high"] / self.m_this_day_open - 1) / norm_scale * ret_scale,
+            "alpha06": (bar["daily_low"] / self.m_this_day_open - 1) / norm_scale * ret_scale,
+        }
+
+        # --- top volume bars
+        order = np.array([_[1] for _ in self.m_volume_order])
+        k01, k02, k05 = int(0.1 * n), int(0.2 * n), int(0.5 * n)
+        tops = np.zeros((1, 3, n), dtype=bool)
+        for j, k in enumerate((k01, k02, k05)):
+            tops[0, j, order[0:k]] = True
+        diffs = np.zeros((1, 2, n), dtype=bool)
+        diffs[0, 0, order[k01:k02]], diffs[0, 1, order[k02:k05]] = True, True
+        vwap, m01_return, volume = self.m_vwap[None, 0:n], self.m_m01_return[None, 0:n], self.m_volume[None, 0:n]
+        mean_ret = _masked_mean(m01_return, np.concatenate([tops[:, 0:1], diffs], axis=1))[0]
+        res["alpha07"], res["alpha08"], res["alpha09"] = mean_ret
+
+        subsets = np.concatenate([tops, np.ones((1, 1, n), dtype=bool)], axis=1)
+        res["alpha10"], res["alpha11"], res["alpha12"], res["alpha16"] = _masked_spearman(vwap, volume, subsets)[0]
+        res["alpha13"], res["alpha14"], res["alpha15"], res["alpha17"] = _masked_spearman(m01_return, volume, subsets)[0]
+
+        # --- chart
+        res["alpha18"], res["alpha19"] = 0, 0
+        for m_agg_width in (15, 10, 5):
+            if n >= 3 * m_agg_width:
+                agg_low = self.m_low[0:3 * m_agg_width].reshape(3, m_agg_width).min(axis=1)
+                agg_high = self.m_high[0:3 * m_agg_width].reshape(3, m_agg_width).max(axis=1)
+                res["alpha18"] = 1 if agg_low[0] < agg_low[1] < agg_low[2] else 0
+                res["alpha19"] = 1 if agg_high[0] > agg_high[1] > agg_high[2] else 0
+                break
+
+        # --- skewness
+        res["alpha20"] = float(_skew_from_moments(*self.m_ret_moments))
+        return res
+
+    def to_df(self) -> pd.DataFrame:
+        """
+
+        :return: emitted tids, same layout as the output of cal_features_and_return_one_day,
+                 "timestamp" is the one of the first bar after the checkpoint and "rtm" is known
+                 only after the last bar of the day, both are NaN before.
+        """
+        n = self.m_bar_num
+        res = []
+        for bar_num_before_t, t in self.m_checkpoints.items():
+            if t not in self.m_res:
+                continue
+            next_bar_fed = bar_num_before_t < n
+            day_end = n == self.m_tot_bar_num
+            res.append({
+                "instrument": self.m_instrument,
+                "contract": self.m_contract,
+                "tid": self.m_res[t]["tid"],
+                "timestamp": self.m_timestamp[bar_num_before_t] if next_bar_fed else np.nan,
+                **{k: self.m_res[t][k] for k in ["alpha{:02d}".format(_) for _ in range(21)]},
+                "rtm": (self.m_vwap[n - 1] / self.m_vwap[bar_num_before_t] - 1) * self.m_ret_scale if day_end else np.nan,
+            })
+        return pd.DataFrame(res, index=[t for t in self.m_checkpoints.values() if t in self.m_res])
+
+
+def replay_features_and_return_one_day(m01: pd.DataFrame,
+                                       instrument: str, contract: str, contract_multiplier: int,
+                                       pre_settle: float, pre_spot_close: float,
+                                       sub_win_width: int = 30, tot_bar_num: int = 240,
+                                       amount_scale: float = 1e4, ret_scale: int = 100) -> pd.DataFrame:
+    """
+    feed historical minute bars to CIntradayFeatures one by one, output should be
+    the same as cal_features_and_return_one_day_np
+
+    """
+    engine = CIntradayFeatures(
+        instrument=instrument, contract=contract, contract_multiplier=contract_multiplier,
+        pre_settle=pre_settle, pre_spot_close=pre_spot_close,
+        sub_win_width=sub_win_width, tot_bar_num=tot_bar_num,
+        amount_scale=amount_scale, ret_scale=ret_scale)
+    for bar in m01[list(m01_tensor_fields)].to_dict(orient="records"):
+        engine.update(bar)
+    return engine.to_df()
+
+
 def save_to_sio_obj(t_sklearn_obj, t_path: str):
     obj = sio.dumps(t_sklearn_obj)
     with open(t_path, "wb+") as f:
@@ -133,3 +556,42 @@ def read_from_sio_obj(t_path: str):
     with open(t_path, "rb") as f:
         obj = f.read()
     return sio.loads(obj, trusted=True)
+
+
+def reset_mlp_for_warm_start(t_mlp):
+    """
+    with warm_start = True, sklearn keeps early stopping records of the last fit, which
+    was judged on another window, and would restore its best weights. Weights are kept here,
+    and records are restarted, so the next fit starts from the last weights and stops on its own data.
+
+    """
+    if not hasattr(t_mlp, "coefs_"):
+        return 0
+    t_mlp.loss_curve_ = []
+    t_mlp._no_improvement_count = 0  # noqa
+    if t_mlp.early_stopping:
+        t_mlp.validation_scores_ = []
+        t_mlp.best_validation_score_ = -np.inf
+        t_mlp.best_loss_ = None
+    else:
+        t_mlp.best_loss_ = np.inf
+    return 0
+
+
+def get_train_model(model_lbl: str, warm_start: bool = False):
+    """
+
+    :param model_lbl: ["lm", "mlpr", "mlpc"]
+    :param warm_start: for mlpr and mlpc, start from the weights of the last fit, and stop early
+    :return:
+    """
+    if model_lbl == "lm":
+        return LinearRegression()
+    if model_lbl == "mlpr":
+        return MLPRegressor(hidden_layer_sizes=(5, 5), solver="adam", random_state=0, alpha=1.0, max_iter=2000,
+                            warm_start=warm_start, early_stopping=warm_start)
+    if model_lbl == "mlpc":
+        return MLPClassifier(hidden_layer_sizes=(5, 5), solver="adam", random_state=0, alpha=1.0, max_iter=2000,
+                             warm_start=warm_start, early_stopping=warm_start)
+    print("... model_lbl = {} is not supported".format(model_lbl))
+    sys.exit()
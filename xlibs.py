@@ -0,0 +1,822 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from urllib.request import pathname2url
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+from sklearn.preprocessing import StandardScaler, LabelBinarizer
+from sklearn.linear_model import LinearRegression
+from sklearn.neural_network import MLPRegressor, MLPClassifier
+from skyrim.falkreath import CTable
+from xfuns import read_from_sio_obj
+
+features_and_return_parquet_name = "features_and_return.parquet"
+predictions_parquet_name = "predictions.parquet"
+
+
+def _import_pyarrow():
+    """
+    pyarrow is needed by the parquet libs only, so it is imported when they are used
+
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("... pyarrow is not installed, it is needed by the parquet libs, like features_sink or predictions_lib_type = \"parquet\"")
+        print("... this program will terminate at once, please install it or use \"sqlite\"")
+        sys.exit()
+    return pa, ds, pq
+
+
+class CManagerLibParquet(object):
+    def __init__(self, t_lib_dir: str, t_sort_by: tuple[str, ...] = ("trade_date", "instrument", "tid")):
+        """
+        a columnar lib partitioned by month, saved as t_lib_dir/month=YYYYMM/part-0.parquet.
+        Rows must have a column "trade_date", and are sorted by t_sort_by inside each partition.
+        Readers share the interface of skyrim.falkreath.CManagerLibReader.
+
+        """
+        self.m_lib_dir = t_lib_dir
+        self.m_sort_by = list(t_sort_by)
+        self.m_buffer: list[pd.DataFrame] = []
+        self.m_buffer_month: str | None = None
+        pa, ds, _ = _import_pyarrow()
+        self.m_partitioning = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+    # --- writer
+    def append(self, t_update_df: pd.DataFrame):
+        """
+        rows are buffered and a month is written once rows of a later month arrive,
+        so appending dates in ascending order writes each partition once.
+        Dates already in a partition are replaced.
+
+        """
+        for month, month_df in t_update_df.groupby(t_update_df["trade_date"].str.slice(0, 6)):
+            if month != self.m_buffer_month:
+                self.flush()
+                self.m_buffer_month = month
+            self.m_buffer.append(month_df)
+        return 0
+
+    def flush(self):
+        if self.m_buffer_month is None:
+            return 0
+        month_df = pd.concat(self.m_buffer, axis=0, ignore_index=True)
+        month_dir = os.path.join(self.m_lib_dir, "month={}".format(self.m_buffer_month))
+        month_path = os.path.join(month_dir, "part-0.parquet")
+        if os.path.exists(month_path):
+            exist_df = pd.read_parquet(month_path)
+            exist_df = exist_df.loc[~exist_df["trade_date"].isin(month_df["trade_date"])]
+            month_df = pd.concat([exist_df, month_df], axis=0, ignore_index=True)
+        month_df = month_df.sort_values(by=self.m_sort_by, ignore_index=True)
+        os.makedirs(month_dir, exist_ok=True)
+        pa, _, pq = _import_pyarrow()
+        # readers may scan the lib while it is written, files starting with "_" are ignored by them
+        pq.write_table(pa.Table.from_pandas(month_df, preserve_index=False), tmp_path := os.path.join(month_dir, "_part-0.parquet"))
+        os.replace(tmp_path, month_path)
+        self.m_buffer, self.m_buffer_month = [], None
+        return 0
+
+    # --- reader
+    def read_by_conditions(self, t_conditions: list[tuple], t_value_columns: list[str]) -> pd.DataFrame:
+        """
+
+        :param t_conditions: like [("instrument", "=", "IC.CFE"), ("trade_date", ">=", "20180101")],
+                             conditions on trade_date are also used to skip months
+        :param t_value_columns:
+        :return:
+        """
+        if not os.path.exists(self.m_lib_dir):
+            return pd.DataFrame(columns=t_value_columns)
+        _, ds, _ = _import_pyarrow()
+        dataset = ds.dataset(self.m_lib_dir, format="parquet", partitioning=self.m_partitioning)
+        filter_expr = None
+        for k, op, v in t_conditions + self._month_conditions(t_conditions):
+            field = ds.field(k)
+            expr = {
+                "=": field == v, "==": field == v, "!=": field != v,
+                ">": field > v, ">=": field >= v, "<": field < v, "<=": field <= v,
+            }[op]
+            filter_expr = expr if filter_expr is None else (filter_expr & expr)
+        return dataset.to_table(columns=t_value_columns, filter=filter_expr).to_pandas()
+
+    def read(self, t_value_columns: list[str]) -> pd.DataFrame:
+        return self.read_by_conditions(t_conditions=[], t_value_columns=t_value_columns)
+
+    def read_array_by_conditions(self, t_conditions: list[tuple], t_value_columns: list[str]) -> np.ndarray:
+        src_df = self.read_by_conditions(t_conditions=t_conditions, t_value_columns=t_value_columns)
+        return src_df.to_numpy(dtype=np.float64)
+
+    @staticmethod
+    def _month_conditions(t_conditions: list[tuple]) -> list[tuple]:
+        month_ops = {">": ">=", ">=": ">=", "<": "<=", "<=": "<=", "=": "=", "==": "="}
+        return [("month", month_ops[op], v[0:6]) for k, op, v in t_conditions if k == "trade_date" and op in month_ops]
+
+    def close(self):
+        return self.flush()
+
+
+class CManagerLibReaderMmap(object):
+    def __init__(self, t_db_save_dir: str, t_db_name: str, t_mmap_size: int = 2 ** 30,
+                 t_order_by: tuple[str, ...] = ()):
+        """
+        a read-only reader of sqlite3, with the same interface as skyrim.falkreath.CManagerLibReader,
+        pages are read through mmap, up to t_mmap_size bytes.
+        If t_order_by is provided, rows are returned in this order whichever index is used by sqlite.
+
+        """
+        db_path = os.path.join(t_db_save_dir, t_db_name)
+        self.m_connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(db_path)), uri=True)
+        self.m_cursor = self.m_connection.cursor()
+        self.m_cursor.execute("PRAGMA mmap_size = {}".format(t_mmap_size))
+        self.m_default_table_name = ""
+        self.m_order_by = list(t_order_by)
+
+    def set_default(self, t_default_table_name: str):
+        self.m_default_table_name = t_default_table_name
+        return 0
+
+    def _select(self, t_conditions: list[tuple], t_value_columns: list[str]) -> list[tuple]:
+        sql = "SELECT {} FROM {}".format(", ".join(t_value_columns), self.m_default_table_name)
+        if t_conditions:
+            sql += " WHERE " + " AND ".join(["{} {} ?".format(k, op) for k, op, _ in t_conditions])
+        if self.m_order_by:
+            sql += " ORDER BY " + ", ".join(self.m_order_by)
+        return self.m_cursor.execute(sql, [v for _, _, v in t_conditions]).fetchall()
+
+    def read_by_conditions(self, t_conditions: list[tuple], t_value_columns: list[str]) -> pd.DataFrame:
+        return pd.DataFrame(self._select(t_conditions, t_value_columns), columns=t_value_columns)
+
+    def read(self, t_value_columns: list[str]) -> pd.DataFrame:
+        return self.read_by_conditions(t_conditions=[], t_value_columns=t_value_columns)
+
+    def read_array_by_conditions(self, t_conditions: list[tuple], t_value_columns: list[str]) -> np.ndarray:
+        """
+
+        :param t_conditions: like [("instrument", "=", "IC.CFE"), ("trade_date", ">=", "20180101")]
+        :param t_value_columns: numeric columns only, like x_lbls + y_lbls
+        :return: a float64 array with shape (rows, len(t_value_columns)), NULL is nan
+        """
+        rows = self._select(t_conditions, t_value_columns)
+        return np.array(rows, dtype=np.float64).reshape(len(rows), len(t_value_columns))
+
+    def close(self):
+        self.m_connection.close()
+        return 0
+
+
+def get_features_and_return_lib(features_and_return_dir: str, sqlite3_tables: dict, lib_type: str = "sqlite"):
+    """
+
+    :param features_and_return_dir:
+    :param sqlite3_tables:
+    :param lib_type: "sqlite" for features_and_return.db made by dp_01,
+                     "parquet" for features_and_return.parquet made by dp_00 with sink = "parquet"
+    :return: a reader with read_by_conditions, read_array_by_conditions and close
+    """
+    if lib_type == "parquet":
+        return CManagerLibParquet(t_lib_dir=os.path.join(features_and_return_dir, features_and_return_parquet_name))
+    features_and_return_lib = CManagerLibReaderMmap(
+        t_db_save_dir=features_and_return_dir,
+        t_db_name="features_and_return.db",
+        t_order_by=("trade_date", "instrument", "tid"),
+    )
+    features_and_return_db_stru = sqlite3_tables["features_and_return"]
+    features_and_return_tab = CTable(t_table_struct=features_and_return_db_stru)
+    features_and_return_lib.set_default(features_and_return_tab.m_table_name)
+    return features_and_return_lib
+
+
+class CPredictionsStore(object):
+    m_columns = ["model_lbl", "instrument_grp", "tid_grp", "tmw", "trade_date", "instrument", "tid", "rtm", "pred"]
+    m_keys = ["model_lbl", "instrument_grp", "tid_grp", "tmw", "trade_date", "instrument", "tid"]
+
+    def __init__(self, t_lib_dir: str, t_flush_rows: int = 1000000):
+        """
+        predictions of all models and groups in one lib, partitioned by model and month of trade_date,
+        saved as t_lib_dir/model_lbl=lm/month=YYYYMM/{time_ns}-{pid}.parquet. Each writer adds its own files,
+        so many processes can append at the same time. Rows of a key written later replace earlier ones
+        when read, and compact merges files of a partition into one, which is done by the parent after writers.
+        instrument_grp and tid_grp are "" for pooled groups.
+
+        """
+        self.m_lib_dir = t_lib_dir
+        self.m_flush_rows = t_flush_rows
+        self.m_buffer: list[pd.DataFrame] = []
+        self.m_buffer_rows = 0
+        pa, ds, _ = _import_pyarrow()
+        self.m_partitioning = ds.partitioning(pa.schema([("model_lbl", pa.string()), ("month", pa.string())]), flavor="hive")
+
+    # --- writer
+    def append(self, t_model_lbl: str, t_instrument: str | None, t_tid: str | None, t_trn_win: int, t_pred_df: pd.DataFrame):
+        """
+
+        :param t_model_lbl:
+        :param t_instrument: instrument of the group, None for pooled groups
+        :param t_tid: tid of the group, None for pooled groups
+        :param t_trn_win:
+        :param t_pred_df: with columns trade_date, instrument, tid, rtm and pred
+        :return:
+        """
+        self.m_buffer.append(pd.DataFrame({
+            "model_lbl": t_model_lbl,
+            "instrument_grp": t_instrument if t_instrument else "",
+            "tid_grp": t_tid if t_tid else "",
+            "tmw": np.int32(t_trn_win),
+            "trade_date": t_pred_df["trade_date"].to_numpy(),
+            "instrument": t_pred_df["instrument"].to_numpy(),
+            "tid": t_pred_df["tid"].to_numpy(),
+            "rtm": t_pred_df["rtm"].to_numpy(dtype=np.float64),
+            "pred": t_pred_df["pred"].to_numpy(dtype=np.float64),
+        }))
+        self.m_buffer_rows += len(t_pred_df)
+        if self.m_buffer_rows >= self.m_flush_rows:
+            self.flush()
+        return 0
+
+    def flush(self):
+        if not self.m_buffer:
+            return 0
+        update_df = pd.concat(self.m_buffer, axis=0, ignore_index=True)
+        update_df["updated"] = np.int64(time.time_ns())
+        file_name = "{:020d}-{}.parquet".format(time.time_ns(), os.getpid())
+        for (model_lbl, month), part_df in update_df.groupby([update_df["model_lbl"], update_df["trade_date"].str.slice(0, 6)]):
+            self._write_partition(model_lbl, month, part_df.drop(columns="model_lbl"), file_name)
+        self.m_buffer, self.m_buffer_rows = [], 0
+        return 0
+
+    def _write_partition(self, t_model_lbl: str, t_month: str, t_part_df: pd.DataFrame, t_file_name: str):
+        part_dir = os.path.join(self.m_lib_dir, "model_lbl={}".format(t_model_lbl), "month={}".format(t_month))
+        os.makedirs(part_dir, exist_ok=True)
+        pa, _, pq = _import_pyarrow()
+        # readers may scan the lib while it is written, files starting with "_" are ignored by them
+        pq.write_table(pa.Table.from_pandas(t_part_df, preserve_index=False), tmp_path := os.path.join(part_dir, "_" + t_file_name))
+        os.replace(tmp_path, os.path.join(part_dir, t_file_name))
+        return 0
+
+    def compact(self):
+        """
+        files of a partition are merged into one, rows of a key written later are kept.
+        Do not run it while other processes are appending.
+
+        """
+        if not os.path.exists(self.m_lib_dir):
+            return 0
+        for model_dir in sorted(os.listdir(self.m_lib_dir)):
+            for month_dir in sorted(os.listdir(os.path.join(self.m_lib_dir, model_dir))):
+                part_dir = os.path.join(self.m_lib_dir, model_dir, month_dir)
+                part_files = sorted(_ for _ in os.listdir(part_dir) if not _.startswith("_"))
+                if len(part_files) <= 1:
+                    continue
+                part_df = pd.concat([pd.read_parquet(os.path.join(part_dir, _)) for _ in part_files], axis=0, ignore_index=True)
+                part_df = self._drop_replaced(part_df, self.m_keys[1:])
+                self._write_partition(model_dir.split("=")[1], month_dir.split("=")[1], part_df, part_files[-1])
+                for part_file in part_files[:-1]:
+                    os.remove(os.path.join(part_dir, part_file))
+        return 0
+
+    @staticmethod
+    def _drop_replaced(t_df: pd.DataFrame, t_keys: list[str]) -> pd.DataFrame:
+        if t_df.duplicated(subset=t_keys).any():
+            t_df = t_df.sort_values(by="updated", kind="stable").drop_duplicates(subset=t_keys, keep="last")
+        return t_df.sort_values(by=t_keys, ignore_index=True)
+
+    # --- reader
+    def read(self, t_value_columns: list[str], t_model_lbls: list[str] | None = None, t_bgn_date: str | None = None) -> pd.DataFrame:
+        """
+
+        :param t_value_columns: a part of m_columns, only these columns and keys are read
+        :param t_model_lbls: if provided, only partitions of these models are read
+        :param t_bgn_date: if provided, only rows with trade_date >= t_bgn_date are read, and earlier months are skipped
+        :return: rows sorted by m_keys
+        """
+        if not os.path.exists(self.m_lib_dir):
+            return pd.DataFrame(columns=t_value_columns)
+        _, ds, _ = _import_pyarrow()
+        dataset = ds.dataset(self.m_lib_dir, format="parquet", partitioning=self.m_partitioning)
+        filter_expr = None if t_model_lbls is None else ds.field("model_lbl").isin(t_model_lbls)
+        if t_bgn_date is not None:
+            date_expr = (ds.field("month") >= t_bgn_date[0:6]) & (ds.field("trade_date") >= t_bgn_date)
+            filter_expr = date_expr if filter_expr is None else (filter_expr & date_expr)
+        read_columns = list(dict.fromkeys(self.m_keys + t_value_columns + ["updated"]))
+        src_df = self._drop_replaced(dataset.to_table(columns=read_columns, filter=filter_expr).to_pandas(), self.m_keys)
+        return src_df[t_value_columns]
+
+    def close(self):
+        return self.flush()
+
+
+def get_predictions_store(predictions_dir: str) -> CPredictionsStore:
+    return CPredictionsStore(t_lib_dir=os.path.join(predictions_dir, predictions_parquet_name))
+
+
+class CFeaturesPanel(object):
+    m_header_columns = ("trade_date", "instrument", "contract", "tid", "timestamp")
+
+    def __init__(self, t_spec: dict, t_shms: dict[str, shared_memory.SharedMemory] | None = None):
+        """
+        a features panel in shared memory, made by CFeaturesPanel.from_lib in the parent process,
+        and passed to workers as an argument of mp.Process, so all workers read one copy of data.
+        Rows are sorted by (instrument, tid, trade_date), so rows of an instrument and a tid are
+        a zero-copy slice. Rows of a pooled group (instrument or tid is None) are gathered by
+        a precomputed order, sorted by (trade_date, instrument, tid).
+        Readers share the interface of skyrim.falkreath.CManagerLibReader.
+
+        """
+        self.m_spec = t_spec
+        self.m_value_columns: list[str] = t_spec["value_columns"]
+        self.m_categories: dict[str, np.ndarray] = {k: np.array(v) for k, v in t_spec["categories"].items()}
+        self.m_groups: dict[tuple, tuple[str, int, int]] = t_spec["groups"]
+        self.m_is_owner = t_shms is not None
+        self.m_shms: dict[str, shared_memory.SharedMemory] = {} if t_shms is None else t_shms
+        self.m_arrays: dict[str, np.ndarray] = {}
+        for array_name, (shm_name, shape, dtype) in t_spec["arrays"].items():
+            if array_name not in self.m_shms:
+                self.m_shms[array_name] = shared_memory.SharedMemory(name=shm_name)
+            self.m_arrays[array_name] = np.ndarray(shape, dtype=dtype, buffer=self.m_shms[array_name].buf)
+            self.m_arrays[array_name].flags.writeable = False
+
+    def __getstate__(self):
+        return self.m_spec
+
+    def __setstate__(self, state):
+        # with the "spawn" start method, workers attach to the shared memory by names instead of copying arrays
+        self.__init__(state)
+
+    @staticmethod
+    def from_lib(t_lib, t_value_columns: list[str]) -> "CFeaturesPanel":
+        """
+
+        :param t_lib: any reader with read, like the output of get_features_and_return_lib
+        :param t_value_columns: numeric columns, like x_lbls + y_lbls
+        :return: a panel owning the shared memory, which must be released by unlink
+        """
+        src_df = t_lib.read(t_value_columns=list(CFeaturesPanel.m_header_columns) + t_value_columns)
+        codes, categories = {}, {}
+        for k in ("instrument", "tid", "contract"):
+            codes[k], categories[k] = pd.factorize(src_df[k], sort=True)
+        trade_date = src_df["trade_date"].astype(np.int32).to_numpy()
+
+        # --- direct groups, sorted by (instrument, tid, trade_date)
+        srt = np.lexsort((trade_date, codes["tid"], codes["instrument"]))
+        arrays = {
+            "values": src_df[t_value_columns].to_numpy(dtype=np.float64)[srt],
+            "trade_date": trade_date[srt],
+            "instrument": codes["instrument"][srt].astype(np.int16),
+            "tid": codes["tid"][srt].astype(np.int16),
+            "contract": codes["contract"][srt].astype(np.int32),
+            "timestamp": src_df["timestamp"].to_numpy(dtype=np.int64)[srt],
+        }
+        groups = {}
+        pair = arrays["instrument"].astype(np.int64) * len(categories["tid"]) + arrays["tid"]
+        pair_values, pair_bgn = np.unique(pair, return_index=True)
+        pair_end = np.append(pair_bgn[1:], len(pair))
+        for v, lo, hi in zip(pair_values, pair_bgn, pair_end):
+            instrument, tid = categories["instrument"][v // len(categories["tid"])], categories["tid"][v % len(categories["tid"])]
+            groups[(instrument, tid)] = ("direct", int(lo), int(hi))
+
+        # --- pooled groups, sorted by (trade_date, instrument, tid)
+        pooled_srt = np.lexsort((arrays["tid"], arrays["instrument"], arrays["trade_date"]))
+        pooled_orders, lo = [], 0
+        pooled_masks = [((None, None), np.ones(len(pooled_srt), dtype=bool))]
+        pooled_masks += [((instrument, None), arrays["instrument"][pooled_srt] == i) for i, instrument in enumerate(categories["instrument"])]
+        pooled_masks += [((None, tid), arrays["tid"][pooled_srt] == i) for i, tid in enumerate(categories["tid"])]
+        for key, mask in pooled_masks:
+            pooled_orders.append(pooled_srt[mask])
+            groups[key] = ("pooled", lo, lo + int(mask.sum()))
+            lo += int(mask.sum())
+        arrays["pooled_order"] = np.concatenate(pooled_orders).astype(np.int64)
+        arrays["pooled_trade_date"] = arrays["trade_date"][arrays["pooled_order"]]
+
+        # --- copy to shared memory
+        spec = {
+            "value_columns": list(t_value_columns),
+            "categories": {k: list(v) for k, v in categories.items()},
+            "groups": groups,
+            "arrays": {},
+        }
+        shms = {}
+        for array_name, array in arrays.items():
+            shms[array_name] = shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            spec["arrays"][array_name] = (shm.name, array.shape, array.dtype.str)
+        return CFeaturesPanel(spec, shms)
+
+    def _locate(self, t_conditions: list[tuple]) -> slice | np.ndarray:
+        instrument, tid, bgn_date, end_date = None, None, 0, 99991231
+        for k, op, v in t_conditions:
+            if (k, op) in [("instrument", "="), ("instrument", "==")]:
+                instrument = v
+            elif (k, op) in [("tid", "="), ("tid", "==")]:
+                tid = v
+            elif k == "trade_date" and op in [">=", ">"]:
+                bgn_date = max(bgn_date, int(v) + (op == ">"))
+            elif k == "trade_date" and op in ["<=", "<"]:
+                end_date = min(end_date, int(v) - (op == "<"))
+            else:
+                print("... condition {} is not supported by CFeaturesPanel".format((k, op, v)))
+                sys.exit()
+
+        if (instrument, tid) not in self.m_groups:
+            return slice(0, 0)
+        group_type, lo, hi = self.m_groups[(instrument, tid)]
+        dates = self.m_arrays["trade_date" if group_type == "direct" else "pooled_trade_date"][lo:hi]
+        i0 = lo + np.searchsorted(dates, bgn_date, side="left")
+        i1 = lo + np.searchsorted(dates, end_date, side="right")
+        return slice(i0, i1) if group_type == "direct" else self.m_arrays["pooled_order"][i0:i1]
+
+    def read_array_by_conditions(self, t_conditions: list[tuple], t_value_columns: list[str]) -> np.ndarray:
+        """
+
+        :param t_conditions: "=" on instrument and tid, and a range of trade_date
+        :param t_value_columns: value columns of the panel, if they are adjacent in the panel,
+                                and the group is not pooled, a read-only view is returned
+        :return:
+        """
+        rows = self._locate(t_conditions)
+        col_idx = [self.m_value_columns.index(_) for _ in t_value_columns]
+        if col_idx == list(range(col_idx[0], col_idx[0] + len(col_idx))):
+            return self.m_arrays["values"][rows, col_idx[0]:col_idx[0] + len(col_idx)]
+        return self.m_arrays["values"][rows][:, col_idx]
+
+    def read_by_conditions(self, t_conditions: list[tuple], t_value_columns: list[str]) -> pd.DataFrame:
+        rows = self._locate(t_conditions)
+        res = {}
+        for k in t_value_columns:
+            if k in self.m_value_columns:
+                res[k] = self.m_arrays["values"][rows, self.m_value_columns.index(k)]
+            elif k == "trade_date":
+                res[k] = self.m_arrays["trade_date"][rows].astype(str)
+            elif k in self.m_categories:
+                res[k] = self.m_categories[k][self.m_arrays[k][rows]]
+            else:
+                res[k] = self.m_arrays[k][rows]
+        return pd.DataFrame(res)
+
+    def read(self, t_value_columns: list[str]) -> pd.DataFrame:
+        return self.read_by_conditions(t_conditions=[], t_value_columns=t_value_columns)
+
+    def close(self):
+        # workers keep the panel for all groups, memory is released by the owner with unlink
+        return 0
+
+    def unlink(self):
+        self.m_arrays.clear()
+        for shm in self.m_shms.values():
+            shm.close()
+            if self.m_is_owner:
+                shm.unlink()
+        self.m_shms.clear()
+        return 0
+
+
+class CModelStore(object):
+    m_magic = b"MDLSTORE"
+    m_align = 64
+    m_classes = {_.__name__: _ for _ in (StandardScaler, LinearRegression, MLPRegressor, MLPClassifier)}
+
+    def __init__(self, t_models_dir: str):
+        """
+        scalers and models of a month in one file, saved as models_dir/YYYY/YYYYMM/YYYYMM.models,
+        made by pack_month from the skops files of the month. The file is
+        MAGIC + len of index + json index + arrays aligned to 64 bytes, and arrays are read
+        through one memmap per month, so an artifact is fetched without reading or unpickling a file.
+        The index keeps fitted attributes (ending with "_") and params of each artifact, which is enough
+        to predict. Private states like the optimizer of MLP are not kept, so warm start still needs skops files.
+
+        """
+        self.m_models_dir = t_models_dir
+        self.m_months: dict[str, tuple[dict, np.memmap, float] | None] = {}
+
+    def get_store_path(self, t_month: str) -> str:
+        return os.path.join(self.m_models_dir, t_month[0:4], t_month, "{}.models".format(t_month))
+
+    # --- writer
+    def pack_month(self, t_month: str, t_remove_files: bool = False) -> int:
+        """
+
+        :param t_month: format = [YYYYMM], all skops files of this month are packed
+        :param t_remove_files: remove skops files after packing, to save inodes.
+                               Keep them if warm start or the manifest of the dag is used.
+        :return: number of artifacts in the store
+        """
+        model_month_dir = os.path.dirname(store_path := self.get_store_path(t_month))
+        if not os.path.exists(model_month_dir):
+            return 0
+        artifact_files = sorted(_ for _ in os.listdir(model_month_dir) if not _.startswith(t_month))
+        # artifacts packed before, whose files are removed, are kept
+        packed_files = [] if (month_store := self._load_month(t_month)) is None else sorted(set(month_store[0]) - set(artifact_files))
+        index, chunks, offset = {}, [], 0
+        for artifact_file in sorted(artifact_files + packed_files):
+            if artifact_file in packed_files:
+                obj = self.get(t_month, artifact_file)
+            else:
+                obj = read_from_sio_obj(os.path.join(model_month_dir, artifact_file))
+            entry = {"class": type(obj).__name__, "params": obj.get_params(), "attrs": {}, "arrays": {}}
+            for k, v in vars(obj).items():
+                if k.startswith("_") or not k.endswith("_"):
+                    continue
+                if isinstance(v, list) and v and all(isinstance(_, np.ndarray) for _ in v):
+                    arrays = {"{}/{}".format(k, i): _ for i, _ in enumerate(v)}
+                    entry["attrs"][k] = {"list": len(v)}
+                elif isinstance(v, np.ndarray) and v.dtype != object:
+                    arrays = {k: v}
+                else:
+                    arrays = {}
+                    entry["attrs"][k] = v.tolist() if isinstance(v, (np.ndarray, np.generic)) else v
+                for array_name, array in arrays.items():
+                    array = np.ascontiguousarray(array)
+                    entry["arrays"][array_name] = (offset, array.dtype.str, array.shape)
+                    chunks.append(array.tobytes() + b"\0" * (-array.nbytes % self.m_align))
+                    offset += len(chunks[-1])
+            index[artifact_file] = entry
+        index_bytes = json.dumps(index).encode("utf-8")
+        index_bytes += b" " * (-(len(self.m_magic) + 8 + len(index_bytes)) % self.m_align)
+        with open(tmp_path := store_path + ".tmp", "wb") as f:
+            f.write(self.m_magic + np.uint64(len(index_bytes)).tobytes() + index_bytes)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, store_path)
+        self.m_months.pop(t_month, None)
+        if t_remove_files:
+            for artifact_file in artifact_files:
+                os.remove(os.path.join(model_month_dir, artifact_file))
+        return len(index)
+
+    # --- reader
+    def _load_month(self, t_month: str) -> tuple[dict, np.memmap, float] | None:
+        if t_month not in self.m_months:
+            if not os.path.exists(store_path := self.get_store_path(t_month)):
+                self.m_months[t_month] = None
+            else:
+                with open(store_path, "rb") as f:
+                    if f.read(len(self.m_magic)) != self.m_magic:
+                        print("... {} is not a model store".format(store_path))
+                        sys.exit()
+                    index_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+                    index = json.loads(f.read(index_len))
+                data_offset = len(self.m_magic) + 8 + index_len
+                data = np.memmap(store_path, dtype=np.uint8, mode="r", offset=data_offset) if os.path.getsize(store_path) > data_offset else None
+                self.m_months[t_month] = (index, data, os.path.getmtime(store_path))
+        return self.m_months[t_month]
+
+    def get_arrays(self, t_month: str, t_artifact_file: str) -> dict[str, np.ndarray] | None:
+        """
+
+        :param t_month: format = [YYYYMM]
+        :param t_artifact_file: like "M-IC.CFE-T01-TMW06-202301.scl" or "M-IC.CFE-T01-TMW06-202301.mlpr"
+        :return: read-only views of arrays, like {"mean_", "scale_"} of a scaler, {"coef_"} of lm,
+                 {"coefs_/0", "coefs_/1", ..., "intercepts_/0", ...} of mlp, None if not in the store
+        """
+        if (month_store := self._load_month(t_month)) is None or t_artifact_file not in month_store[0]:
+            return None
+        entry, data = month_store[0][t_artifact_file], month_store[1]
+        return {k: np.ndarray(tuple(shape), dtype=dtype, buffer=data, offset=offset)
+                for k, (offset, dtype, shape) in entry["arrays"].items()}
+
+    def get(self, t_month: str, t_artifact_file: str):
+        """
+
+        :return: the sklearn object rebuilt from the store, None if not in the store
+        """
+        if (arrays := self.get_arrays(t_month, t_artifact_file)) is None:
+            return None
+        entry = self.m_months[t_month][0][t_artifact_file]
+        obj = self.m_classes[entry["class"]](**entry["params"])
+        for k, v in entry["attrs"].items():
+            if isinstance(v, dict) and "list" in v:
+                v = [arrays["{}/{}".format(k, i)] for i in range(v["list"])]
+            elif isinstance(v, list):
+                v = np.array(v, dtype=object) if k == "feature_names_in_" else v
+            setattr(obj, k, v)
+        for k, v in arrays.items():
+            if "/" not in k:
+                setattr(obj, k, v)
+        if isinstance(obj, MLPClassifier):
+            obj._label_binarizer = LabelBinarizer().fit(obj.classes_)
+        return obj
+
+    def read(self, t_month: str, t_artifact_file: str):
+        """
+        read an artifact from the store, or from its skops file if it is not packed,
+        or if the file is newer than the store, like a model retrained after packing.
+
+        """
+        artifact_path = os.path.join(self.m_models_dir, t_month[0:4], t_month, t_artifact_file)
+        month_store = self._load_month(t_month)
+        if month_store is None or (os.path.exists(artifact_path) and os.path.getmtime(artifact_path) > month_store[2]):
+            return read_from_sio_obj(artifact_path)
+        if (obj := self.get(t_month, t_artifact_file)) is None:
+            return read_from_sio_obj(artifact_path)
+        return obj
+
+
+class CStackedModels(object):
+    m_activations = {
+        "identity": lambda z: z,
+        "relu": lambda z: np.maximum(z, 0, out=z),
+        "tanh": lambda z: np.tanh(z, out=z),
+        "logistic": lambda z: expit(z, out=z),
+    }
+
+    def __init__(self, t_grp_ids: list[str], t_arrays: dict[str, np.ndarray], t_asked_grp_ids: list[str] | None = None):
+        """
+        scalers and models of groups of a month, stacked along the first axis, so all groups
+        are scored by a few batched matrix multiplies instead of a predict of sklearn for each model.
+        Arrays are "scl/mean" and "scl/scale" of shape (G, F), and for each model_lbl with a mask "{model_lbl}/has" of (G,),
+        "lm/coef" of (G, F, 1) and "lm/intercept" of (G, 1), or "{model_lbl}/coefs/{i}" of (G, fan_in, fan_out),
+        "{model_lbl}/intercepts/{i}" of (G, fan_out) and "{model_lbl}/activation" = [hidden, out] for mlp,
+        and "mlpc/classes" of (G, 2). Models missing in a group are zeros, and their predictions are NaN.
+
+        :param t_asked_grp_ids: groups asked when stacking, including the ones skipped for not having a scaler
+        """
+        self.m_grp_ids = list(t_grp_ids)
+        self.m_asked_grp_ids = list(t_grp_ids) if t_asked_grp_ids is None else list(t_asked_grp_ids)
+        self.m_arrays = t_arrays
+        self.m_model_lbls = [k[:-len("/has")] for k in t_arrays if k.endswith("/has")]
+
+    @staticmethod
+    def get_path(t_models_dir: str, t_month: str) -> str:
+        return os.path.join(t_models_dir, t_month[0:4], t_month, "{}.stacked.npz".format(t_month))
+
+    @staticmethod
+    def from_store(t_model_store: CModelStore, t_month: str, t_grp_ids: list[str], t_model_lbls: list[str]):
+        """
+
+        :param t_model_store: scalers and models are read by it, from the store or skops files
+        :param t_month: format = [YYYYMM], train end month
+        :param t_grp_ids: like ["M-IC.CFE-T01-TMW06", ...], groups without a scaler are skipped
+        :param t_model_lbls: ["lm", "mlpr", "mlpc"]
+        :return:
+        """
+        grp_ids, scalers, models = [], [], {_: [] for _ in t_model_lbls}
+        for model_grp_id in t_grp_ids:
+            try:
+                scaler = t_model_store.read(t_month, "{}-{}.scl".format(model_grp_id, t_month))
+            except FileNotFoundError:
+                continue
+            grp_ids.append(model_grp_id)
+            scalers.append(scaler)
+            for model_lbl in t_model_lbls:
+                try:
+                    models[model_lbl].append(t_model_store.read(t_month, "{}-{}.{}".format(model_grp_id, t_month, model_lbl)))
+                except FileNotFoundError:
+                    models[model_lbl].append(None)
+
+        arrays = {
+            "scl/mean": np.array([_.mean_ for _ in scalers], dtype=np.float64).reshape(len(grp_ids), -1),
+            "scl/scale": np.array([_.scale_ for _ in scalers], dtype=np.float64).reshape(len(grp_ids), -1),
+        }
+        x_num = arrays["scl/mean"].shape[1]
+        for model_lbl, grp_models in models.items():
+            has = np.array([_ is not None for _ in grp_models], dtype=bool)
+            fitted = [_ for _ in grp_models if _ is not None]
+            arrays[model_lbl + "/has"] = has
+            if len(fitted) == 0:
+                continue
+            if isinstance(fitted[0], LinearRegression):
+                arrays["lm/coef"] = np.zeros((len(grp_ids), x_num, 1))
+                arrays["lm/intercept"] = np.zeros((len(grp_ids), 1))
+                arrays["lm/coef"][has, :, 0] = [np.ravel(_.coef_) for _ in fitted]
+                arrays["lm/intercept"][has, 0] = [np.ravel(_.intercept_)[0] for _ in fitted]
+                continue
+
+            # --- mlp, all groups must have the same layers
+            layers = [[_.shape for _ in m.coefs_] for m in fitted]
+            activation = [fitted[0].activation, fitted[0].out_activation_]
+            if any(_ != layers[0] for _ in layers) or any([m.activation, m.out_activation_] != activation for m in fitted):
+                print("... {} models @ {} do not have the same layers, they could not be stacked".format(model_lbl, t_month))
+                print("... this program will terminate at once, please check again")
+                sys.exit()
+            for i, (fan_in, fan_out) in enumerate(layers[0]):
+                arrays["{}/coefs/{}".format(model_lbl, i)] = np.zeros((len(grp_ids), fan_in, fan_out))
+                arrays["{}/intercepts/{}".format(model_lbl, i)] = np.zeros((len(grp_ids), fan_out))
+                arrays["{}/coefs/{}".format(model_lbl, i)][has] = [m.coefs_[i] for m in fitted]
+                arrays["{}/intercepts/{}".format(model_lbl, i)][has] = [m.intercepts_[i] for m in fitted]
+            arrays[model_lbl + "/activation"] = np.array(activation)
+            if isinstance(fitted[0], MLPClassifier):
+                if any(len(m.classes_) != 2 for m in fitted):
+                    print("... {} models @ {} are not binary classifiers, they could not be stacked".format(model_lbl, t_month))
+                    print("... this program will terminate at once, please check again")
+                    sys.exit()
+                arrays[model_lbl + "/classes"] = np.zeros((len(grp_ids), 2))
+                arrays[model_lbl + "/classes"][has] = [m.classes_ for m in fitted]
+        return CStackedModels(grp_ids, arrays, t_grp_ids)
+
+    def save(self, t_path: str):
+        with open(tmp_path := t_path + ".tmp", "wb") as f:
+            np.savez(f, grp_ids=np.array(self.m_grp_ids, dtype=str), asked_grp_ids=np.array(self.m_asked_grp_ids, dtype=str),
+                     **self.m_arrays)
+        os.replace(tmp_path, t_path)
+        return 0
+
+    @staticmethod
+    def load(t_path: str):
+        with np.load(t_path, allow_pickle=False) as npz:
+            arrays = {k: npz[k] for k in npz.files}
+        return CStackedModels(arrays.pop("grp_ids").tolist(), arrays, arrays.pop("asked_grp_ids").tolist())
+
+    def take(self, t_grp_loc: list[int] | np.ndarray):
+        """
+
+        :param t_grp_loc: locations of groups in m_grp_ids
+        :return: a CStackedModels of these groups only
+        """
+        t_grp_loc = np.asarray(t_grp_loc, dtype=int)
+        return CStackedModels(
+            [self.m_grp_ids[_] for _ in t_grp_loc],
+            {k: v if k.endswith("/activation") else v[t_grp_loc] for k, v in self.m_arrays.items()},
+            [self.m_grp_ids[_] for _ in t_grp_loc])
+
+    def forward(self, t_x: np.ndarray) -> dict[str, np.ndarray]:
+        """
+        same arithmetic as transform of StandardScaler and predict of sklearn, layer by layer
+
+        :param t_x: raw features of shape (n, F) for all groups, or (G, n, F) for each group
+        :return: {model_lbl: predictions of shape (G, n)}, NaN if the group does not have the model
+        """
+        a = self.m_arrays
+        x = np.nan_to_num((t_x - a["scl/mean"][:, None, :]) / a["scl/scale"][:, None, :], nan=0)
+        res = {}
+        for model_lbl in self.m_model_lbls:
+            if model_lbl == "lm":
+                z = np.matmul(x, a["lm/coef"])[:, :, 0] + a["lm/intercept"] if "lm/coef" in a else None
+            elif "{}/coefs/0".format(model_lbl) in a:
+                z, i = x, 0
+                hidden_activation, out_activation = (self.m_activations[_] for _ in a[model_lbl + "/activation"])
+                while (coefs := a.get("{}/coefs/{}".format(model_lbl, i))) is not None:
+                    z = np.matmul(z, coefs)
+                    z += a["{}/intercepts/{}".format(model_lbl, i)][:, None, :]
+                    i += 1
+                    z = hidden_activation(z) if "{}/coefs/{}".format(model_lbl, i) in a else out_activation(z)
+                z = z[:, :, 0]
+                if (classes := a.get(model_lbl + "/classes")) is not None:
+                    z = np.take_along_axis(classes, (z > 0.5).astype(int), axis=1)
+            else:
+                z = None
+            res[model_lbl] = np.full(x.shape[0:2], np.nan) if z is None else np.where(a[model_lbl + "/has"][:, None], z, np.nan)
+        return res
+
+
+def get_stacked_models(models_dir: str, train_end_month: str, grp_ids: list[str], model_lbls: list[str],
+                       model_store: CModelStore | None = None) -> CStackedModels:
+    """
+    load the file made by CStackedModels.save if it was stacked with all groups and models asked,
+    and is newer than the artifacts of the month, else stack them from the model store
+
+    :return: stacked models of groups in grp_ids with a scaler, in the order of grp_ids
+    """
+    stacked_path = CStackedModels.get_path(models_dir, train_end_month)
+    if os.path.exists(stacked_path):
+        model_month_dir = os.path.dirname(stacked_path)
+        stacked_mtime = os.path.getmtime(stacked_path)
+        if all(os.path.getmtime(os.path.join(model_month_dir, _)) <= stacked_mtime for _ in os.listdir(model_month_dir)):
+            stacked = CStackedModels.load(stacked_path)
+            grp_loc = {grp_id: k for k, grp_id in enumerate(stacked.m_grp_ids)}
+            if set(model_lbls) <= set(stacked.m_model_lbls) and set(grp_ids) <= set(stacked.m_asked_grp_ids):
+                return stacked.take([grp_loc[_] for _ in grp_ids if _ in grp_loc])
+    return CStackedModels.from_store(
+        model_store if model_store is not None else CModelStore(models_dir), train_end_month, grp_ids, model_lbls)
+
+
+class CLruCache(object):
+    def __init__(self, t_max_size: int):
+        """
+        a size bounded cache of a process, the least recently used item is evicted when it is full.
+        Hits and misses are counted, to be reported at the end of a run.
+
+        """
+        self.m_max_size = t_max_size
+        self.m_items: OrderedDict = OrderedDict()
+        self.m_hits, self.m_misses = 0, 0
+
+    def get(self, t_key, t_load_fun):
+        """
+
+        :param t_key: any hashable, like (model_grp_id, train_end_month)
+        :param t_load_fun: called without arguments if t_key is missed, its return is cached,
+                           and nothing is cached if it raises or returns None, like a missing artifact,
+                           so it is loaded again once it is made
+        :return:
+        """
+        if t_key in self.m_items:
+            self.m_hits += 1
+            self.m_items.move_to_end(t_key)
+            return self.m_items[t_key]
+        self.m_misses += 1
+        if (value := t_load_fun()) is None:
+            return None
+        self.m_items[t_key] = value
+        if len(self.m_items) > self.m_max_size:
+            self.m_items.popitem(last=False)
+        return value
+
+    def info(self) -> str:
+        return "hits = {}, misses = {}, size = {}/{}".format(self.m_hits, self.m_misses, len(self.m_items), self.m_max_size)
@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+import inspect
+import datetime as dt
+
+
+def cal_inputs_hash(inputs: dict) -> str:
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cal_code_version(*funs) -> str:
+    """
+
+    :param funs: functions which make an artifact, their source code is hashed,
+                 so editing other functions in the same module does not make artifacts stale
+    :return:
+    """
+    return hashlib.sha1("".join(inspect.getsource(f) for f in funs).encode("utf-8")).hexdigest()
+
+
+class CManifest(object):
+    def __init__(self, t_manifest_path: str):
+        """
+        a json file of {artifact key: {"hash", "inputs", "artifact", "updated"}}, "inputs" are what the
+        artifact is made from, like data range, hashes of upstream artifacts, x_lbls, model params and code version.
+        An artifact is current if the hash of its inputs is unchanged and its file, if any, still exists.
+
+        """
+        self.m_manifest_path = t_manifest_path
+        self.m_entries: dict[str, dict] = {}
+        if os.path.exists(t_manifest_path):
+            with open(t_manifest_path, "r") as j:
+                self.m_entries = json.load(j)
+
+    def get_hash(self, t_key: str) -> str | None:
+        return self.m_entries[t_key]["hash"] if t_key in self.m_entries else None
+
+    def is_current(self, t_key: str, t_inputs: dict) -> bool:
+        if (entry := self.m_entries.get(t_key)) is None or entry["hash"] != cal_inputs_hash(t_inputs):
+            return False
+        return (entry["artifact"] == "") or os.path.exists(entry["artifact"])
+
+    def record(self, t_key: str, t_inputs: dict, t_artifact: str = ""):
+        """
+
+        :param t_key: like "train/M-IC.CFE-T01-TMW06/202301/mlpr"
+        :param t_inputs:
+        :param t_artifact: path of the artifact, checked by is_current if it exists now, "" for rows in a db
+        :return:
+        """
+        self.m_entries[t_key] = {
+            "hash": cal_inputs_hash(t_inputs),
+            "inputs": t_inputs,
+            "artifact": t_artifact if os.path.exists(t_artifact) else "",
+            "updated": dt.datetime.now().strftime("%Y%m%d %H:%M:%S"),
+        }
+        return 0
+
+    def save(self):
+        tmp_path = self.m_manifest_path + ".tmp"
+        with open(tmp_path, "w") as j:
+            json.dump(self.m_entries, j, indent=1, sort_keys=True, default=str)
+        os.replace(tmp_path, self.m_manifest_path)
+        return 0